@@ -280,13 +280,10 @@ def load_adventures_for_level(level, subset=None):
 
     all_adventures = []
     # NOTE: if we ever have ADVENTURES in the DB, adjust how the "levels" field is used.
-    if subset:
-        adventures = ADVENTURES[g.lang].get_adventures_subset(subset, keyword_lang)
-    else:
-        adventures = ADVENTURES[g.lang].get_adventures(keyword_lang)
+    adventures = ADVENTURES[g.lang].get_adventures_for_level(level, keyword_lang, subset or None)
 
     for short_name, adventure in adventures.items():
-        adventure_level = adventure['levels'].get(level, None)
+        adventure_level = adventure['levels'][level]
         if not adventure_level:
             continue
 
@@ -680,11 +677,16 @@ def parse():
 
         try:
             response['Code'] = transpile_result.code
-            source_map_result = transpile_result.source_map.get_result()
+            if body.get('source_map_format') == 'compact':
+                source_map_result = transpile_result.source_map.get_compact_result()
+                for mapping_error in source_map_result['errors']:
+                    mapping_error[1] = get_error_text(mapping_error[1], keyword_lang)
+            else:
+                source_map_result = transpile_result.source_map.get_result()
 
-            for i, mapping in source_map_result.items():
-                if mapping['error'] is not None:
-                    source_map_result[i]['error'] = get_error_text(source_map_result[i]['error'], keyword_lang)
+                for i, mapping in source_map_result.items():
+                    if mapping['error'] is not None:
+                        source_map_result[i]['error'] = get_error_text(source_map_result[i]['error'], keyword_lang)
 
             response['source_map'] = source_map_result
 
@@ -2518,9 +2520,7 @@ def normalize_public_programs(programs):
     - Add 'number_lines'
     """
     ret = []
-    for program in programs:
-        program = pre_process_explore_program(program)
-
+    for program in pre_process_explore_programs(programs):
         # There is a record somewhere that doesn't have a code field, guard against that
         code = program.get('code', '')
 
@@ -2533,17 +2533,17 @@ def normalize_public_programs(programs):
 
 
 @querylog.timed
-def pre_process_explore_program(program):
-    # If program does not have an error value set -> parse it and set value
-    if 'error' not in program:
-        try:
-            hedy.transpile(program.get('code'), program.get('level'), program.get('lang'))
-            program['error'] = False
-        except BaseException:
-            program['error'] = True
+def pre_process_explore_programs(programs):
+    # If a program does not have an error value set -> parse it and set value
+    unchecked = [program for program in programs if 'error' not in program]
+    # the web workers are processes already, so the programs are transpiled in this one
+    outcomes = hedy.transpile_many(
+        [(program.get('code'), program.get('level'), program.get('lang')) for program in unchecked], processes=1)
+    for program, (_, error) in zip(unchecked, outcomes):
+        program['error'] = error is not None
         g_db().store_program(program)
 
-    return program
+    return programs
 
 
 @app.route('/change_language', methods=['POST'])
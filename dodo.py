@@ -26,7 +26,7 @@ from glob import glob
 import sys
 import platform
 
-from doit.tools import LongRunning
+from doit.tools import LongRunning, config_changed
 
 if os.getenv('GITHUB_ACTION') and platform.system() == 'Windows':
     # Add MSYS2 to the path, so we can use commands like 'bash' and 'cp' and 'mv'.
@@ -244,6 +244,36 @@ def task_lark():
     )
 
 
+def task_parser_bundle():
+    """Precompile the Lark parsers of the commonly used languages into a bundle.
+
+    Which languages are bundled is set by env PARSER_BUNDLE_LANGUAGES, see hedy.get_parser_bundle_languages.
+
+    The bundle is indexed at server startup, so few requests have to wait for a grammar
+    to be compiled. It takes a while to build, so it is only built on Heroku (see the
+    heroku-postbuild script in package.json), not by the deploy task that CI runs.
+    """
+    script = 'build-tools/heroku/generate-parser-bundle'
+    return dict(
+        title=lambda _: 'Precompile parsers',
+        task_dep=['lark'],
+        file_dep=[
+            *glob('grammars/*.lark'),
+            *glob('content/keywords/*.yaml'),
+            'hedy.py',
+            'hedy_grammar.py',
+            'hedy_parser_bundle.py',
+            script,
+        ],
+        actions=[
+            [python3, script],
+        ],
+        targets=['parser-bundle/lark-version'],
+        # the languages to bundle can be changed with env PARSER_BUNDLE_LANGUAGES, see hedy.get_parser_bundle_languages
+        uptodate=[config_changed(os.getenv('PARSER_BUNDLE_LANGUAGES', ''))],
+    )
+
+
 def task_prefixes():
     """Generate Python prefixes for TypeScript"""
     script = 'build-tools/heroku/generate-prefixes-ts'
@@ -6,6 +6,12 @@ import inspect
 """
 
 
+def _restore_exception(cls, args):
+    exception = cls.__new__(cls)
+    exception.args = args
+    return exception
+
+
 class HedyException(Exception):
     def __init__(self, error_code, **arguments):
         """Create a new HedyException.
@@ -40,6 +46,11 @@ class HedyException(Exception):
             return [self.arguments['line_number']]
         return None
 
+    def __reduce__(self):
+        # The subclasses all have their own constructor arguments, so the default way of pickling and copying
+        # exceptions, calling the constructor again with `self.args`, does not work. Restore the attributes instead.
+        return _restore_exception, (self.__class__, self.args), self.__dict__
+
 
 class WarningException(HedyException):
     """Fixed That For You warning/exception.
@@ -173,6 +184,11 @@ class InputTooBigException(HedyException):
                          max_lines=max_lines)
 
 
+class TranspileBudgetExceededException(HedyException):
+    def __init__(self, seconds):
+        super().__init__('Too Slow', seconds=seconds)
+
+
 class InvalidCommandException(WarningException):
     def __init__(
             self,
@@ -1,6 +1,15 @@
 # This file is used to configure gunicorn,
 # used on Heroku.
 
+def on_starting(server):
+    # Index the precompiled parsers in the master process, before the workers
+    # are forked, so that all workers know them. Only import the bundle module
+    # here: importing the app would start logging threads which do not survive the fork.
+    import hedy_parser_bundle
+    count = hedy_parser_bundle.load()
+    server.log.info(f'Found {count} precompiled parsers')
+
+
 def worker_exit(server, worker):
     # When the worker is being exited (perhaps because of a timeout),
     # give the query_log handler a chance to flush to disk.
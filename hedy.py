@@ -1,20 +1,29 @@
 import textwrap
-from functools import lru_cache
+from functools import cache, lru_cache
 
 import lark
 from website.flask_helpers import gettext_with_fallback as gettext
 from lark import Lark
 from lark.exceptions import UnexpectedEOF, UnexpectedCharacters, VisitError
-from lark import Tree, Transformer, visitors, v_args
+from lark import Token, Tree, Transformer, visitors, v_args
 from os import path, getenv
 
 import hedy
 import hedy_error
 import hedy_grammar
+import hedy_parser_bundle
+import parser_cache
 import hedy_translation
+import python_emitter
+import suggestion_index
+import transpile_budget
+import transpile_cache
 from utils import atomic_write_file
 from hedy_content import ALL_KEYWORD_LANGUAGES
 from collections import namedtuple
+from python_emitter import Block
+import bisect
+import collections
 import re
 import regex
 from dataclasses import dataclass, field
@@ -22,6 +31,7 @@ import exceptions
 import program_repair
 import yaml
 import hashlib
+import multiprocessing
 import os
 import pickle
 import sys
@@ -30,7 +40,7 @@ import utils
 
 # Some useful constants
 from hedy_content import KEYWORDS
-from hedy_sourcemap import SourceMap, source_map_transformer
+from hedy_sourcemap import SourceMap, SourceRange, source_map_transformer
 
 from prefixes.music import present_in_notes_mapping
 from prefixes.normal import get_num_sys
@@ -47,9 +57,6 @@ local_keywords_enabled = True
 TRANSPILER_LOOKUP = {}
 MICROBIT_TRANSPILER_LOOKUP = {}
 
-# define source-map
-source_map = SourceMap()
-
 # builtins taken from 3.11.0 docs: https://docs.python.org/3/library/functions.html
 PYTHON_BUILTIN_FUNCTIONS = [
     'abs',
@@ -454,6 +461,18 @@ def get_suggestions_for_language(lang, level):
     return en_lang_commands
 
 
+def get_suggestion_index(lang, level):
+    """Returns the index of the commands that are suggested for an invalid command in this language and level."""
+    if not local_keywords_enabled:
+        lang = 'en'
+    return _get_suggestion_index(lang, level)
+
+
+@cache
+def _get_suggestion_index(lang, level):
+    return suggestion_index.BKTree(get_suggestions_for_language(lang, level), calculate_minimum_distance)
+
+
 def escape_var(var):
     var_name = var
     if isinstance(var, LookupEntry):
@@ -473,14 +492,20 @@ def closest_command(input_, known_commands, threshold=2):
     #             This is to prevent "print is not a command in Hedy level 3, did you mean print?" error message.
     #  (True, 'sug') Valid suggestion. A command is similar enough to the input but not identical, e.g. 'aks' -> 'ask'
 
+    # The known commands can be a list or a BKTree. Building a tree takes longer than a scan of the list, so only
+    # the trees of get_suggestion_index, which are built once per language and level, are searched as a tree.
+
     # FH, early 2020: simple string distance, could be more sophisticated MACHINE LEARNING!
-    minimum_distance = 1000
-    result = None
-    for command in known_commands:
-        minimum_distance_for_command = calculate_minimum_distance(command, input_)
-        if minimum_distance_for_command < minimum_distance and minimum_distance_for_command <= threshold:
-            minimum_distance = minimum_distance_for_command
-            result = command
+    if isinstance(known_commands, suggestion_index.BKTree):
+        result = known_commands.closest(input_, threshold)
+    else:
+        minimum_distance = 1000
+        result = None
+        for command in known_commands:
+            minimum_distance_for_command = calculate_minimum_distance(command, input_)
+            if minimum_distance_for_command < minimum_distance and minimum_distance_for_command <= threshold:
+                minimum_distance = minimum_distance_for_command
+                result = command
 
     if result:
         if result != input_:
@@ -532,17 +557,43 @@ class LookupEntry:
         return '(' not in self.name and '[' not in self.name
 
 
+_letter_or_underscore = r"[\p{Lu}\p{Ll}\p{Lt}\p{Lm}\p{Lo}\p{Nl}_]"
+_letter_or_numeral = r"[\p{Mn}\p{Mc}\p{Nd}\p{Pc}·]"
+_function_name_regex = regex.compile(
+    fr"{_letter_or_underscore}({_letter_or_underscore}|{_letter_or_numeral})*\(")
+
+
+@lru_cache(maxsize=4096)
+def _lookup_name(name):
+    """Returns the name under which an entry is matched in the lookup table: the arguments of a function
+    are dropped, and reserved words are escaped."""
+    if _function_name_regex.match(name):
+        return escape_var(name.split('(')[0])
+    return escape_var(name)
+
+
 class LookupTable:
     """The lookup table has a naive implementation of scopes: the start and end lines of every local scope is stored
      in a list. Everything else falls in the global scope. Since local scopes cannot be nested, every line in the
-     code could either belong to one local scope or the global scope."""
+     code could either belong to one local scope or the global scope.
+
+     The entries are indexed by their name and the local scopes by their start line, so that looking up a variable
+     does not have to go through all the entries."""
 
     def __init__(self, local_scopes, entries):
         self.local_scopes = local_scopes
         self.entries = entries
         self.__local_scopes = local_scopes
         self.__entries = entries
-        self.entries = entries
+        self.__sorted_scopes = sorted(local_scopes, key=lambda scope: scope[1])
+        self.__scope_starts = [s for (_, s, _) in self.__sorted_scopes]
+        self.__scope_start_lines = set(self.__scope_starts)
+        # a nested function is an error, but its scope is still stored, and then the first matching scope is used
+        self.__scopes_overlap = any(s <= e for (_, _, e), (_, s, _) in zip(self.__sorted_scopes,
+                                                                           self.__sorted_scopes[1:]))
+        self.__entries_by_name = collections.defaultdict(list)
+        for entry in entries:
+            self.__entries_by_name[_lookup_name(str(entry.name))].append(entry)
 
     def get_all(self):
         return self.__entries
@@ -552,21 +603,37 @@ class LookupTable:
         return [e for e in self.__entries if e.is_var()]
 
     def try_get_local_scope(self, line):
-        for (n, s, e) in self.__local_scopes:
-            if s <= line <= e:
-                return n, s, e
+        if self.__scopes_overlap:
+            for (n, s, e) in self.__local_scopes:
+                if s <= line <= e:
+                    return n, s, e
+            return None
+        i = bisect.bisect_right(self.__scope_starts, line) - 1
+        if i >= 0 and line <= self.__sorted_scopes[i][2]:
+            return self.__sorted_scopes[i]
         return None
 
     def get_all_in_scope(self, access_line):
         """Returns the lookup entries for the scope of the given access line."""
+        return self.__select_in_scope(self.__entries, access_line)
+
+    def get_matching(self, var, access_line):
+        """Returns the lookup entries that match the provided variable name. The access_line is needed to determine
+        the scope in which the variable is used. Note that in the lookup table, variables are escaped but functions
+        are not. In other words, the variable `sum` is stored as `_sum`, but the function `sum` is stored as `sum()`.
+        When calling this method, don't escape func names. """
+        entries = self.__entries_by_name.get(_lookup_name(str(var)), [])
+        return self.__select_in_scope(entries, access_line)
+
+    def __select_in_scope(self, entries, access_line):
+        """Returns the given entries which are in the scope of the access line, in the order of get_all_in_scope."""
         def in_global_scope(entry):
             is_func = entry.name.endswith('()')
-            line = entry.definition_line
             # functions are always part of the global scope since they cannot be nested
-            return is_func or not [s for (_, s, e) in self.__local_scopes if s <= line <= e]
+            return is_func or self.try_get_local_scope(entry.definition_line) is None
 
         def is_func_definition(entry):
-            return entry.is_func() and entry.definition_line in [s for (_, s, _) in self.__local_scopes]
+            return entry.is_func() and entry.definition_line in self.__scope_start_lines
 
         local_scope = self.try_get_local_scope(access_line)
         if local_scope:
@@ -575,35 +642,16 @@ class LookupTable:
             # scope defined before the local scope. Note that we return the whole local scope, not just the part
             # before the access line. The decision whether to throw an error if a variable is used before it is
             # defined or to interpret the variable as a literal string, must be made by the caller.
-            loc = [e for e in self.__entries if start <= e.definition_line <= end]
-            glo = [e for e in self.__entries if e.definition_line < start and in_global_scope(e)]
+            loc = [e for e in entries if start <= e.definition_line <= end]
+            glo = [e for e in entries if e.definition_line < start and in_global_scope(e)]
             return loc + glo
 
         # if the variable is in the global scope, return the whole global scope
         # combined with the function definitions
-        glo = [e for e in self.__entries if in_global_scope(e)]
-        funcs = [e for e in self.__entries if is_func_definition(e)]
+        glo = [e for e in entries if in_global_scope(e)]
+        funcs = [e for e in entries if is_func_definition(e)]
         return glo + funcs
 
-    def get_matching(self, var, access_line):
-        """Returns the lookup entries that match the provided variable name. The access_line is needed to determine
-        the scope in which the variable is used. Note that in the lookup table, variables are escaped but functions
-        are not. In other words, the variable `sum` is stored as `_sum`, but the function `sum` is stored as `sum()`.
-        When calling this method, don't escape func names. """
-
-        def escape(arg):
-            arg = str(arg)
-            letter_or_underscore = r"[\p{Lu}\p{Ll}\p{Lt}\p{Lm}\p{Lo}\p{Nl}_]"
-            letter_or_numeral = r"[\p{Mn}\p{Mc}\p{Nd}\p{Pc}·]"
-            var_regex = fr"{letter_or_underscore}({letter_or_underscore}|{letter_or_numeral})*"
-            function_regex = fr"{var_regex}\("
-            if regex.match(function_regex, arg):
-                return escape_var(arg.split('(')[0])
-            return escape_var(arg)
-
-        entries_in_scope = self.get_all_in_scope(access_line)
-        return [entry for entry in entries_in_scope if escape(entry.name) == escape(var)]
-
 
 class TypedTree(Tree):
     def __init__(self, data, children, meta, type_):
@@ -611,6 +659,62 @@ class TypedTree(Tree):
         self.type_ = type_
 
 
+class TreeWalk:
+    """Runs several passes over a tree in a single depth-first walk, instead of one walk per pass.
+
+    A pass is either a Transformer, which is called bottom-up with the results of its own callbacks for the children,
+    exactly as if it transformed the tree on its own, or a Visitor, which is called top-down as by `visit_topdown`.
+    For every node the passes are called in the given order, so the errors of the first pass are raised before the
+    next passes see the node. A pass that depends on the complete result of another pass, e.g. on the lookup table,
+    can not be part of the same walk and needs a walk of its own."""
+
+    def __init__(self, *passes):
+        self.transformers = [p for p in passes if isinstance(p, Transformer)]
+        self.visitors = [p for p in passes if isinstance(p, visitors.Visitor)]
+        # for every transformer, the callback of every rule, or None if the rule has no callback
+        self.__callbacks = [{} for _ in self.transformers]
+
+    def walk(self, tree):
+        """Walks the tree and returns the results of the transformers, in the order they were given."""
+        transpile_budget.check()
+        for visitor in self.visitors:
+            visitor._call_userfunc(tree)
+
+        transformed_children = [[] for _ in self.transformers]
+        for child in tree.children:
+            if isinstance(child, Tree):
+                results = self.walk(child)
+            else:
+                results = [t._call_userfunc_token(child) if t.__visit_tokens__ and isinstance(child, Token) else child
+                           for t in self.transformers]
+            for children, result in zip(transformed_children, results):
+                if result is not visitors.Discard:
+                    children.append(result)
+
+        return [self.__call_transformer(i, tree, children) for i, children in enumerate(transformed_children)]
+
+    def __call_transformer(self, i, tree, children):
+        # the same as Transformer._call_userfunc, with the callbacks looked up once per rule
+        transformer = self.transformers[i]
+        callbacks = self.__callbacks[i]
+        if tree.data in callbacks:
+            f = callbacks[tree.data]
+        else:
+            f = callbacks[tree.data] = getattr(transformer, tree.data, None)
+
+        if f is None:
+            return transformer.__default__(tree.data, children, tree.meta)
+        try:
+            wrapper = getattr(f, 'visit_wrapper', None)
+            if wrapper is not None:
+                return f.visit_wrapper(f, tree.data, children, tree.meta)
+            return f(children)
+        except lark.exceptions.GrammarError:
+            raise
+        except Exception as e:
+            raise VisitError(tree.data, tree, e)
+
+
 @v_args(meta=True)
 class ExtractAST(Transformer):
     # simplifies the tree: f.e. flattens arguments of text, var and punctuation for further processing
@@ -670,6 +774,8 @@ class LookupEntryCollector(visitors.Visitor):
         self.has_pressed = has_pressed
         self.local_scopes = []
         self.lookup_entries = []
+        # the names and lines of the calls of functions which are not defined before the call
+        self.undefined_calls = []
 
     def ask(self, tree):
         # in level 1 there is no variable name on the left side of the ask command
@@ -736,7 +842,14 @@ class LookupEntryCollector(visitors.Visitor):
         function_name = tree.children[0].children[0]
         names = [x.name for x in self.lookup_entries]
         if function_name + "()" not in names:
-            raise exceptions.UndefinedFunctionException(function_name, tree.meta.line)
+            self.undefined_calls.append((function_name, tree.meta.line))
+
+    def check_calls(self):
+        """Raises an error for the first call of a function which is not defined before it. The error is raised
+        after the visit, so that it can run in the same walk as IsComplete without hiding its errors."""
+        if self.undefined_calls:
+            function_name, line = self.undefined_calls[0]
+            raise exceptions.UndefinedFunctionException(function_name, line)
 
     def add_to_lookup(self, name, tree, definition_line, skip_hashing=False):
         entry = LookupEntry(name, tree, definition_line, skip_hashing)
@@ -752,12 +865,13 @@ class LookupEntryCollector(visitors.Visitor):
 # their inferred type. It also performs type validation for commands, e.g. 'text' + 1 results in error.
 @v_args(tree=True)
 class TypeValidator(Transformer):
-    def __init__(self, lookup, level, lang, input_string):
+    def __init__(self, lookup, level, lang, input_string, skip_faulty=False):
         super().__init__()
         self.lookup = lookup
         self.level = level
         self.lang = lang
         self.input_string = input_string
+        self.skip_faulty = skip_faulty
 
     def print(self, tree):
         self.validate_args_type_allowed(Command.print, tree.children, tree.meta)
@@ -994,7 +1108,8 @@ class TypeValidator(Transformer):
                     meta.line,
                     meta.end_line,
                     meta.column - 1,
-                    meta.end_column - 2)
+                    meta.end_column - 2,
+                    self.skip_faulty)
                 result = {k: v for k, v in result.items()}
                 command = ' '.join([v.strip() for v in result.values() if v is not None])
             raise exceptions.InvalidArgumentTypeException(command=command, invalid_type=arg_type,
@@ -1065,7 +1180,8 @@ class TypeValidator(Transformer):
                 else:
                     match.currently_inferring = True
                     try:
-                        TypeValidator(self.lookup, self.level, self.lang, self.input_string).transform(match.tree)
+                        TypeValidator(self.lookup, self.level, self.lang, self.input_string,
+                                      self.skip_faulty).transform(match.tree)
                     except VisitError as ex:
                         raise ex.orig_exc
                     match.currently_inferring = False
@@ -1235,7 +1351,7 @@ def all_commands(input_string, level, lang='en'):
 
 def all_variables(input_string, level, lang='en'):
     """ Return all variables used in a program string.
-    This function is still used by the roles of variables detection """
+    This function is still used by the analysis tools, but no longer by 'transpile' """
     program_root = parse_input(input_string, level, lang)
     abstract_syntax_tree = ExtractAST().transform(program_root)
 
@@ -1243,7 +1359,10 @@ def all_variables(input_string, level, lang='en'):
     has_pressed = "if_pressed" in commands or "if_pressed_else" in commands
 
     lookup = create_lookup_table(abstract_syntax_tree, level, lang, input_string, has_pressed)
+    return variables_in_lookup(lookup)
 
+
+def variables_in_lookup(lookup):
     # list access and functions are intentionally omitted here
     variables = [str(v.name) for v in lookup.get_only_vars()]
     return list(set(variables))
@@ -1255,10 +1374,35 @@ class IsValid(Filter):
     # this function is used to generate more informative error messages
     # tree is transformed to a node of [Bool, args, command number]
 
-    def __init__(self, level, lang, input_string):
+    def __init__(self, level, lang, input_string, skip_faulty=False):
         self.level = level
         self.lang = lang
         self.input_string = input_string
+        self.skip_faulty = skip_faulty
+        # when skipping faulty code, error productions do not raise, their exceptions are collected instead
+        self.skipped_errors = []
+        if skip_faulty:
+            for name in dir(self):
+                if name.startswith('error'):
+                    setattr(self, name, self._skipping_faulty(name))
+
+    # The error of an invalid space is found by transpiling the fixed program, so it depends on the rest of the
+    # program. When skipping faulty code it is not collected, the line is transpiled on its own instead.
+    _errors_not_collected = {'error_invalid_space'}
+
+    def _skipping_faulty(self, name):
+        error_method = getattr(self, name)
+
+        @v_args(meta=True)
+        def skip(meta, args):
+            if name not in self._errors_not_collected:
+                try:
+                    error_method(meta, args)
+                except Exception as e:
+                    source_range = SourceRange(meta.line, meta.column, meta.end_line, meta.end_column)
+                    self.skipped_errors.append((source_range, e))
+            return [True]
+        return skip
 
     def error_invalid_space(self, meta, args):
         line = args[0][2].line
@@ -1311,7 +1455,7 @@ class IsValid(Filter):
 
     def error_invalid(self, meta, args):
         invalid_command = args[0][1]
-        sug_exists, suggestion = closest_command(invalid_command, get_suggestions_for_language(self.lang, self.level))
+        sug_exists, suggestion = closest_command(invalid_command, get_suggestion_index(self.lang, self.level))
 
         if sug_exists is None:  # there is no suggestion
             raise exceptions.MissingCommandException(level=self.level, line_number=meta.line)
@@ -1329,10 +1473,14 @@ class IsValid(Filter):
         else:  # there is a valid suggestion
             result = None
             fixed_code = self.input_string.replace(invalid_command, suggestion)
-            if fixed_code != self.input_string:  # only if we have made a successful fix
+            # when skipping faulty code only the error itself is used, so we don't transpile the fix
+            if fixed_code != self.input_string and not self.skip_faulty:  # only if we have made a successful fix
                 try:
                     fixed_result = transpile_inner(fixed_code, self.level)
                     result = fixed_result
+                except exceptions.TranspileBudgetExceededException:
+                    # running out of time says nothing about the fixed code, so it is not an error of the program
+                    raise
                 except exceptions.HedyException:
                     # The fixed code contains another error. Only report the original error for now.
                     pass
@@ -1547,11 +1695,13 @@ def add_sleep_to_command(commands, indent=True, is_debug=False, location="after"
     if is_debug:
         return commands
 
-    lines = commands.split()
-    if lines[-1] == "time.sleep(0.1)":  # we don't sleep double so skip if final line is a sleep already
+    last_word = commands.last_word() if isinstance(commands, Block) else commands.split()[-1]
+    if last_word == "time.sleep(0.1)":  # we don't sleep double so skip if final line is a sleep already
         return commands
 
     sleep_command = "time.sleep(0.1)" if indent is False else "  time.sleep(0.1)"
+    if isinstance(commands, Block):
+        return Block(commands, sleep_command) if location == "after" else Block(sleep_command, commands)
     if location == "after":
         return commands + "\n" + sleep_command
     else:  # location is before
@@ -1610,12 +1760,14 @@ def hedy_transpiler(level, microbit=False):
 
 @v_args(meta=True)
 class ConvertToPython(Transformer):
-    def __init__(self, lookup, language="en", is_debug=False, has_pressed=False):
+    def __init__(self, lookup, language="en", is_debug=False, has_pressed=False, source_map=None):
         super().__init__()
         self.lookup = lookup
         self.language = language
         self.is_debug = is_debug
         self.has_pressed = has_pressed
+        # the source map of the current transpilation, filled by the methods decorated with source_map_rule
+        self.source_map = source_map
 
     def add_debug_breakpoint(self):
         if self.is_debug:
@@ -1804,9 +1956,8 @@ class ConvertToPython(Transformer):
         return s in ['True', 'False']
 
     @staticmethod
-    def indent(s, spaces_amount=2):
-        lines = s.split('\n')
-        return '\n'.join([' ' * spaces_amount + line for line in lines])
+    def indent(s):
+        return python_emitter.indent(s)
 
     @staticmethod
     def unpack(arg):
@@ -1826,18 +1977,18 @@ class ConvertToPython(Transformer):
 
 @v_args(meta=True)
 @hedy_transpiler(level=1)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_1(ConvertToPython):
 
-    def __init__(self, lookup, language, is_debug, has_pressed):
-        super().__init__(lookup, language, is_debug, has_pressed)
+    def __init__(self, lookup, language, is_debug, has_pressed, source_map=None):
+        super().__init__(lookup, language, is_debug, has_pressed, source_map)
         __class__.level = 1
 
     def program(self, meta, args):
-        lines = [str(a) for a in args]
+        lines = [a if isinstance(a, (str, Block)) else str(a) for a in args]
         if self.has_pressed:
             lines.insert(0, "global_scope_ = dict()")
-        return '\n'.join(lines)
+        return Block(*lines).render()
 
     def command(self, meta, args):
         return args[0]
@@ -2012,7 +2163,7 @@ class ConvertToPython_1(ConvertToPython):
 
 @v_args(meta=True)
 @hedy_transpiler(level=2)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_2(ConvertToPython_1):
     def color(self, meta, args):
         if not args:
@@ -2127,7 +2278,7 @@ class ConvertToPython_2(ConvertToPython_1):
 
 @v_args(meta=True)
 @hedy_transpiler(level=3)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_3(ConvertToPython_2):
     def assign_list(self, meta, args):
         parameter = self.unpack(args[0])
@@ -2176,7 +2327,7 @@ class ConvertToPython_3(ConvertToPython_2):
 
 @v_args(meta=True)
 @hedy_transpiler(level=4)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_4(ConvertToPython_3):
     def process_arg_for_fstring(self, name, access_line=100, var_to_escape=''):
         name = escape_var(self.unpack(name))
@@ -2239,7 +2390,7 @@ class ConvertToPython_4(ConvertToPython_3):
 
 @v_args(meta=True)
 @hedy_transpiler(level=5)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_5(ConvertToPython_4):
     def ask(self, meta, args):
         var = self.scoped_var_assign(escape_var(self.unpack(args[0])), meta.line)
@@ -2289,14 +2440,13 @@ class ConvertToPython_5(ConvertToPython_4):
           pass""")
 
     def ifs(self, meta, args):  # might be worth asking if we want a debug breakpoint here
-        return f"""if {args[0]}:{self.add_debug_breakpoint()}
-{ConvertToPython.indent(args[1])}"""
+        return Block(f"if {args[0]}:{self.add_debug_breakpoint()}", ConvertToPython.indent(args[1]))
 
     def ifelse(self, meta, args):
-        return f"""if {args[0]}:{self.add_debug_breakpoint()}
-{ConvertToPython.indent(args[1])}
-else:{self.add_debug_breakpoint()}
-{ConvertToPython.indent(args[2])}"""
+        return Block(f"if {args[0]}:{self.add_debug_breakpoint()}",
+                     ConvertToPython.indent(args[1]),
+                     f"else:{self.add_debug_breakpoint()}",
+                     ConvertToPython.indent(args[2]))
 
     def condition(self, meta, args):
         return ' and '.join(args)
@@ -2334,10 +2484,7 @@ else:{self.add_debug_breakpoint()}
         return f'if_pressed_{key_name}_'
 
     def make_function(self, function_name, body):
-        return (
-            f'def {function_name}():' + '\n' +
-            ConvertToPython.indent(body)
-        )
+        return Block(f'def {function_name}():', ConvertToPython.indent(body))
 
     def clear_key_mapping(self):
         return 'if_pressed_mapping = {"else": "if_pressed_default_else"}'
@@ -2365,19 +2512,19 @@ else:{self.add_debug_breakpoint()}
         else_code = args[2]
         else_function_name = self.make_function_name('else', meta.line)
 
-        return (
-            self.clear_key_mapping() + '\n' +
-            self.add_if_key_mapping(key, if_function_name) + '\n' +
-            self.add_else_key_mapping(else_function_name) + '\n' +
-            self.make_function(if_function_name, if_code) + '\n' +
-            self.make_function(else_function_name, else_code) + '\n' +
+        return Block(
+            self.clear_key_mapping(),
+            self.add_if_key_mapping(key, if_function_name),
+            self.add_else_key_mapping(else_function_name),
+            self.make_function(if_function_name, if_code),
+            self.make_function(else_function_name, else_code),
             self.make_extension_call()
         )
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=6)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_6(ConvertToPython_5):
     def turn(self, meta, args):
         if not args:
@@ -2661,7 +2808,7 @@ class ConvertToPython_6(ConvertToPython_5):
 
 @v_args(meta=True)
 @hedy_transpiler(level=7)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_7(ConvertToPython_6):
     def repeat(self, meta, args):
         return self.make_repeat(meta, args, multiline=False)
@@ -2675,50 +2822,51 @@ class ConvertToPython_7(ConvertToPython_6):
             body = self.indent(args[1])
         # In level 8 and up, repeat can have multiple lines in its body
         else:
-            body = "\n".join([self.indent(x) for x in args[1:]])
+            body = Block(*[self.indent(x) for x in args[1:]])
 
         body = add_sleep_to_command(body, indent=True, is_debug=self.is_debug, location="after")
         ex = make_value_error(Command.repeat, 'suggestion_number', self.language)
-        return f"for {var_name} in range(int_with_error({times}, {ex})):{self.add_debug_breakpoint()}\n{body}"
+        return Block(f"for {var_name} in range(int_with_error({times}, {ex})):{self.add_debug_breakpoint()}", body)
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=8)
 @v_args(meta=True)
 @hedy_transpiler(level=9)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_8_9(ConvertToPython_7):
     def command(self, meta, args):
-        return "".join(args)
+        # an if with its elifs and else, each of them is a block of code
+        return args[0] if len(args) == 1 else Block(*args)
 
     def repeat(self, meta, args):
         return self.make_repeat(meta, args, multiline=True)
 
     def ifs(self, meta, args):
         all_lines = [ConvertToPython.indent(x) for x in args[1:]]
-        return "if " + args[0] + ":" + self.add_debug_breakpoint() + "\n" + "\n".join(all_lines)
+        return Block("if " + args[0] + ":" + self.add_debug_breakpoint(), *all_lines)
 
     def if_pressed(self, meta, args):
         key = self.process_arg_for_data_access(args[0], meta.line)
         args = [a for a in args if a != ""]  # filter out in|dedent tokens
 
-        if_code = '\n'.join(args[1:])
+        if_code = Block(*args[1:])
         if_function_name = self.make_function_name(args[0], meta.line)
 
-        return (
-            self.clear_key_mapping() + '\n' +
-            self.add_if_key_mapping(key, if_function_name) + '\n' +
-            self.make_function(if_function_name, if_code) + '\n'
+        return Block(
+            self.clear_key_mapping(),
+            self.add_if_key_mapping(key, if_function_name),
+            self.make_function(if_function_name, if_code)
         )
 
     def if_pressed_elses(self, meta, args):
         args = [a for a in args if a != ""]  # filter out in|dedent tokens
-        else_code = '\n'.join(args)
+        else_code = Block(*args)
         else_function_name = self.make_function_name('else', meta.line)
 
-        return (
-            self.add_else_key_mapping(else_function_name) + '\n' +
-            self.make_function(else_function_name, else_code) + '\n' +
+        return Block(
+            self.add_else_key_mapping(else_function_name),
+            self.make_function(else_function_name, else_code),
             self.make_extension_call()
         )
 
@@ -2726,22 +2874,22 @@ class ConvertToPython_8_9(ConvertToPython_7):
         args = [a for a in args if a != ""]  # filter out in|dedent tokens
         all_lines = [ConvertToPython.indent(x) for x in args]
 
-        return "\nelse:\n" + "\n".join(all_lines)
+        return Block("else:", *all_lines)
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=10)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_10(ConvertToPython_8_9):
     def for_list(self, meta, args):
         times = self.process_arg_for_data_access(args[0], meta.line, use_var_value=False, use_scope=False)
         list_name = self.process_arg_for_data_access(args[1], meta.line, use_var_value=True)
 
         lines = self.prepend_for_variable_to_body(args[2:], times)
-        body = "\n".join([self.indent(line) for line in lines])
+        body = Block(*[self.indent(line) for line in lines])
         body = add_sleep_to_command(body, True, self.is_debug, location="after")
 
-        return f"for {times} in {list_name}:{self.add_debug_breakpoint()}\n{body}"
+        return Block(f"for {times} in {list_name}:{self.add_debug_breakpoint()}", body)
 
     def prepend_for_variable_to_body(self, lines, for_var):
         # if self.has_pressed:
@@ -2753,7 +2901,7 @@ class ConvertToPython_10(ConvertToPython_8_9):
 
 @v_args(meta=True)
 @hedy_transpiler(level=11)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_11(ConvertToPython_10):
     def for_loop(self, meta, args):
         iterator = escape_var(args[0])
@@ -2770,15 +2918,14 @@ class ConvertToPython_11(ConvertToPython_10):
         range_part = (f'[Value({range_var}, num_sys={num_sys}) '
                       f'for {range_var} in range({range_begin}, {range_end} + {step}, {step})]')
         lines = self.prepend_for_variable_to_body(args[3:], iterator)
-        body = "\n".join([self.indent(x) for x in lines])
+        body = Block(*[self.indent(x) for x in lines])
         body = add_sleep_to_command(body, indent=True, is_debug=self.is_debug, location="after")
         # Adding runtime errors, i.e. int_with_error(arg, 'Very long error message'), can bloat the code a lot.
         # To overcome this, we only add the runtime error the first time the arg is accessed - in the step definition.
         # In later uses, such as the range definition, we use regular int() cast.
-        return textwrap.dedent(f"""\
+        return Block(textwrap.dedent(f"""\
             {step} = 1 if {step_begin} < {step_end} else -1
-            for {iterator} in {range_part}:{self.add_debug_breakpoint()}
-            """) + body
+            for {iterator} in {range_part}:{self.add_debug_breakpoint()}"""), body)
 
     def process_for_loop_args(self, arg, meta, runtime_error=False):
         if self.is_variable(arg, meta.line) or self.is_list_access(arg):
@@ -2793,7 +2940,7 @@ class ConvertToPython_11(ConvertToPython_10):
 
 @v_args(meta=True)
 @hedy_transpiler(level=12)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_12(ConvertToPython_11):
     def text_in_quotes(self, meta, args):
         # We need to re-add the quotes, so that the Python code becomes name = 'Jan' or "Jan's"
@@ -3023,7 +3170,7 @@ class ConvertToPython_12(ConvertToPython_11):
     def ifs(self, meta, args):
         all_lines = [self.indent(x) for x in args[1:]]
         exception = self.make_index_error_check_if_list([args[0]])
-        return exception + "if " + args[0] + ":" + self.add_debug_breakpoint() + "\n" + "\n".join(all_lines)
+        return Block(exception + "if " + args[0] + ":" + self.add_debug_breakpoint(), *all_lines)
 
     def process_add_to_remove_from_list_argument(self, arg, meta):
         if self.is_variable_with_definition(arg, meta.line):
@@ -3068,9 +3215,9 @@ class ConvertToPython_12(ConvertToPython_11):
         self.try_register_variable_access(list_name, meta.line)
 
         lines = self.prepend_for_variable_to_body(args[2:], times)
-        body = "\n".join([self.indent(x) for x in lines])
+        body = Block(*[self.indent(x) for x in lines])
         body = add_sleep_to_command(body, is_debug=self.is_debug)
-        return f"for {times} in {list_name}:{self.add_debug_breakpoint()}\n{body}"
+        return Block(f"for {times} in {list_name}:{self.add_debug_breakpoint()}", body)
 
     def for_loop(self, meta, args):
         iterator = escape_var(args[0])
@@ -3078,7 +3225,7 @@ class ConvertToPython_12(ConvertToPython_11):
         self.try_register_variable_access(iterator, meta.line)
 
         lines = self.prepend_for_variable_to_body(args[3:], iterator)
-        body = "\n".join([self.indent(x) for x in lines])
+        body = Block(*[self.indent(x) for x in lines])
         body = add_sleep_to_command(body, is_debug=self.is_debug)
         step_var_name = self.get_fresh_var('__step')
 
@@ -3089,10 +3236,9 @@ class ConvertToPython_12(ConvertToPython_11):
         range_part = (f'[Value({range_var}, num_sys={num_sys}) '
                       f'for {range_var} in range({begin}, {end} + {step_var_name}, {step_var_name})]')
 
-        return textwrap.dedent(f"""\
+        return Block(textwrap.dedent(f"""\
             {step_var_name} = 1 if {begin} < {end} else -1
-            for {iterator} in {range_part}:{self.add_debug_breakpoint()}
-            """) + body
+            for {iterator} in {range_part}:{self.add_debug_breakpoint()}"""), body)
 
     def process_arg_for_data_access(self, arg, access_line=100, use_var_value=True, use_scope=True):
         if self.is_variable(arg, access_line):
@@ -3154,9 +3300,9 @@ class ConvertToPython_12(ConvertToPython_11):
             if has_args:
                 init_value = f'''{{{', '.join(f'"{str(x)}": {str(x)}' for x in args[1].children)}}}'''
             lines.insert(0, f'local_scope_{function_name}_ = {init_value}')
-        body = "\n".join(self.indent(line) for line in lines)
+        body = Block(*[self.indent(line) for line in lines])
 
-        return f"def {function_name}({args_str}):\n{body}"
+        return Block(f"def {function_name}({args_str}):", body)
 
     def call(self, meta, args):
         function_name = self.unpack(args[0])
@@ -3198,16 +3344,12 @@ class ConvertToPython_12(ConvertToPython_11):
                 return Value(f'''{args_str}''')""")
 
     def make_function(self, function_name, body):
-        return (
-            f'global {function_name}' + '\n' +
-            f'def {function_name}():' + '\n' +
-            ConvertToPython.indent(body)
-        )
+        return Block(f'global {function_name}', f'def {function_name}():', ConvertToPython.indent(body))
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=13)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_13(ConvertToPython_12):
     def and_condition(self, meta, args):
         return ' and '.join(args)
@@ -3218,7 +3360,7 @@ class ConvertToPython_13(ConvertToPython_12):
 
 @v_args(meta=True)
 @hedy_transpiler(level=14)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_14(ConvertToPython_13):
     def process_comparison(self, meta, args, operator):
         arg0 = self.process_variable_for_comparisons(args[0], meta)
@@ -3256,18 +3398,18 @@ class ConvertToPython_14(ConvertToPython_13):
 
 @v_args(meta=True)
 @hedy_transpiler(level=15)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_15(ConvertToPython_14):
     def while_loop(self, meta, args):
         args = [a for a in args if a != ""]  # filter out in|dedent tokens
-        body = self.indent("\n".join(args[1:]))
+        body = self.indent(Block(*args[1:]))
         body = add_sleep_to_command(body, True, self.is_debug, location="after")
         exception = self.make_index_error_check_if_list([args[0]])
-        return exception + "while " + args[0] + ":" + self.add_debug_breakpoint() + "\n" + body
+        return Block(exception + "while " + args[0] + ":" + self.add_debug_breakpoint(), body)
 
     def if_pressed_without_else(self, meta, args):
         code = args[0]
-        return code + self.make_extension_call()
+        return Block(code, self.make_extension_call())
 
     def ask(self, meta, args):
         var = self.unpack(args[0])
@@ -3303,7 +3445,7 @@ class ConvertToPython_15(ConvertToPython_14):
 
 @v_args(meta=True)
 @hedy_transpiler(level=16)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_16(ConvertToPython_15):
     def change_list_item(self, meta, args):
         name = self.unpack(args[0])
@@ -3320,29 +3462,29 @@ class ConvertToPython_16(ConvertToPython_15):
 
 @v_args(meta=True)
 @hedy_transpiler(level=17)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_17(ConvertToPython_16):
     def elifs(self, meta, args):
         args = [a for a in args if a != ""]  # filter out in|dedent tokens
         all_lines = [ConvertToPython.indent(x) for x in args[1:]]
-        return "\nelif " + args[0] + ":" + self.add_debug_breakpoint() + "\n" + "\n".join(all_lines)
+        return Block("elif " + args[0] + ":" + self.add_debug_breakpoint(), *all_lines)
 
     def if_pressed_elifs(self, meta, args):
         args = [a for a in args if a != ""]  # filter out in|dedent tokens
         key = self.process_arg_for_data_access(args[0], meta.line)
 
-        elif_code = '\n'.join(args[1:])
+        elif_code = Block(*args[1:])
         elif_function_name = self.make_function_name(args[0], meta.line)
 
-        return (
-            self.add_if_key_mapping(key, elif_function_name) + '\n' +
-            self.make_function(elif_function_name, elif_code) + '\n'
+        return Block(
+            self.add_if_key_mapping(key, elif_function_name),
+            self.make_function(elif_function_name, elif_code)
         )
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=18)
-@source_map_transformer(source_map)
+@source_map_transformer
 class ConvertToPython_18(ConvertToPython_17):
     def input(self, meta, args):
         return self.ask(meta, args)
@@ -3362,7 +3504,7 @@ class ConvertToPython_18(ConvertToPython_17):
 
 @v_args(meta=True)
 @hedy_transpiler(level=1, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_1(ConvertToPython_1):
     def print(self, meta, args):
         # escape needed characters
@@ -3372,7 +3514,7 @@ class MicrobitConvertToPython_1(ConvertToPython_1):
 
 @v_args(meta=True)
 @hedy_transpiler(level=2, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_2(MicrobitConvertToPython_1, ConvertToPython_2):
 
     def print(self, meta, args):
@@ -3412,14 +3554,14 @@ class MicrobitConvertToPython_2(MicrobitConvertToPython_1, ConvertToPython_2):
 
 @v_args(meta=True)
 @hedy_transpiler(level=3, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_3(MicrobitConvertToPython_2, ConvertToPython_3):
     pass
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=4, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_4(MicrobitConvertToPython_3, ConvertToPython_4):
 
     def process_print_ask_args(self, args, meta, var_to_escape=''):
@@ -3435,21 +3577,21 @@ class MicrobitConvertToPython_4(MicrobitConvertToPython_3, ConvertToPython_4):
 
 @v_args(meta=True)
 @hedy_transpiler(level=5, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_5(MicrobitConvertToPython_4, ConvertToPython_5):
     pass
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=6, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_6(MicrobitConvertToPython_5, ConvertToPython_6):
     pass
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=7, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_7(MicrobitConvertToPython_6, ConvertToPython_7):
     pass
 
@@ -3457,28 +3599,28 @@ class MicrobitConvertToPython_7(MicrobitConvertToPython_6, ConvertToPython_7):
 @v_args(meta=True)
 @hedy_transpiler(level=8, microbit=True)
 @hedy_transpiler(level=9, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_8_9(MicrobitConvertToPython_7, ConvertToPython_8_9):
     pass
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=10, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_10(MicrobitConvertToPython_8_9, ConvertToPython_10):
     pass
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=11, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_11(MicrobitConvertToPython_10, ConvertToPython_11):
     pass
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=12, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_12(MicrobitConvertToPython_11, ConvertToPython_12):
     pass
     # def print(self, meta, args):
@@ -3488,42 +3630,42 @@ class MicrobitConvertToPython_12(MicrobitConvertToPython_11, ConvertToPython_12)
 
 @v_args(meta=True)
 @hedy_transpiler(level=13, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_13(MicrobitConvertToPython_12, ConvertToPython_13):
     pass
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=14, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_14(MicrobitConvertToPython_13, ConvertToPython_14):
     pass
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=15, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_15(MicrobitConvertToPython_14, ConvertToPython_15):
     pass
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=16, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_16(MicrobitConvertToPython_15, ConvertToPython_16):
     pass
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=17, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_17(MicrobitConvertToPython_16, ConvertToPython_17):
     pass
 
 
 @v_args(meta=True)
 @hedy_transpiler(level=18, microbit=True)
-@source_map_transformer(source_map)
+@source_map_transformer
 class MicrobitConvertToPython_18(MicrobitConvertToPython_17, ConvertToPython_18):
     pass
 
@@ -3535,46 +3677,55 @@ def _get_parser_cache_directory():
     return tempfile.gettempdir()
 
 
-def _save_parser_to_file(lark, pickle_file):
-    # Store the parser to a file, a bit hacky because it is not
+def _parser_to_bytes(lark):
+    # Pickle the parser, a bit hacky because it is not
     # pickle-able out of the box
     # See https://github.com/lark-parser/lark/issues/1348
 
     # Note that if Lark ever implements the cache for Earley parser
     # or if we switch to a LALR parser we don't need this hack anymore
 
-    full_path = os.path.join(_get_parser_cache_directory(), pickle_file)
-
     # These attributes can not be pickled as they are a module
     lark.parser.parser.lexer_conf.re_module = None
     lark.parser.lexer_conf.re_module = None
+    try:
+        return pickle.dumps(lark)
+    finally:
+        # Restore the unpickle-able bits.
+        # Keep this in sync with _parser_from_bytes!
+        lark.parser.parser.lexer_conf.re_module = regex
+        lark.parser.lexer_conf.re_module = regex
+
+
+def _parser_from_bytes(data):
+    lark = pickle.loads(data)
+    # Restore the unpickle-able bits.
+    # Keep this in sync with _parser_to_bytes!
+    lark.parser.parser.lexer_conf.re_module = regex
+    lark.parser.lexer_conf.re_module = regex
+    return lark
+
+
+def _save_parser_to_file(lark, pickle_file):
+    full_path = os.path.join(_get_parser_cache_directory(), pickle_file)
+    data = _parser_to_bytes(lark)
 
     try:
         with atomic_write_file(full_path) as fp:
-            pickle.dump(lark, fp)
+            fp.write(data)
     except OSError:
         # Ignore errors if another process already moved the file
         # or if the destination already exist.
         # These scenarios can happen under concurrent execution.
         pass
 
-    # Restore the unpickle-able bits.
-    # Keep this in sync with the restore method!
-    lark.parser.parser.lexer_conf.re_module = regex
-    lark.parser.lexer_conf.re_module = regex
-
 
 def _restore_parser_from_file_if_present(pickle_file):
     full_path = os.path.join(_get_parser_cache_directory(), pickle_file)
     if os.path.isfile(full_path):
         try:
             with open(full_path, "rb") as fp:
-                lark = pickle.load(fp)
-            # Restore the unpickle-able bits.
-            # Keep this in sync with the save method!
-            lark.parser.parser.lexer_conf.re_module = regex
-            lark.parser.lexer_conf.re_module = regex
-            return lark
+                return _parser_from_bytes(fp.read())
         except Exception:
             # If anything goes wrong try to remove the file
             # and we will try again in the next cycle
@@ -3585,91 +3736,167 @@ def _restore_parser_from_file_if_present(pickle_file):
     return None
 
 
-@lru_cache(maxsize=0 if utils.is_production() else 100)
+def _restore_parser_from_bundle_if_present(unique_parser_hash):
+    data = hedy_parser_bundle.get(unique_parser_hash)
+    if data is None:
+        return None
+    return _parser_from_bytes(data)
+
+
+def _get_parser_options(keep_all_tokens):
+    return {
+        "regex": True,
+        "propagate_positions": True,
+        "keep_all_tokens": keep_all_tokens,
+    }
+
+
+def _get_unique_parser_hash(grammar, parser_opts):
+    return hashlib.sha1("_".join((
+        grammar,
+        str(sys.version_info[:2]),
+        str(parser_opts),
+    )).encode()).hexdigest()
+
+
 def get_parser(level, lang="en", keep_all_tokens=False, skip_faulty=False):
     """Return the Lark parser for a given level.
     Parser generation takes about 0.5 seconds depending on the level so
     we want to cache it, or we have latency of 500ms on the calculations
     and a high server load, and CI runs of 5+ hours.
 
-    We used to cache this to RAM but because of all the permutations we
-    had 1000s of parsers and got into out-of-memory issue in the
+    We used to cache all parsers to RAM but because of all the permutations
+    we had 1000s of parsers and got into out-of-memory issue in the
     production environment.
 
-    Now we cache a limited number of the parsers to RAM, but introduce
-    a second tier of cache to disk.
+    Now we keep the most used parsers in RAM within a memory budget (see
+    parser_cache). Other parsers come from the bundle that is precompiled
+    at deploy time (see hedy_parser_bundle), or from a second tier of
+    cache on disk. Parsers are identified by the hash of their grammar,
+    so keyword languages that end up with the same grammar (e.g. because
+    their keywords are not translated) share one parser in all tiers.
+
+    This only removes the duplicates: most keyword languages still need a
+    parser of their own, about 45 of the 60 per level. The keywords of a
+    language are part of its grammar, also in the negative lookaheads of
+    the text terminals, and whether a word is a keyword or text is only
+    decided by the parse. Sharing one parser per level would need the
+    keywords to be normalized before parsing, with the same outcome.
 
     This is not implemented by Lark natively for the Earley parser.
     See https://github.com/lark-parser/lark/issues/1348.
     """
+    unique_parser_hash = _get_unique_parser_hash_for_level(level, lang, keep_all_tokens, skip_faulty)
+    parser = parser_cache.PARSER_CACHE.get(unique_parser_hash)
+    if parser is None:
+        parser = _create_parser(level, lang, keep_all_tokens, skip_faulty, unique_parser_hash)
+        parser_cache.PARSER_CACHE.put(unique_parser_hash, parser)
+    return parser
+
+
+@cache
+def _get_unique_parser_hash_for_level(level, lang, keep_all_tokens, skip_faulty):
     grammar = hedy_grammar.create_grammar(level, lang, skip_faulty)
-    parser_opts = {
-        "regex": True,
-        "propagate_positions": True,
-        "keep_all_tokens": keep_all_tokens,
-    }
-    unique_parser_hash = hashlib.sha1("_".join((
-        grammar,
-        str(sys.version_info[:2]),
-        str(parser_opts),
-    )).encode()).hexdigest()
+    return _get_unique_parser_hash(grammar, _get_parser_options(keep_all_tokens))
+
 
-    cached_parser_file = f"cached-parser-{level}-{lang}-{unique_parser_hash}.pkl"
+def _create_parser(level, lang, keep_all_tokens, skip_faulty, unique_parser_hash):
+    cached_parser_file = f"cached-parser-{level}-{unique_parser_hash}.pkl"
 
-    use_cache = True
-    parser = None
-    if use_cache:
+    parser = _restore_parser_from_bundle_if_present(unique_parser_hash)
+    if parser is None:
         parser = _restore_parser_from_file_if_present(cached_parser_file)
     if parser is None:
-        parser = Lark(grammar, **parser_opts)  # ambiguity='explicit'
-        if use_cache:
-            _save_parser_to_file(parser, cached_parser_file)
+        grammar = hedy_grammar.create_grammar(level, lang, skip_faulty)
+        parser = Lark(grammar, **_get_parser_options(keep_all_tokens))  # ambiguity='explicit'
+        _save_parser_to_file(parser, cached_parser_file)
 
     return parser
 
 
-ParseResult = namedtuple('ParseResult', ['code', 'source_map', 'has_turtle',
-                                         'has_pressed', 'has_clear', 'has_music', 'has_sleep', 'commands',
-                                         'roles_of_variables'])
+# The keyword languages of most programs. Parsers of other languages are compiled when they are first needed.
+DEFAULT_PARSER_BUNDLE_LANGUAGES = ['en', 'nl', 'es', 'fr', 'de', 'ar']
 
 
-def transpile_inner_with_skipping_faulty(input_string, level, lang="en", unused_allowed=True):
-    def skipping_faulty(meta, args):
-        return [True]
+def get_parser_bundle_languages():
+    """The keyword languages to bundle the parsers of: env PARSER_BUNDLE_LANGUAGES, a comma separated list of
+    languages or 'all' for all keyword languages, or the default languages if it is not set.
 
-    defined_errors = [method for method in dir(IsValid) if method.startswith('error')]
-    defined_errors_original = dict()
+    A parser takes about 0.3s to compile and 270KB on disk, on average over the levels. The default languages need
+    216 parsers of all levels, with and without skip_faulty: about 60MB, built in a little over a minute. All 60 keyword
+    languages need about 1600 parsers: about 430MB, built in about 9 minutes on every deploy.
+    """
+    languages = getenv('PARSER_BUNDLE_LANGUAGES', '').strip()
+    if not languages:
+        return DEFAULT_PARSER_BUNDLE_LANGUAGES
+    if languages == 'all':
+        return sorted(ALL_KEYWORD_LANGUAGES)
+    return [lang.strip() for lang in languages.split(',') if lang.strip()]
 
-    def set_error_to_allowed():
-        # override IsValid methods to always be valid & store original
-        for error in defined_errors:
-            defined_errors_original[error] = getattr(IsValid, error)
-            setattr(IsValid, error, skipping_faulty)
 
-    def set_errors_to_original():
-        # revert IsValid methods to original
-        for error in defined_errors:
-            setattr(IsValid, error, defined_errors_original[error])
+def save_parser_bundle(directory=hedy_parser_bundle.BUNDLE_DIR, levels=None, languages=None):
+    """Compile the parsers of the keyword languages of get_parser_bundle_languages for all levels, with and without
+    skip_faulty, and store them in a bundle directory.
+
+    The parsers that keep all tokens are not included: they are only used to translate keywords, and are compiled
+    when they are needed. Languages which end up with the same grammar share one parser.
+    """
+    levels = levels or range(1, HEDY_MAX_LEVEL + 1)
+    languages = languages or get_parser_bundle_languages()
+    parser_opts = _get_parser_options(keep_all_tokens=False)
+    parsers = {}
+    for level in levels:
+        for lang in languages:
+            for skip_faulty in [False, True]:
+                grammar = hedy_grammar.create_grammar(level, lang, skip_faulty)
+                unique_parser_hash = _get_unique_parser_hash(grammar, parser_opts)
+                if unique_parser_hash not in parsers:
+                    parsers[unique_parser_hash] = _parser_to_bytes(Lark(grammar, **parser_opts))
+
+    os.makedirs(directory, exist_ok=True)
+    version_file = path.join(directory, hedy_parser_bundle.VERSION_FILE)
+    # The bundle is not used while it is incomplete, that is until the version is written again
+    if path.isfile(version_file):
+        os.unlink(version_file)
+    for name in os.listdir(directory):
+        if name.endswith('.pkl') and name[:-len('.pkl')] not in parsers:
+            os.unlink(path.join(directory, name))
+    for unique_parser_hash, data in parsers.items():
+        with atomic_write_file(hedy_parser_bundle.parser_filename(directory, unique_parser_hash)) as f:
+            f.write(data)
+    with atomic_write_file(version_file, 'w') as f:
+        f.write(lark.__version__)
+    return len(parsers)
 
-    try:
-        set_error_to_allowed()
-        transpile_result = transpile_inner(
-            input_string, level, lang, populate_source_map=True, unused_allowed=unused_allowed
-        )
-    finally:
-        # make sure to always revert IsValid methods to original
-        set_errors_to_original()
 
-    # If transpiled successfully while allowing errors, transpile mapped code again to get original error
+ParseResult = namedtuple('ParseResult', ['code', 'source_map', 'has_turtle',
+                                         'has_pressed', 'has_clear', 'has_music', 'has_sleep', 'commands',
+                                         'roles_of_variables'])
+
+
+def transpile_inner_with_skipping_faulty(input_string, level, lang="en", unused_allowed=True):
+    transpile_result = transpile_inner(
+        input_string, level, lang, populate_source_map=True, unused_allowed=unused_allowed, skip_faulty=True
+    )
+
+    # The error productions found while transpiling tell us the original error of most skipped code.
+    # Skipped code without one is transpiled on its own to get its original error.
     # If none is found, raise error so that original error will be returned
     at_least_one_error_found = False
+    source_map = transpile_result.source_map
 
     for hedy_source_code, python_source_code in source_map.map.copy().items():
         if hedy_source_code.error is not None or python_source_code.code == 'pass':
-            try:
-                transpile_inner(hedy_source_code.code, source_map.level, source_map.language)
-            except Exception as e:
-                hedy_source_code.error = e
+            skipped_error = source_map.get_skipped_error_in_range(hedy_source_code.source_range)
+            if skipped_error is not None:
+                hedy_source_code.error = skipped_error
+            else:
+                try:
+                    transpile_inner(hedy_source_code.code, source_map.level, source_map.language)
+                except exceptions.TranspileBudgetExceededException:
+                    raise
+                except Exception as e:
+                    hedy_source_code.error = e
 
             if hedy_source_code.error is not None:
                 at_least_one_error_found = True
@@ -3690,22 +3917,121 @@ def transpile(input_string, level, lang="en", skip_faulty=True, is_debug=False,
     The second time, after the non-skipping approach raised an exception,
     we try transpile the code with skipping faulty code, if skip_faulty is True.
     After that either the partial program is returned or the original error
+
+    If the transpile cache is enabled, the outcome of transpiling the same program before is reused.
     """
+    if transpile_cache.is_enabled():
+        return transpile_cache.cached_transpile(transpile_uncached, input_string, level, lang, skip_faulty,
+                                                is_debug, unused_allowed, microbit)
+    return transpile_uncached(input_string, level, lang, skip_faulty, is_debug, unused_allowed, microbit)
+
+
+def transpile_uncached(input_string, level, lang="en", skip_faulty=True, is_debug=False, unused_allowed=False,
+                       microbit=False):
+    with transpile_budget.limit():
+        return transpile_within_budget(input_string, level, lang, skip_faulty, is_debug, unused_allowed, microbit)
+
 
+def transpile_many(programs, processes=None):
+    """Transpile many programs, in a pool of processes so that a batch job uses all the cores of the machine.
+
+    `programs` is an iterable of (code, level, lang) tuples. For every program in it, in the same order, a
+    (result, exception) pair is yielded as soon as it is ready: the ParseResult of `transpile` and None, or None and
+    the exception it raised. Programs with the same code, level and language are transpiled once, and get the same
+    result. With `processes=1` or when there is a single program to transpile, no pool is started.
+
+    This deduplication is on top of the transpile cache (see transpile_cache), which `transpile` still goes through:
+    it also saves sending the duplicates to the workers, and works when the cache is not enabled.
+    """
+    programs = list(programs)
+    unique_programs = list(dict.fromkeys(programs))
+    # the number of times the result of a program is still to be yielded, so it is dropped after the last one
+    remaining = collections.Counter(programs)
+
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(unique_programs) < 2:
+        yield from _yield_in_order(programs, remaining, map(_transpile_outcome, unique_programs))
+        return
+
+    # every worker creates the parsers of the batch up front, so the first programs of each level do not have to.
+    # The bundle is indexed here, and the workers only get the entries of the parsers of the batch, which they read
+    # from the bundle directory themselves. The skip faulty parsers are only read when a faulty program needs them.
+    parsers = sorted({(level, lang) for _, level, lang in unique_programs}, key=str)
+    if not hedy_parser_bundle.PARSERS:
+        hedy_parser_bundle.load()
+    bundle_entries = _get_bundle_entries(parsers)
+    chunksize = max(1, len(unique_programs) // (processes * 4))
+    with multiprocessing.Pool(min(processes, len(unique_programs)), _load_parsers, (parsers, bundle_entries)) as pool:
+        outcomes = pool.imap(_transpile_outcome, unique_programs, chunksize)
+        yield from _yield_in_order(programs, remaining, outcomes)
+
+
+def _yield_in_order(programs, remaining, outcomes):
+    # The outcomes are in the order of the first occurrence of every program, so the outcome of a program is either
+    # received already, or it is the next one.
+    received = {}
+    for program in programs:
+        if program not in received:
+            received[program] = next(outcomes)
+        outcome = received[program]
+        remaining[program] -= 1
+        if remaining[program] == 0:
+            del received[program]
+        yield outcome
+
+
+def _get_bundle_entries(parsers):
+    # a faulty program is transpiled again with the skip faulty parser, if skipping faulty code is enabled
+    skip_faulty_options = [False, True] if getenv('ENABLE_SKIP_FAULTY', False) else [False]
+    entries = {}
+    for level, lang in parsers:
+        for skip_faulty in skip_faulty_options:
+            try:
+                unique_parser_hash = _get_unique_parser_hash_for_level(level, lang, False, skip_faulty)
+            except Exception:
+                break  # an invalid level or language gives its error when the program is transpiled
+            if unique_parser_hash in hedy_parser_bundle.PARSERS:
+                entries[unique_parser_hash] = hedy_parser_bundle.PARSERS[unique_parser_hash]
+    return entries
+
+
+def _load_parsers(parsers, bundle_entries):
+    hedy_parser_bundle.PARSERS.update(bundle_entries)
+    for level, lang in parsers:
+        try:
+            get_parser(level, lang)
+        except Exception:
+            pass  # an invalid level or language gives its error when the program is transpiled
+
+
+def _transpile_outcome(program):
+    code, level, lang = program
+    try:
+        return transpile(code, level, lang), None
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            # the exception has to be sent back to the main process, keep what can be sent
+            e = Exception(f'{type(e).__name__}: {e}')
+        return None, e
+
+
+def transpile_within_budget(input_string, level, lang, skip_faulty, is_debug, unused_allowed, microbit):
     try:
-        source_map.set_skip_faulty(False)
         transpile_result = transpile_inner(input_string, level, lang, populate_source_map=True,
                                            is_debug=is_debug, unused_allowed=unused_allowed, microbit=microbit)
 
     except Exception as original_error:
-        hedy_amount_lines = len(input_string.strip().split('\n'))
+        hedy_amount_lines = input_string.strip().count('\n') + 1
 
         if getenv('ENABLE_SKIP_FAULTY', False) and skip_faulty and hedy_amount_lines > 1:
-            if isinstance(original_error, source_map.exceptions_not_to_skip):
+            if isinstance(original_error, SourceMap.exceptions_not_to_skip):
                 raise original_error
             try:
-                source_map.set_skip_faulty(True)
                 transpile_result = transpile_inner_with_skipping_faulty(input_string, level, lang)
+            except exceptions.TranspileBudgetExceededException:
+                raise
             except Exception:
                 raise original_error  # we could not skip faulty code, raise original exception
         else:
@@ -3749,53 +4075,100 @@ def beautify_parse_error(character_found):
     return character_found
 
 
-def find_indent_length(line):
-    number_of_spaces = 0
-    for x in line:
-        if x == ' ':
-            number_of_spaces += 1
-        else:
-            break
-    return number_of_spaces
-
-
-def line_requires_indentation(line, lang):
-    # this is done a bit half-assed, clearly *parsing* the one line would be superior
-    # because now a line like `repeat is 5` would also require indentation!
-
-    line = line.lstrip()  # remove spaces since also `    for    ` requires indentation
-    if lang not in indent_keywords.keys():  # some language like Greek or Czech do not have local keywords
-        lang = 'en'
-
-    local_indent_keywords = indent_keywords[lang]
-
-    for k in local_indent_keywords:
-        # does the line start with this keyword?
-        # We can't just split since some langs like French have keywords containing a space
-        # We also have to check space/lineending/: after or forward 100 wil also require indentation
-        end_of_line_or_word = (len(line) > len(k) and (
-            line[len(k)] == " " or line[len(k)] == ":")) or len(line) == len(k)
-        if end_of_line_or_word and line[:len(k)] == k:
-            return True
-    return False
-
+@dataclass(frozen=True)
+class LineKeywords:
+    """The keywords that the line tokenizer looks for in a language, in English and in the language itself."""
+    # without local keywords, a keyword does not have to be followed by a space to be found at the start of a line
+    has_local_keywords: bool
+    if_: tuple
+    else_: tuple
+    repeat: tuple
+    times: tuple
+    is_: tuple
+    # finds the lines that can be an if, possibly after a repeat: the lines with the first word of an if keyword
+    maybe_if: re.Pattern
+    # commands which, on the line of an if, show that the line is not just a condition
+    commands: tuple
+    pressed: tuple
+    # matches the start of a line that requires the next line to be indented
+    indent: re.Pattern
+
+
+@cache
+def get_line_keywords(lang):
+    has_local_keywords = lang in ALL_KEYWORD_LANGUAGES
+
+    def keywords(*commands):
+        if not has_local_keywords:
+            return commands
+        local_keywords = hedy_translation.keywords_to_dict_single_choice(lang)
+        return tuple(k for c in commands for k in (c, local_keywords.get(c)) if k is not None)
+
+    keywords_in_lang = KEYWORDS.get(lang, KEYWORDS['en'])
+    # some languages like Greek or Czech do not have local keywords
+    local_indent_keywords = indent_keywords[lang] if lang in indent_keywords else indent_keywords['en']
+    # We can't just split since some langs like French have keywords containing a space
+    # We also have to check space/lineending/: after or forward 100 wil also require indentation
+    indent = '|'.join(re.escape(k) for k in local_indent_keywords if k is not None)
+
+    if_ = keywords('if')
+    return LineKeywords(
+        has_local_keywords=has_local_keywords,
+        if_=if_,
+        else_=keywords('else'),
+        repeat=('repeat', keywords_in_lang.get('repeat')),
+        times=('times', keywords_in_lang.get('times')),
+        is_=keywords('is'),
+        maybe_if=re.compile('|'.join(re.escape(k.split()[0]) for k in if_)),
+        commands=keywords('print', 'ask', 'forward', 'turn', 'play'),
+        pressed=keywords('pressed'),
+        indent=re.compile(f'(?:{indent})(?=[ :]|\\Z)'),
+    )
+
+
+class ProcessedInput(str):
+    """A program as it comes out of process_input_string. It keeps its lines, so later stages do not split it again."""
+
+    def __new__(cls, text, lines=None):
+        program = super().__new__(cls, text)
+        program.lines = tuple(text.split('\n') if lines is None else lines)
+        return program
+
+
+def get_lines(input_string):
+    return input_string.lines if isinstance(input_string, ProcessedInput) else input_string.split('\n')
+
+
+def tokenize_lines(code, level, lang, complete_ifs=True):
+    """Split the program in lines and prepare them for the parser, in a single pass:
+    - in levels 5 to 7 we do not allow if without else, so an empty else is added to an if that has none
+    - from level 8 on, the indentation is checked and an #ENDBLOCK is added at the end of every block
+    Returns the lines of the prepared program."""
+    lines = code.split('\n')
+    complete_ifs = complete_ifs and 5 <= level < hedy.LEVEL_STARTING_INDENTATION
+    find_blocks = level >= hedy.LEVEL_STARTING_INDENTATION
+    if not complete_ifs and not find_blocks:
+        return lines
 
-def preprocess_blocks(code, level, lang):
+    keywords = get_line_keywords(lang)
     processed_code = []
-    lines = code.split("\n")
     current_number_of_indents = 0
     previous_number_of_indents = 0
     indent_size = 4  # set at 4 for now
     indent_size_adapted = False  # FH We can remove this now since we changed in indenter a bit in Nov 2022
-    line_number = 0
     next_line_needs_indentation = False
-    for line in lines:
-        if ' _ ' in line or line == '_':
-            raise hedy.exceptions.CodePlaceholdersPresentException(line_number=line_number + 1)
 
-        leading_spaces = find_indent_length(line)
+    for line_number, line in enumerate(lines, start=1):
+        if complete_ifs:
+            # the last line can have an if without else, that is no problem
+            if line_number < len(lines) and keywords.maybe_if.search(line) and \
+                    if_needs_else(lines, line_number - 1, keywords):
+                # add a nop (like 'Pass' but we just insert a meaningless assign)
+                line = line + " else x__x__x__x is 5"
+            processed_code.append(line)
+            continue
 
-        line_number += 1
+        leading_spaces = len(line) - len(line.lstrip(' '))
 
         # ignore whitespace-only lines
         if leading_spaces == len(line):
@@ -3803,8 +4176,7 @@ def preprocess_blocks(code, level, lang):
             continue
 
         # ignore lines that contain only a comment
-        comment_reg_ex = r' *\#[^\n]*'
-        if regex.fullmatch(comment_reg_ex, line):
+        if line[leading_spaces] == '#':
             processed_code.append(line)
             continue
 
@@ -3844,15 +4216,11 @@ def preprocess_blocks(code, level, lang):
         if current_number_of_indents < previous_number_of_indents:
             # we are dedenting ('jumping back) so we need to and an end-block
             # (multiple if multiple dedents are happening)
+            processed_code[-1] += '#ENDBLOCK' * (previous_number_of_indents - current_number_of_indents)
 
-            difference_in_indents = (previous_number_of_indents - current_number_of_indents)
-            for i in range(difference_in_indents):
-                processed_code[-1] += '#ENDBLOCK'
-
-        if line_requires_indentation(line, lang):
-            next_line_needs_indentation = True
-        else:
-            next_line_needs_indentation = False
+        # this is done a bit half-assed, clearly *parsing* the one line would be superior
+        # because now a line like `repeat is 5` would also require indentation!
+        next_line_needs_indentation = keywords.indent.match(line.lstrip()) is not None
 
         # save to compare for next line
         previous_number_of_indents = current_number_of_indents
@@ -3862,9 +4230,9 @@ def preprocess_blocks(code, level, lang):
 
     # if the last line is indented, the end of the program is also the end of all indents
     # so close all blocks
-    for i in range(current_number_of_indents):
-        processed_code[-1] += '#ENDBLOCK'
-    return "\n".join(processed_code)
+    if find_blocks:
+        processed_code[-1] += '#ENDBLOCK' * current_number_of_indents
+    return processed_code
 
 
 def raise_too_many_indents_error(line_number, leading_spaces, indent_size, fixed_code, level):
@@ -3885,124 +4253,63 @@ def raise_too_few_indents_error(line_number, leading_spaces, indent_size, fixed_
                                                      indent_size=indent_size, fixed_code=fixed_code)
 
 
-def preprocess_ifs(code, lang='en'):
-    processed_code = []
-    lines = code.split("\n")
-
-    def starts_with(command, line):
-        if lang in ALL_KEYWORD_LANGUAGES:
-            command_plus_translated_command = [command, KEYWORDS[lang].get(command)]
-            for c in command_plus_translated_command:
-                #  starts with the keyword and next character is a space
-                if line[0:len(c)] == c and (len(c) == len(line) or line[len(c)] == ' '):
-                    return True
-            return False
-        else:
-            return line[0:len(command)] == command
-
-    def starts_with_after_repeat(command, line):
-        elements_in_line = line.split()
-        keywords_in_lang = KEYWORDS.get(lang, KEYWORDS['en'])
-        repeat_plus_translated = ['repeat', keywords_in_lang.get('repeat')]
-        times_plus_translated = ['times', keywords_in_lang.get('times')]
-
-        if len(elements_in_line) > 2 and elements_in_line[0] in repeat_plus_translated and elements_in_line[
-                2] in times_plus_translated:
-            line = ' '.join(elements_in_line[3:])
-
-        if lang in ALL_KEYWORD_LANGUAGES:
-            command_plus_translated_command = [command, KEYWORDS[lang].get(command)]
-            for c in command_plus_translated_command:
-                #  starts with the keyword and next character is a space
-                if line[0:len(c)] == c and (len(c) == len(line) or line[len(c)] == ' '):
-                    return True
-            return False
-        else:
-            return line[0:len(command)] == command
-
-    def contains(command, line):
-        if lang in ALL_KEYWORD_LANGUAGES:
-            if not command == '=':
-                command_plus_translated_command = [command, KEYWORDS[lang].get(command)]
-            else:
-                command_plus_translated_command = [command]
-            for c in command_plus_translated_command:
-                if c in line:
-                    return True
-            return False
-        else:
-            return command in line
-
-    def contains_two(command, line):
-        if lang in ALL_KEYWORD_LANGUAGES:
-            command_plus_translated_command = [command, KEYWORDS[lang].get(command)]
-            for c in command_plus_translated_command:
-                if line.count(
-                        ' ' + c + ' ') >= 2:  # surround in spaces since we dont want to mathc something like 'dishwasher is sophie'
-                    return True
-            return False
+def if_needs_else(lines, i, keywords):
+    """Whether the line is an if with a second command but without else, and the next non-empty line is not an else
+    either."""
+    line = lines[i]
+    if not (_starts_with_keyword(keywords.if_, line, keywords) or
+            _starts_with_keyword(keywords.if_, _skip_repeat(line, keywords), keywords)):
+        return False
+    if _contains_any_of(keywords.else_, line):
+        return False
 
-    def contains_any_of(commands, line):
-        # translation is not needed here, happens in contains
-        if lang in ALL_KEYWORD_LANGUAGES:
-            for c in commands:
-                if contains(c, line):
-                    return True
-            return False
-        else:
-            for c in commands:
-                if contains(c, line):
-                    return True
-            return False
+    # is this line just a condition and no other keyword (because that is no problem)
+    # surround is in spaces since we dont want to match something like 'dishwasher is sophie'
+    contains_two_is = keywords.has_local_keywords and any(line.count(f' {w} ') >= 2 for w in keywords.is_)
+    has_second_command = (_contains_any_of(keywords.commands, line) or contains_two_is
+                          or (_contains_any_of(keywords.is_, line) and '=' in line))
+    if not has_second_command or _contains_any_of(keywords.pressed, line):
+        return False
 
-    def next_non_empty_line(lines, start_line_number):
-        if start_line_number > len(lines):
-            return ''  # end of code, return empty so that starts_with doesnt find anything
-        else:
-            for i in range(start_line_number + 1, len(lines)):
-                if lines[i] == '':
-                    continue
-                else:
-                    return lines[i]
+    # a second command, but also no else in this line -> check next line!
+    next_non_empty_line = next((lines[j] for j in range(i + 1, len(lines)) if lines[j] != ''), '')
+    return not _starts_with_keyword(keywords.else_, next_non_empty_line, keywords)
 
-        return ''  # nothing found? return empty so that starts_with doesnt find anything
 
-    for i in range(len(lines) - 1):
-        line = lines[i]
+def _starts_with_keyword(words, line, keywords):
+    for word in words:
+        #  starts with the keyword and next character is a space
+        if line.startswith(word) and (not keywords.has_local_keywords or len(word) == len(line) or
+                                      line[len(word)] == ' '):
+            return True
+    return False
 
-        # if this line starts with if but does not contain an else, and the next non-empty line too is not an else.
-        if (starts_with('if', line) or starts_with_after_repeat('if', line)) and (
-                not starts_with('else', next_non_empty_line(lines, i))) and (not contains('else', line)):
-            # is this line just a condition and no other keyword (because that is no problem)
-            commands = ["print", "ask", "forward", "turn", "play"]
-            excluded_commands = ["pressed"]
 
-            if (
-                (contains_any_of(commands, line) or contains_two('is', line)
-                 or (contains('is', line) and contains('=', line)))
-                and not contains_any_of(excluded_commands, line)
-            ):
-                # a second command, but also no else in this line -> check next line!
+def _contains_any_of(words, line):
+    for word in words:
+        if word in line:
+            return True
+    return False
 
-                # no else in next line?
-                # add a nop (like 'Pass' but we just insert a meaningless assign)
-                line = line + " else x__x__x__x is 5"
 
-        processed_code.append(line)
-    processed_code.append(lines[-1])  # always add the last line (if it has if and no else that is no problem)
-    return "\n".join(processed_code)
+def _skip_repeat(line, keywords):
+    """Returns the command after `repeat n times` if the line starts with that, the line itself otherwise."""
+    elements_in_line = line.split()
+    if len(elements_in_line) > 2 and elements_in_line[0] in keywords.repeat and elements_in_line[2] in keywords.times:
+        return ' '.join(elements_in_line[3:])
+    return line
 
 
 def location_of_first_blank(code_snippet):
     # returns 0 if the code does not contain _
     # otherwise returns the first location (line) of the blank
-    lines = code_snippet.split('\n')
-    for i in range(len(lines)):
-        code = lines[i]
-        if len(code) > 0:
-            if (" _" in code) or ("_ " in code) or (code[-1] == "_"):
-                return i + 1
-    return 0
+    locations = [code_snippet.find(blank) for blank in (' _', '_ ', '_\n')]
+    if code_snippet.endswith('_'):
+        locations.append(len(code_snippet) - 1)
+    locations = [location for location in locations if location != -1]
+    if not locations:
+        return 0
+    return code_snippet.count('\n', 0, min(locations)) + 1
 
 
 def check_program_size_is_valid(input_string):
@@ -4022,25 +4329,17 @@ def process_input_string(input_string, level, lang, preprocess_ifs_enabled=True)
     if level >= 4:
         result = result.replace("\\", "\\\\")
 
-    # In levels 5 to 7 we do not allow if without else, we add an empty print to make it possible in the parser
-    if level >= 5 and level < 8 and preprocess_ifs_enabled:
-        result = preprocess_ifs(result, lang)
-
-    # In level 8 we add indent-dedent blocks to the code before parsing
-    if level >= hedy.LEVEL_STARTING_INDENTATION:
-        result = preprocess_blocks(result, level, lang)
-
-    return result
+    lines = tokenize_lines(result, level, lang, preprocess_ifs_enabled)
+    return ProcessedInput('\n'.join(lines), lines)
 
 
-def parse_input(input_string, level, lang):
-    parser = get_parser(level, lang, skip_faulty=source_map.skip_faulty)
+def parse_input(input_string, level, lang, skip_faulty=False):
+    parser = get_parser(level, lang, skip_faulty=skip_faulty)
     try:
-        parse_result = parser.parse(input_string + '\n')
+        parse_result = parser.parse(transpile_budget.budgeted(input_string + '\n'))
         return parse_result.children[0]  # getting rid of the root could also be done in the transformer would be nicer
     except lark.UnexpectedEOF:
-        lines = input_string.split('\n')
-        last_line = len(lines)
+        last_line = len(get_lines(input_string))
         raise exceptions.UnquotedEqualityCheckException(line_number=last_line)
     except UnexpectedCharacters as e:
         try:
@@ -4062,10 +4361,140 @@ def parse_input(input_string, level, lang):
             raise e
 
 
-def is_program_valid(program_root, input_string, level, lang):
+def parse_input_incrementally(input_string, level, lang, skip_faulty=False):
+    """Parse the program chunk by chunk, reusing the parse trees of chunks that were parsed before.
+
+    Students often change one line and run their program again, so most of the chunks are unchanged. A chunk is a
+    top-level statement together with its block, and the `else` or `elif` that follows it. Before level 8 there are no
+    blocks, so most chunks are a single line, and many lines are the same in the programs of all students. The trees
+    of the chunks are shifted to their position in the program and joined under one program node, which gives the
+    same tree as parsing the whole program. If anything is off, e.g. a chunk has a parse error or an error production,
+    the whole program is parsed so that the same error is raised.
+    """
+    chunks = split_into_chunks(input_string, level, lang)
+    if len(chunks) < 2:
+        return parse_input(input_string, level, lang, skip_faulty)
+
+    children = []
+    line_offset = 0
+    pos_offset = 0
+    try:
+        for i, chunk in enumerate(chunks):
+            is_last = i == len(chunks) - 1
+            root, has_error = _parse_chunk(chunk + '\n' if is_last else chunk, level, lang, skip_faulty)
+            # How the parser resolves an error production can depend on the rest of the program, e.g. from level 5
+            # an invalid command is only parsed as such at the start of the program
+            if has_error:
+                raise ValueError('Chunk with an error production')
+            root = _shifted_copy(root, line_offset, pos_offset)
+            if i == 0:
+                first_meta = root.meta
+            children.extend(root.children)
+            line_offset += chunk.count('\n')
+            pos_offset += len(chunk)
+        last_meta = root.meta
+        if first_meta.empty or last_meta.empty:
+            raise ValueError('Chunk without position')
+    except exceptions.TranspileBudgetExceededException:
+        raise
+    except Exception:
+        return parse_input(input_string, level, lang, skip_faulty)
+
+    program = Tree('program', children)
+    for attribute in ['line', 'column', 'start_pos', 'container_line', 'container_column']:
+        setattr(program.meta, attribute, getattr(first_meta, attribute))
+    for attribute in ['end_line', 'end_column', 'end_pos', 'container_end_line', 'container_end_column']:
+        setattr(program.meta, attribute, getattr(last_meta, attribute))
+    program.meta.empty = False
+    return program
+
+
+def split_into_chunks(input_string, level, lang):
+    """Split the program in chunks that can be parsed on their own. Every line that is empty, indented, a comment
+    (which can also carry the end of a block) or starts with `else` or `elif` belongs to the chunk before it.
+
+    Before level 8 an `if` can span several unindented lines, and how the parser resolves the ambiguity of its `else`
+    depends on the lines before it. Programs with an `if` or `else` are therefore one chunk on these levels."""
+    if level < LEVEL_STARTING_INDENTATION:
+        if _get_if_or_else_line_pattern(lang).search(input_string):
+            return [input_string]
+
+    lines = [line + '\n' for line in get_lines(input_string)]
+    lines[-1] = lines[-1][:-1]
+    continuation_keywords = _get_keyword_values(lang, ('else', 'elif'))
+
+    chunks = []
+    for line in lines:
+        continues_chunk = (line.strip() == '' or line[0].isspace() or line.startswith('#') or
+                           line.startswith(continuation_keywords))
+        if chunks and continues_chunk:
+            chunks[-1] += line
+        else:
+            chunks.append(line)
+    return chunks
+
+
+@cache
+def _get_if_or_else_line_pattern(lang):
+    """Matches the lines that start with an if or else keyword, possibly after `repeat n times`. An else that is not at
+    the start of a line is on the line of its if. Words like 'different' or 'gift' are not keywords."""
+    def alternatives(*keywords):
+        return '|'.join(re.escape(k) for k in sorted(_get_keyword_values(lang, keywords), key=len, reverse=True))
+
+    return re.compile(rf'^[ \t]*(?:(?:{alternatives("repeat")})[ \t]+\S+[ \t]+(?:{alternatives("times")})[ \t]+)?'
+                      rf'(?:{alternatives("if", "else")})(?=\s|$)', re.MULTILINE)
+
+
+@cache
+def _get_keyword_values(lang, keywords):
+    values = []
+    for keyword_lang in {'en', lang}:
+        if keyword_lang in ALL_KEYWORD_LANGUAGES:
+            translations = hedy_translation.keyword_alternatives(keyword_lang)
+            for keyword in keywords:
+                values += translations[keyword]
+    return tuple(value for value in values if value)
+
+
+# Most chunks are a single line before level 8, and the same lines occur in the programs of many students
+@lru_cache(maxsize=10000)
+def _parse_chunk(chunk, level, lang, skip_faulty):
+    """Returns the parse tree of the chunk, and whether it contains an error production."""
+    parser = get_parser(level, lang, skip_faulty=skip_faulty)
+    root = parser.parse(transpile_budget.budgeted(chunk)).children[0]
+    return root, any(node.data.startswith('error_') for node in root.iter_subtrees())
+
+
+def _shifted_copy(node, line_offset, pos_offset):
+    """Copy a parse tree, moving all positions down by the given number of lines and characters. The cached trees
+    are never changed, so the metas and tokens are copied as well."""
+    if isinstance(node, Token):
+        if node.line is None:
+            return node
+        return Token(node.type, node.value, node.start_pos + pos_offset, node.line + line_offset, node.column,
+                     node.end_line + line_offset, node.end_column, node.end_pos + pos_offset)
+    if not isinstance(node, Tree):
+        return node
+
+    tree = Tree(node.data, [_shifted_copy(child, line_offset, pos_offset) for child in node.children])
+    meta = tree.meta
+    meta.__dict__.update(node.meta.__dict__)
+    if not meta.empty:
+        for attribute in ['line', 'end_line', 'container_line', 'container_end_line']:
+            if hasattr(meta, attribute):
+                setattr(meta, attribute, getattr(meta, attribute) + line_offset)
+        for attribute in ['start_pos', 'end_pos']:
+            if hasattr(meta, attribute):
+                setattr(meta, attribute, getattr(meta, attribute) + pos_offset)
+    return tree
+
+
+def is_program_valid(program_root, input_string, level, lang, skip_faulty=False):
     # IsValid raises the appropriate exception when an error production (starting with error_)
-    # is found in the parse tree
-    IsValid(level, lang, input_string).transform(program_root)
+    # is found in the parse tree. When skipping faulty code, the exceptions are returned with their location instead.
+    is_valid = IsValid(level, lang, input_string, skip_faulty)
+    is_valid.transform(program_root)
+    return is_valid.skipped_errors
 
 
 def repair_leading_space(input_string, lang, level, line):
@@ -4077,6 +4506,8 @@ def repair_leading_space(input_string, lang, level, line):
             result = fixed_result
             raise exceptions.InvalidSpaceException(
                 level=level, line_number=line, fixed_code=fixed_code, fixed_result=result)
+        except exceptions.TranspileBudgetExceededException:
+            raise
         except exceptions.HedyException as E:
             if type(E) is not exceptions.InvalidSpaceException:
                 transpile_inner(fixed_code, level)
@@ -4084,8 +4515,8 @@ def repair_leading_space(input_string, lang, level, line):
     return fixed_code, result
 
 
-def is_program_complete(abstract_syntax_tree, level):
-    is_complete = IsComplete(level).transform(abstract_syntax_tree)
+def check_program_complete(is_complete, level):
+    """Raises an error for the first incomplete command, given the result of IsComplete."""
     if not is_complete[0]:
         incomplete_command_and_line = is_complete[1][0]
         incomplete_command = incomplete_command_and_line[0]
@@ -4094,38 +4525,80 @@ def is_program_complete(abstract_syntax_tree, level):
                                                     line_number=line)
 
 
-def create_lookup_table(abstract_syntax_tree, level, lang, input_string, has_pressed):
+def create_lookup_table(abstract_syntax_tree, level, lang, input_string, has_pressed, skip_faulty=False):
     visitor = LookupEntryCollector(level, has_pressed)
     visitor.visit_topdown(abstract_syntax_tree)
+    return validate_lookup_table(visitor, abstract_syntax_tree, level, lang, input_string, skip_faulty)
+
+
+def validate_lookup_table(visitor, abstract_syntax_tree, level, lang, input_string, skip_faulty=False):
+    """Creates the lookup table from the entries collected by a LookupEntryCollector, and infers and validates
+    the types of the program."""
+    visitor.check_calls()
     lookup_table = LookupTable(visitor.local_scopes, visitor.lookup_entries)
 
-    TypeValidator(lookup_table, level, lang, input_string).transform(abstract_syntax_tree)
+    TreeWalk(TypeValidator(lookup_table, level, lang, input_string, skip_faulty)).walk(abstract_syntax_tree)
 
     return lookup_table
 
 
-def create_AST(input_string, level, lang="en"):
-    program_root = parse_input(input_string, level, lang)
+@dataclass
+class ProgramAnalysis:
+    """The results of parsing and analysing a program once. The transpiler, the roles of variables detection and
+    the unused variables check all work on the same analysis, so the program is parsed only once per transpile."""
+    input_string: str
+    level: int
+    lang: str
+    program_root: Tree
+    abstract_syntax_tree: Tree
+    lookup_table: LookupTable
+    commands: list
+    # the errors of the error productions which were skipped, with their location
+    skipped_errors: list = field(default_factory=list)
+
+    @property
+    def has_pressed(self):
+        return "if_pressed" in self.commands or "if_pressed_else" in self.commands
+
+
+def analyze_program(input_string, level, lang="en", skip_faulty=False):
+    if getenv('ENABLE_INCREMENTAL_PARSE', False):
+        program_root = parse_input_incrementally(input_string, level, lang, skip_faulty)
+    else:
+        program_root = parse_input(input_string, level, lang, skip_faulty)
+
+    # The analysis passes are fused in as few walks as possible, each walk needs the complete result of the one before:
+    # 1. on the parse tree: checks whether any error production nodes are present, collects the commands (FH, dec
+    #    2023: AllCommands should one day work on the AST) and extracts the AST
+    # 2. on the AST: checks whether all commands are complete and collects the entries of the lookup table
+    # 3. on the AST: infers and validates the types with the lookup table
+    is_valid = IsValid(level, lang, input_string, skip_faulty)
+    _, commands, abstract_syntax_tree = TreeWalk(is_valid, AllCommands(level), ExtractAST()).walk(program_root)
+    skipped_errors = is_valid.skipped_errors
+    has_pressed = "if_pressed" in commands or "if_pressed_else" in commands
 
-    # checks whether any error production nodes are present in the parse tree
-    is_program_valid(program_root, input_string, level, lang)
-    abstract_syntax_tree = ExtractAST().transform(program_root)
-    is_program_complete(abstract_syntax_tree, level)
+    lookup_entry_collector = LookupEntryCollector(level, has_pressed)
+    is_complete = TreeWalk(IsComplete(level), lookup_entry_collector).walk(abstract_syntax_tree)[0]
+    check_program_complete(is_complete, level)
 
     if not valid_echo(abstract_syntax_tree):
         raise exceptions.LonelyEchoException()
 
-    commands = AllCommands(level).transform(program_root)
-    # FH, dec 2023. I don't love how AllCommands works on program root and not on AST,
-    # but his will do for now. One day we should really start to clean up our AST!
-    has_pressed = "if_pressed" in commands or "if_pressed_else" in commands
-    lookup_table = create_lookup_table(abstract_syntax_tree, level, lang, input_string, has_pressed)
+    lookup_table = validate_lookup_table(lookup_entry_collector, abstract_syntax_tree, level, lang, input_string,
+                                         skip_faulty)
+
+    return ProgramAnalysis(input_string, level, lang, program_root, abstract_syntax_tree, lookup_table, commands,
+                           skipped_errors)
+
 
-    return abstract_syntax_tree, lookup_table, commands
+def create_AST(input_string, level, lang="en"):
+    analysis = analyze_program(input_string, level, lang)
+    return analysis.abstract_syntax_tree, analysis.lookup_table, analysis.commands
 
 
-def determine_roles(lookup, input_string, level, lang):
-    all_vars = all_variables(input_string, level, lang)
+def determine_roles(analysis):
+    lookup = analysis.lookup_table
+    all_vars = variables_in_lookup(lookup)
     roles_dictionary = {}
     for var in all_vars:
         assignments = [x for x in lookup.get_all() if x.name == var]
@@ -4147,8 +4620,16 @@ def determine_roles(lookup, input_string, level, lang):
     return roles_dictionary
 
 
+def check_unused_variables(analysis, python, parse_result):
+    for x in analysis.lookup_table.get_all():
+        if isinstance(x.name, str) and x.access_line is None and x.name != 'x__x__x__x':
+            x.name = re.sub(r'^_', '', x.name)
+            raise hedy.exceptions.UnusedVariableException(
+                analysis.level, x.definition_line, x.name, fixed_code=python, fixed_result=parse_result)
+
+
 def transpile_inner(input_string, level, lang="en", populate_source_map=False, is_debug=False, unused_allowed=False,
-                    microbit=False):
+                    microbit=False, skip_faulty=False):
     check_program_size_is_valid(input_string)
     input_string = process_input_string(input_string, level, lang)
 
@@ -4156,26 +4637,26 @@ def transpile_inner(input_string, level, lang="en", populate_source_map=False, i
     if level > HEDY_MAX_LEVEL:
         raise Exception(f'Levels over {HEDY_MAX_LEVEL} not implemented yet')
 
-    if populate_source_map:
-        source_map.clear()
-        source_map.set_level(level)
-        source_map.set_language(lang)
-        source_map.set_hedy_input(input_string)
+    # every transpilation fills its own source map, so concurrent transpilations do not interfere
+    source_map = SourceMap(level, lang, input_string, skip_faulty)
 
     try:
-        abstract_syntax_tree, lookup_table, commands = create_AST(input_string, level, lang)
+        analysis = analyze_program(input_string, level, lang, skip_faulty)
+        source_map.set_skipped_errors(analysis.skipped_errors)
+        commands = analysis.commands
 
         has_clear = "clear" in commands
         has_turtle = "forward" in commands or "turn" in commands or "color" in commands
-        has_pressed = "if_pressed" in commands or "if_pressed_else" in commands
+        has_pressed = analysis.has_pressed
         has_music = "play" in commands
         has_sleep = "sleep" in commands
 
         # grab the right transpiler from the lookup
         convertToPython = MICROBIT_TRANSPILER_LOOKUP[level] if microbit else TRANSPILER_LOOKUP[level]
-        python = convertToPython(lookup_table, lang, is_debug, has_pressed).transform(abstract_syntax_tree)
+        python = str(convertToPython(analysis.lookup_table, lang, is_debug, has_pressed, source_map).transform(
+            analysis.abstract_syntax_tree))
 
-        roles_of_variables = determine_roles(lookup_table, input_string, level, lang)
+        roles_of_variables = determine_roles(analysis)
 
         parse_result = ParseResult(python, source_map, has_turtle, has_pressed,
                                    has_clear, has_music, has_sleep, commands, roles_of_variables)
@@ -4184,11 +4665,7 @@ def transpile_inner(input_string, level, lang="en", populate_source_map=False, i
             source_map.set_python_output(python)
 
         if not unused_allowed:
-            for x in lookup_table.get_all():
-                if isinstance(x.name, str) and x.access_line is None and x.name != 'x__x__x__x':
-                    x.name = re.sub(r'^_', '', x.name)
-                    raise hedy.exceptions.UnusedVariableException(
-                        level, x.definition_line, x.name, fixed_code=python, fixed_result=parse_result)
+            check_unused_variables(analysis, python, parse_result)
 
         return parse_result
     except VisitError as E:
@@ -5,7 +5,7 @@ from os import path
 import static_babel_content
 
 from utils import customize_babel_locale
-from website.yaml_file import YamlFile
+from website.yaml_file import YamlFile, freeze
 from safe_format import safe_format
 
 logger = logging.getLogger(__name__)
@@ -566,11 +566,43 @@ class NoSuchCommand:
         return {}
 
 
+class AdventureBundle:
+    """The adventures of a language with the keywords in them translated, indexed by level. The adventures are frozen,
+    since they are shared by all requests."""
+
+    def __init__(self, adventures, version):
+        self.version = version
+        self.adventures = freeze(adventures)
+        self.names = {aid: adv['name'] for aid, adv in adventures.items()}
+        self.by_level = {}
+        for aid, adv in self.adventures.items():
+            for level in adv.get('levels', {}):
+                self.by_level.setdefault(level, {})[aid] = adv
+
+
+# Translating the keywords in all the adventures of a language takes a while, and is needed on most pages, so the
+# translated adventures are shared by all requests. They are keyed by (language, keyword language), and built again
+# when the content version of the adventures file changes. The adventures in them can not be modified, make a copy
+# first (copy.deepcopy gives plain dicts and lists).
+ADVENTURE_BUNDLES = {}
+
+
 class Adventures(StructuredDataFile):
     def __init__(self, language):
         self.language = language
         super().__init__(f'{content_dir}/adventures/{self.language}.yaml')
 
+    def get_bundle(self, keyword_lang):
+        """The adventures with the keywords translated to keyword_lang, translated once per content version."""
+        key = (self.language, keyword_lang)
+        version = self.file.content_version()
+        bundle = ADVENTURE_BUNDLES.get(key)
+        if bundle is None or bundle.version != version:
+            adventures = deep_translate_keywords(self.file.get('adventures', {}), keyword_lang)
+            bundle = AdventureBundle(adventures, version)
+            ADVENTURE_BUNDLES[key] = bundle
+        return bundle
+
     def get_adventure_keyname_name_levels(self):
         return {aid: {adv['name']: list(adv['levels'].keys())} for aid, adv in self.file.get('adventures', {}).items()}
 
@@ -618,15 +650,18 @@ class Adventures(StructuredDataFile):
                 for key in sorted(sort.keys(), key=lambda s: s.lower() if s else "")}
 
     def get_adventure_names(self, keyword_lang):
-        return {aid: adv['name'] for aid, adv in deep_translate_keywords(
-            self.file.get('adventures'), keyword_lang).items()}
+        return dict(self.get_bundle(keyword_lang).names)
 
     def get_adventures(self, keyword_lang="en"):
-        return deep_translate_keywords(self.file.get('adventures'), keyword_lang)
+        return dict(self.get_bundle(keyword_lang).adventures)
 
     def get_adventures_subset(self, subset=["print_command", "parrot"], keyword_lang="en"):
-        adventures = {aid: adv for aid, adv in self.file.get('adventures', {}).items() if aid in subset}
-        return deep_translate_keywords(adventures, keyword_lang)
+        return {aid: adv for aid, adv in self.get_bundle(keyword_lang).adventures.items() if aid in subset}
+
+    def get_adventures_for_level(self, level, keyword_lang="en", subset=None):
+        """The adventures that have the given level, with the keywords translated, optionally only those in subset."""
+        adventures = self.get_bundle(keyword_lang).by_level.get(level, {})
+        return {aid: adv for aid, adv in adventures.items() if subset is None or aid in subset}
 
     def has_adventures(self):
         return True if self.file.get('adventures') else False
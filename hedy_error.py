@@ -1,6 +1,10 @@
+import flask
+import flask_babel
 import hedy
 import hedy_translation
 import re
+from functools import lru_cache
+from types import MappingProxyType
 from website.flask_helpers import gettext_with_fallback as gettext
 
 
@@ -64,21 +68,19 @@ def _highlight(input_):
     """ Add highlight styling to the parts in the input surrounded by backticks, for example:
     '`print` is incorrect' becomes '<span class="command-highlighted">print</span> is incorrect'
     This is a simple implementation that does not allow escaping backticks. Extend it in the future if needed. """
-    quote_positions = [i for i, x in enumerate(input_) if x == "`"]
-    quotes_even = len(quote_positions) % 2 == 0
-    if not quote_positions or not quotes_even:
+    parts = input_.split('`')
+    quotes_even = len(parts) % 2 == 1
+    if len(parts) == 1 or not quotes_even:
         return input_
 
-    quote_positions.insert(0, 0)
-    result = []
-    for i, position in enumerate(quote_positions):
-        start_ = position if i == 0 else position + 1
-        end_ = quote_positions[i+1] if i + 1 < len(quote_positions) else len(input_)
-        if start_ < end_:
-            part = input_[start_:end_]
-            is_highlighted = i % 2 == 1
-            result.append(hedy.style_command(part) if is_highlighted else part)
-    return ''.join(result)
+    # the parts at odd positions are the ones between backticks
+    return ''.join(hedy.style_command(part) if i % 2 == 1 else part for i, part in enumerate(parts) if part)
+
+
+def _ui_locale():
+    """ The texts of gettext depend on the locale, and on the language of the session for the fallback to English """
+    session_lang = flask.session.get('lang') if flask.has_request_context() and flask.session else None
+    return str(flask_babel.get_locale()), session_lang
 
 
 def _get_keys(input_):
@@ -88,16 +90,27 @@ def _get_keys(input_):
 
 def _get_missing_arguments(input_, args, lang):
     """ Discover and translate keywords used in the template which are missing from the arguments, e.g. {print} """
-    matches = _get_keys(input_)
+    keyword_arguments = _get_keyword_arguments(input_, lang, _ui_locale())
+    return {k: v for k, v in keyword_arguments.items() if k not in args}
+
+
+@lru_cache(maxsize=4096)
+def _get_keyword_arguments(template, lang, ui_locale):
+    """ The keywords used in the template, translated. The templates are few, so this is only done once for each
+    template, keyword language and UI locale. """
     existing_keywords = hedy_translation.keywords_to_dict_single_choice(lang)
-    used_keys = [k for k in matches if k not in args and k in existing_keywords]
-    translated_keywords = {k: _translate_error_arg(k, lang) for k in used_keys}
-    return translated_keywords
+    used_keys = [k for k in _get_keys(template) if k in existing_keywords]
+    return MappingProxyType({k: _translate_error_arg(k, lang) for k in used_keys})
 
 
 def _extract_nested_arguments(template, lang):
+    return _get_nested_arguments(template, lang, _ui_locale())
+
+
+@lru_cache(maxsize=4096)
+def _get_nested_arguments(template, lang, ui_locale):
     used_keys = _get_keys(template)
-    return {k: _translate_error_arg(k, lang) for k in used_keys}
+    return MappingProxyType({k: _translate_error_arg(k, lang) for k in used_keys})
 
 
 def _translate_error_arg(arg, lang):
@@ -120,6 +133,18 @@ def _translate_list(args, lang):
 
 
 def _translate(v, language):
+    if isinstance(v, str):
+        # the same arguments, like the names of types and commands, occur in many errors
+        return _translate_str(v, language, _ui_locale())
+    return _translate_uncached(v, language)
+
+
+@lru_cache(maxsize=16384)
+def _translate_str(v, language, ui_locale):
+    return _translate_uncached(v, language)
+
+
+def _translate_uncached(v, language):
     translation = gettext('' + str(v))
     # if there is no translation available, probably this is a keyword
     if v == translation:
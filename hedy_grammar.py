@@ -1,6 +1,6 @@
 import re
 import warnings
-from os import path
+from os import path, getenv
 from functools import cache
 import hedy_translation
 
@@ -29,13 +29,7 @@ def create_grammar(level, lang, skip_faulty):
     """ Creates a grammar file for a chosen level and lang. Note that the language is required
     to generate regular expressions that escape keywords (with negative lookahead).
     Currently, it is only a couple of MB in total, so it is safe to cache. """
-    # start with creating the grammar for level 1
-    merged_grammars = get_full_grammar_for_level(1)
-
-    # then keep merging new grammars in
-    for lvl in range(2, level + 1):
-        grammar_text_lvl = get_additional_rules_for_level(lvl)
-        merged_grammars = merge_grammars(merged_grammars, grammar_text_lvl, lang)
+    merged_grammars = merge_grammars_up_to_level(level, lang)
 
     if skip_faulty:
         skip_faulty_grammar = read_skip_faulty_file(level)
@@ -46,12 +40,21 @@ def create_grammar(level, lang, skip_faulty):
     terminals = get_terminals()
     merged_grammars = merged_grammars + '\n' + keywords + '\n' + terminals
 
-    # ready? Save to file to ease debugging
-    # this could also be done on each merge for performance reasons
-    save_total_grammar_file(level, merged_grammars, lang)
+    # Save to file to ease debugging, if asked for
+    if getenv('SAVE_TOTAL_GRAMMARS'):
+        save_total_grammar_file(level, merged_grammars, lang)
     return merged_grammars
 
 
+@cache
+def merge_grammars_up_to_level(level, lang):
+    """ Returns the grammar of level 1 merged consecutively with the additions of all levels up to the given one.
+    The grammar of the previous level is cached, so creating the grammars of all levels merges every level once. """
+    if level == 1:
+        return get_full_grammar_for_level(1)
+    return merge_grammars(merge_grammars_up_to_level(level - 1, lang), get_additional_rules_for_level(level), lang)
+
+
 def merge_grammars(grammar_text_1, grammar_text_2, lang):
     """ Merges two grammar files into one.
     Rules that are redefined in the second file are overridden.
@@ -109,6 +112,7 @@ def write_file(content, *paths):
         file.write(content)
 
 
+@cache
 def get_keywords_for_language(language):
     try:
         return read_file('grammars', f'keywords-{language}.lark')
@@ -116,6 +120,7 @@ def get_keywords_for_language(language):
         return read_file('grammars', 'keywords-en.lark')
 
 
+@cache
 def get_terminals():
     return read_file('grammars', 'terminals.lark')
 
@@ -124,10 +129,12 @@ def save_total_grammar_file(level, grammar, lang_):
     write_file(grammar, 'grammars-Total', f'level{level}.{lang_}-Total.lark')
 
 
+@cache
 def get_additional_rules_for_level(level):
     return read_file('grammars', f'level{level}-Additions.lark')
 
 
+@cache
 def get_full_grammar_for_level(level):
     return read_file('grammars', f'level{level}.lark')
 
@@ -269,16 +276,18 @@ def expand_keyword_not_followed_by_space(**kwargs):
     return '|'.join(result)
 
 
+@cache
 def get_translated_keyword(keyword, lang):
+    """ Returns all values of a keyword in the language and in English. The result is cached, so it is a tuple. """
     def get_keyword_value_from_lang(keyword_, lang_):
-        keywords = hedy_translation.keywords_to_dict(lang_)
+        keywords = hedy_translation.keyword_alternatives(lang_)
         if keyword_ in keywords:
             return [k for k in keywords[keyword_] if k]
         else:
             raise Exception(f"The keywords yaml file for language '{lang_}' has no definition for '{keyword_}'.")
 
     translated_keyword = get_keyword_value_from_lang(keyword, lang) if lang != 'en' else []
-    return translated_keyword + get_keyword_value_from_lang(keyword, 'en')
+    return tuple(translated_keyword + get_keyword_value_from_lang(keyword, 'en'))
 
 
 PREPROCESS_RULES = {
@@ -0,0 +1,56 @@
+"""A bundle of precompiled Lark parsers for the commonly used levels and keyword languages.
+
+Creating the Earley parser of a level takes about half a second, so we create the most used ones at deploy time
+on Heroku (`doit run parser_bundle`). Every parser is stored pickled in its own file in the bundle directory. The
+gunicorn master process only indexes the directory before the workers are forked, and a worker reads the file of a
+parser the first time it needs it. The files stay in the page cache of the OS, which is shared by all workers, so no
+worker holds parsers it never uses.
+
+This module is deliberately light on imports: the gunicorn master imports it without importing the rest of the app.
+
+The parsers are stored under the hash of their grammar and options (see `hedy.get_parser`). A bundle that was
+created for other grammars is therefore harmless, none of its parsers will ever be found.
+"""
+import os
+from os import path
+
+import lark
+
+BUNDLE_DIR = path.join(path.dirname(path.abspath(__file__)), 'parser-bundle')
+VERSION_FILE = 'lark-version'
+
+# Maps the hash of a parser to the file of the pickled parser
+PARSERS = {}
+
+
+def load(directory=BUNDLE_DIR):
+    """Index the parsers of the bundle, and return how many there are.
+
+    Does nothing if the bundle does not exist or was created with another version of Lark.
+    """
+    try:
+        with open(path.join(directory, VERSION_FILE)) as f:
+            if f.read().strip() != lark.__version__:
+                return 0
+        files = os.listdir(directory)
+    except OSError:
+        return 0
+    parsers = {name[:-len('.pkl')]: path.join(directory, name) for name in files if name.endswith('.pkl')}
+    PARSERS.update(parsers)
+    return len(parsers)
+
+
+def get(parser_hash):
+    """Return the pickled parser with the given hash, or None if it is not in the bundle."""
+    filename = PARSERS.get(parser_hash)
+    if filename is None:
+        return None
+    try:
+        with open(filename, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def parser_filename(directory, parser_hash):
+    return path.join(directory, f'{parser_hash}.pkl')
@@ -1,8 +1,10 @@
+import bisect
 import re
-import textwrap
 import exceptions
+from functools import lru_cache
 from os import path
 from lark import Tree
+from python_emitter import Block, Code
 
 
 class SourceRange:
@@ -36,6 +38,10 @@ class SourceRange:
     def __repr__(self):
         return self.__str__()
 
+    def contains(self, other):
+        return ((self.from_line, self.from_column) <= (other.from_line, other.from_column) and
+                (other.to_line, other.to_column) <= (self.to_line, self.to_column))
+
     def __eq__(self, other):
         return (
             self.from_line, self.from_column,
@@ -59,12 +65,16 @@ class SourceCode:
         self.code = code
         self.error = error
         self.command_name = command_name
+        self._hash = None
 
     def __hash__(self):
-        return hash((
-            self.source_range.from_line, self.source_range.from_column,
-            self.source_range.to_line, self.source_range.to_column
-        ))
+        # the Hedy code in the keys of a source map never moves, so the hash is computed once
+        if self._hash is None:
+            self._hash = hash((
+                self.source_range.from_line, self.source_range.from_column,
+                self.source_range.to_line, self.source_range.to_column
+            ))
+        return self._hash
 
     def __eq__(self, other):
         return (
@@ -88,12 +98,95 @@ class SourceCode:
         return self.__str__()
 
 
+class SourceRangeIndex:
+    """
+    A sorted index of source ranges, used to look up the entries of a source map by their range
+
+    The ranges are sorted by their start, and a tree over the sorted ranges keeps the furthest end in each
+    subtree. To find the ranges that contain a range, we only descend in the subtrees of the ranges that start
+    before it and end after it, so a query takes logarithmic time plus the time to list the results.
+    The results are returned in the order the entries were given.
+    """
+
+    def __init__(self, entries):
+        """entries: a list of (SourceRange, value) pairs"""
+        keyed = sorted(
+            ((r.from_line, r.from_column), (r.to_line, r.to_column), order, value)
+            for order, (r, value) in enumerate(entries)
+        )
+        self._keys = [(start, end) for start, end, _, _ in keyed]
+        self._starts = [start for start, _, _, _ in keyed]
+        self._orders = [order for _, _, order, _ in keyed]
+        self._values = [value for _, _, _, value in keyed]
+
+        self._size = 1
+        while self._size < len(keyed):
+            self._size *= 2
+        self._max_ends = [(-1, -1)] * (2 * self._size)
+        for i, (_, end, _, _) in enumerate(keyed):
+            self._max_ends[self._size + i] = end
+        for node in reversed(range(1, self._size)):
+            self._max_ends[node] = max(self._max_ends[2 * node], self._max_ends[2 * node + 1])
+
+    def __len__(self):
+        return len(self._values)
+
+    def find(self, source_range: SourceRange):
+        """Returns the value of the entry with exactly this range, or None if there is no such entry"""
+        key = ((source_range.from_line, source_range.from_column), (source_range.to_line, source_range.to_column))
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return self._values[i]
+        return None
+
+    def containing(self, source_range: SourceRange):
+        """Returns the values of the entries whose range contains this range. For a position, use a range of which
+        the start and the end are the same."""
+        start = (source_range.from_line, source_range.from_column)
+        end = (source_range.to_line, source_range.to_column)
+        # only the ranges that start before the range can contain it
+        limit = bisect.bisect_right(self._starts, start)
+
+        found = []
+        todo = [(1, 0, self._size)]
+        while todo:
+            node, lo, hi = todo.pop()
+            if lo >= limit or self._max_ends[node] < end:
+                continue
+            if hi - lo == 1:
+                found.append(lo)
+            else:
+                mid = (lo + hi) // 2
+                todo.append((2 * node, lo, mid))
+                todo.append((2 * node + 1, mid, hi))
+
+        found.sort(key=lambda i: self._orders[i])
+        return [self._values[i] for i in found]
+
+
 def strip_priority_suffix(rule):
     if re.match(r"\w+\.\d+", rule):
         return rule.split('.')[0]
     return rule
 
 
+@lru_cache(maxsize=None)
+def get_grammar_rules():
+    script_dir = path.abspath(path.dirname(__file__))
+
+    with open(path.join(script_dir, "grammars", "level1.lark"), "r", encoding="utf-8") as file:
+        grammar_text = file.read()
+
+    for i in range(2, 19):
+        with open(path.join(script_dir, "grammars", f'level{i}-Additions.lark'), "r", encoding="utf-8") as file:
+            grammar_text += '\n' + file.read()
+
+    grammar_rules = re.findall(r"([\w.]+):", grammar_text)
+    grammar_rules = [rule for rule in grammar_rules if 'text' not in rule]  # exclude text from mapping
+    grammar_rules = list(set(grammar_rules))  # remove duplicates
+    return frozenset(strip_priority_suffix(r) for r in grammar_rules)
+
+
 class SourceMap:
     """
     A class used to represent the Hedy - Python source map.
@@ -104,24 +197,29 @@ class SourceMap:
     the string representation of the sourcemap is defined as:
     [Start line]-[Start Character]/[End line]-[End Character] :
         [Code]
-    """
 
-    map = dict()
-    level = 0
-
-    skip_faulty = False
+    A new source map is created for every transpilation and handed to the transformer that fills it, so
+    concurrent transpilations never share any state.
+    """
 
     exceptions_not_to_skip = (
         exceptions.UnsupportedStringValue,
+        exceptions.TranspileBudgetExceededException,
     )
 
-    language = 'en'
-    hedy_code = ''
-    python_code = ''
-    grammar_rules = []
-
-    def __init__(self):
-        self.get_grammar_rules()
+    def __init__(self, level=0, language='en', hedy_code='', skip_faulty=False):
+        self.map = dict()
+        self.level = level
+        self.language = language
+        self.hedy_code = hedy_code
+        self.python_code = ''
+        # if the mapping encounters an error and skip_faulty is True we will 'skip' the exception
+        self.skip_faulty = skip_faulty
+        # the exceptions of the error productions skipped while parsing, with their source range
+        self.skipped_errors = []
+        # the index of the entries by Hedy range, and the skipped errors found for the entries, built when first used
+        self._hedy_index = None
+        self._skipped_errors_by_range = None
 
     def set_level(self, level):
         self.level = level
@@ -136,72 +234,67 @@ class SourceMap:
     def set_hedy_input(self, hedy_code):
         self.hedy_code = hedy_code
 
+    def set_skipped_errors(self, skipped_errors):
+        self.skipped_errors = skipped_errors
+        self._skipped_errors_by_range = None
+
     def set_python_output(self, python_code):
+        """Set the Python ranges of the entries in the map, in a single pass. The transformers emit the code of every
+        statement as a Code or a Block, which know where they ended up in the Python code. The code of an expression
+        is glued into the code of its statement, so it is looked up in the range of the statement around it."""
         self.python_code = python_code
-        python_code_mapped = list()
-        hedy_lines = self.hedy_code.split('\n')
-        indent_size = find_program_indent_length(hedy_lines)
-
-        def line_col(context, idx):
-            return context.count('\n', 0, idx) + 1, idx - context.rfind('\n', 0, idx)
-
-        for hedy_source_code, python_source_code in self.map.items():
-            if hedy_source_code.error is not None or python_source_code.code == '':
+        entries = [(hedy, python) for hedy, python in self.map.items() if hedy.error is None and python.code != '']
+
+        offsets = {}
+        for i, (_, python_source_code) in enumerate(entries):
+            start = getattr(python_source_code.code, 'start', None)
+            if start is not None:
+                offsets[i] = (start, python_source_code.code.end)
+
+        # The entries are added to the map after the entries of the rules they are made of, so going backwards, the
+        # statements that contain an entry are on the stack.
+        enclosing = {}
+        stack = []
+        for i in reversed(range(len(entries))):
+            hedy_range = entries[i][0].source_range
+            while stack and not entries[stack[-1]][0].source_range.contains(hedy_range):
+                stack.pop()
+            if i in offsets:
+                stack.append(i)
+            elif stack:
+                enclosing[i] = stack[-1]
+
+        # the expressions of a statement are generated in order, so each search continues where the previous stopped
+        cursors = {}
+        for i, (_, python_source_code) in enumerate(entries):
+            code = python_source_code.code
+            if i in offsets or not isinstance(code, str):
                 continue
-            if self.level <= 7:
-                start_index = -1
-                number_of_indents = 0
-                while start_index == -1 and number_of_indents < 10:
-                    python_statement_code = textwrap.indent(python_source_code.code, '  '*number_of_indents)
-                    start_index = python_code.find(python_statement_code)
-                    code_char_length = len(python_source_code.code)
-
-                    for i in range(python_code_mapped.count(python_source_code.code)):
-                        start_index = python_code.find(python_statement_code, start_index+code_char_length)
-                        start_index = max(0, start_index)  # not found (-1) means that start_index = 0
-                    number_of_indents += 1
+            outer = enclosing.get(i)
+            outer_start, outer_end = offsets[outer] if outer is not None else (0, len(python_code))
+            start = find_code(python_code, code, cursors.get(outer, outer_start), outer_end)
+            if start == -1:
+                start = find_code(python_code, code, outer_start, outer_end)
+            if start == -1:
+                # the code of the expression was changed while it was glued into its statement
+                offsets[i] = (outer_start, outer_end)
             else:
-                number_of_indents = find_indent_length(
-                    hedy_lines[hedy_source_code.source_range.from_line - 1]) // indent_size
-
-                python_statement_code = textwrap.indent(python_source_code.code, '  '*number_of_indents)
-                start_index = python_code.find(python_statement_code)
-                code_char_length = len(python_source_code.code)
-
-                for i in range(python_code_mapped.count(python_source_code.code)):
-                    start_index = python_code.find(python_statement_code, start_index+code_char_length)
-                    start_index = max(0, start_index)  # not found (-1) means that start_index = 0
-
-            end_index = start_index + code_char_length
-            start_line, start_column = line_col(python_code, start_index)
-            end_line, end_column = line_col(python_code, end_index)
-
-            python_source_code.source_range = SourceRange(
-                start_line,
-                start_column,
-                end_line,
-                end_column
-            )
+                offsets[i] = (start, start + len(code))
+                cursors[outer] = start + len(code)
 
-            python_code_mapped.append(python_source_code.code)
+        line_starts = [0] + [match.end() for match in re.finditer('\n', python_code)]
 
-    def get_grammar_rules(self):
-        script_dir = path.abspath(path.dirname(__file__))
+        def line_col(index):
+            line = bisect.bisect_right(line_starts, index)
+            return line, index - line_starts[line - 1] + 1
 
-        with open(path.join(script_dir, "grammars", "level1.lark"), "r", encoding="utf-8") as file:
-            grammar_text = file.read()
-
-        for i in range(2, 19):
-            with open(path.join(script_dir, "grammars", f'level{i}-Additions.lark'), "r", encoding="utf-8") as file:
-                grammar_text += '\n' + file.read()
-
-        self.grammar_rules = re.findall(r"([\w.]+):", grammar_text)
-        self.grammar_rules = [rule for rule in self.grammar_rules if 'text' not in rule]  # exclude text from mapping
-        self.grammar_rules = list(set(self.grammar_rules))  # remove duplicates
-        self.grammar_rules = [strip_priority_suffix(r) for r in self.grammar_rules]
+        for i, (start, end) in offsets.items():
+            entries[i][1].source_range = SourceRange(*line_col(start), *line_col(end))
 
     def add_source(self, hedy_code: SourceCode, python_code: SourceCode):
         self.map[hedy_code] = python_code
+        self._hedy_index = None
+        self._skipped_errors_by_range = None
 
     def clear(self):
         self.map.clear()
@@ -209,6 +302,20 @@ class SourceMap:
         self.language = 'en'
         self.hedy_code = ''
         self.python_code = ''
+        self.skipped_errors = []
+        self._hedy_index = None
+        self._skipped_errors_by_range = None
+
+    def get_hedy_index(self) -> SourceRangeIndex:
+        """The (Hedy SourceCode, Python SourceCode) entries of the map, indexed by their Hedy range"""
+        if self._hedy_index is None:
+            self._hedy_index = SourceRangeIndex(
+                [(hedy_code.source_range, (hedy_code, python_code)) for hedy_code, python_code in self.map.items()]
+            )
+        return self._hedy_index
+
+    def get_entries_containing_hedy_range(self, hedy_range: SourceRange):
+        return self.get_hedy_index().containing(hedy_range)
 
     def get_result(self):
         response_map = dict()
@@ -235,6 +342,27 @@ class SourceMap:
             index += 1
         return response_map
 
+    def get_compact_result(self):
+        """The same mappings as get_result, in a compact format for the /parse response. Every mapping takes eight
+        numbers in `ranges`: the from and to line and column of its Hedy range, followed by those of its Python
+        range. The command of every mapping is in `commands`, and only the mappings with an error are listed in
+        `errors`, as [index, error] pairs. Use decode_compact_result to turn it back into the result of get_result."""
+        ranges = []
+        commands = []
+        errors = []
+
+        for index, (hedy_source_code, python_source_code) in enumerate(self.map.items()):
+            hedy_range = hedy_source_code.source_range
+            python_range = python_source_code.source_range
+            ranges.extend((hedy_range.from_line, hedy_range.from_column, hedy_range.to_line, hedy_range.to_column,
+                           python_range.from_line, python_range.from_column,
+                           python_range.to_line, python_range.to_column))
+            commands.append(hedy_source_code.command_name)
+            if hedy_source_code.error is not None:
+                errors.append([index, hedy_source_code.error])
+
+        return {'ranges': ranges, 'commands': commands, 'errors': errors}
+
     def get_compressed_mapping(self):
         response_map = dict()
 
@@ -244,9 +372,27 @@ class SourceMap:
         return response_map
 
     def get_error_from_hedy_source_range(self, hedy_range: SourceRange) -> Exception:
-        for hedy_source_code, python_source_code in self.map.items():
-            if hedy_source_code.source_range == hedy_range:
-                return hedy_source_code.error
+        entry = self.get_hedy_index().find(hedy_range)
+        if entry is not None:
+            hedy_source_code, _ = entry
+            return hedy_source_code.error
+
+    def get_skipped_error_in_range(self, hedy_range: SourceRange) -> Exception:
+        """Returns the first skipped error within the range, or None if there is none"""
+        if self._skipped_errors_by_range is None:
+            # every skipped error is looked up once in the index, for the entries whose range contains it
+            self._skipped_errors_by_range = {}
+            for source_range, error in self.skipped_errors:
+                for hedy_source_code, _ in self.get_entries_containing_hedy_range(source_range):
+                    self._skipped_errors_by_range.setdefault(str(hedy_source_code.source_range), error)
+
+        if self.get_hedy_index().find(hedy_range) is not None:
+            return self._skipped_errors_by_range.get(str(hedy_range))
+        # the range is not in the map
+        for source_range, error in self.skipped_errors:
+            if hedy_range.contains(source_range):
+                return error
+        return None
 
     def print_source_map(self, d, indent=0):
         for key, value in d.items():
@@ -265,105 +411,118 @@ class SourceMap:
         return str()
 
 
-def source_map_rule(source_map: SourceMap):
+def source_map_rule(function):
     """ A decorator function that should decorator the transformer method (grammar rule)
-        the decorator adds the hedy code & python code to the map when the transformer method (grammar rule) is used
+        the decorator adds the hedy code & python code to the source map of the transformer when the transformer
+        method (grammar rule) is used. Transformers without a source map are not mapped.
     """
 
-    def decorator(function):
-        def wrapper(*args, **kwargs):
-            meta = args[1]
+    def wrapper(*args, **kwargs):
+        source_map = args[0].source_map
+        if source_map is None:
+            return function(*args, **kwargs)
 
-            hedy_code_input = source_map.hedy_code[meta.start_pos:meta.end_pos]
-            hedy_code_input = hedy_code_input.replace('#ENDBLOCK', '')  # ENDBLOCK is not part of the Hedy code, remove
-            error = None
+        meta = args[1]
 
-            if not source_map.skip_faulty:
+        hedy_code_input = source_map.hedy_code[meta.start_pos:meta.end_pos]
+        hedy_code_input = hedy_code_input.replace('#ENDBLOCK', '')  # ENDBLOCK is not part of the Hedy code, remove
+        error = None
+
+        if not source_map.skip_faulty:
+            generated_python = function(*args, **kwargs)
+        else:
+            try:
                 generated_python = function(*args, **kwargs)
-            else:
-                try:
-                    generated_python = function(*args, **kwargs)
-
-                    # When parsing with skip_faulty enabled it could happen that because sanitization is not done
-                    # a tree is returned instead of a string containing valid Python code by a transformer method.
-                    # If this happens we have to raise an exception, we cannot map a Lark tree
-
-                    if (
-                        # if a Lark tree is returned
-                        isinstance(generated_python, Tree) or
-                        # if a Lark tree is returned as a string, we check with regex
-                        bool(re.match(r".*Tree\(.*Token\(.*\).*\).*", generated_python))
-                    ):
-                        raise Exception('Can not map a Lark tree, only strings')
-
-                except Exception as e:
-                    # If an exception is found, we set the Python code to pass (null operator)
-                    # we also map the error
-                    generated_python = 'pass'
-                    error = e
-
-            hedy_code = SourceCode(
-                SourceRange(
-                    meta.container_line, meta.container_column,
-                    meta.container_end_line, meta.container_end_column
-                ),
-                hedy_code_input,
-                error=error,
-                command_name=function.__name__
-            )
 
-            python_code = SourceCode(
-                # We don't know now, set_python_output will set the ranges later
-                SourceRange(None, None, None, None),
-                generated_python
-            )
+                # When parsing with skip_faulty enabled it could happen that because sanitization is not done
+                # a tree is returned instead of a string containing valid Python code by a transformer method.
+                # If this happens we have to raise an exception, we cannot map a Lark tree
+
+                if (
+                    # if a Lark tree is returned
+                    isinstance(generated_python, Tree) or
+                    # if a Lark tree is returned as a string, we check with regex
+                    bool(re.match(r".*Tree\(.*Token\(.*\).*\).*", first_string(generated_python)))
+                ):
+                    raise Exception('Can not map a Lark tree, only strings')
+
+            except Exception as e:
+                # If an exception is found, we set the Python code to pass (null operator)
+                # we also map the error
+                generated_python = 'pass'
+                error = e
+
+        if type(generated_python) is str:
+            # the emitter records where this code ends up in the Python code, if it is emitted as a whole
+            generated_python = Code(generated_python)
+
+        hedy_code = SourceCode(
+            SourceRange(
+                meta.container_line, meta.container_column,
+                meta.container_end_line, meta.container_end_column
+            ),
+            hedy_code_input,
+            error=error,
+            command_name=function.__name__
+        )
 
-            source_map.add_source(hedy_code, python_code)
-            return generated_python
+        python_code = SourceCode(
+            # We don't know now, set_python_output will set the ranges later
+            SourceRange(None, None, None, None),
+            generated_python
+        )
 
-        return wrapper
+        source_map.add_source(hedy_code, python_code)
+        return generated_python
 
-    return decorator
+    return wrapper
 
 
-def source_map_transformer(source_map: SourceMap):
-    """ A decorator function that should decorate a transformer class
+def decode_compact_result(compact_result):
+    """Turn the result of SourceMap.get_compact_result back into the result of SourceMap.get_result."""
+    range_keys = ('from_line', 'from_column', 'to_line', 'to_column')
+    ranges = compact_result['ranges']
+    errors = {index: error for index, error in compact_result['errors']}
 
-        This is used for convenience, instead of adding source_map_rule to all methods,
-        source_map_transformer needs only to be added to the transformer class.
-        This decorator add source_map_rule to all appropriate methods.
-    """
+    response_map = dict()
+    for index, command in enumerate(compact_result['commands']):
+        numbers = ranges[index * 8:index * 8 + 8]
+        response_map[index] = {
+            'hedy_range': dict(zip(range_keys, numbers[:4])),
+            'python_range': dict(zip(range_keys, numbers[4:])),
+            'error': errors.get(index),
+            'command': command
+        }
+    return response_map
 
-    def decorate(cls):
-        for rule in cls.__dict__:
-            if rule in source_map.grammar_rules:
-                setattr(cls, rule, source_map_rule(source_map)(getattr(cls, rule)))
-        return cls
 
-    return decorate
+def find_code(python_code, code, start, end):
+    """Like python_code.find(code, start, end), but a name is not found in the middle of another name."""
+    def is_part_of_name(index):
+        return 0 <= index < len(python_code) and (python_code[index].isalnum() or python_code[index] == '_')
 
+    is_name = code.isidentifier()
+    index = python_code.find(code, start, end)
+    while is_name and index != -1 and (is_part_of_name(index - 1) or is_part_of_name(index + len(code))):
+        index = python_code.find(code, index + 1, end)
+    return index
 
-def find_indent_length(line):
-    number_of_spaces = 0
-    for x in line:
-        if x == ' ':
-            number_of_spaces += 1
-        else:
-            break
-    return number_of_spaces
+
+def first_string(code):
+    return code.first_string() if isinstance(code, Block) else code
 
 
-def find_program_indent_length(program_lines):
-    indent_size = 4
-    found_indent_size = False
-    for line in program_lines:
-        leading_spaces = find_indent_length(line)
-        # continue if line is just spaces
-        if leading_spaces == len(line):
-            continue
+def source_map_transformer(cls):
+    """ A decorator function that should decorate a transformer class
 
-        if not found_indent_size and leading_spaces > 0:
-            indent_size = leading_spaces
-            found_indent_size = True
+        This is used for convenience, instead of adding source_map_rule to all methods,
+        source_map_transformer needs only to be added to the transformer class.
+        This decorator add source_map_rule to all appropriate methods.
+        The transformer instances are expected to have a `source_map` attribute.
+    """
 
-    return indent_size
+    grammar_rules = get_grammar_rules()
+    for rule in cls.__dict__:
+        if rule in grammar_rules:
+            setattr(cls, rule, source_map_rule(getattr(cls, rule)))
+    return cls
@@ -5,8 +5,9 @@ import hedy
 import operator
 from os import path
 import hedy_content
+from functools import cache
+from types import MappingProxyType
 from website.yaml_file import YamlFile
-import copy
 
 # Holds the token that needs to be translated, its line number, start and
 # end indexes and its value (e.g. ", ").
@@ -15,25 +16,45 @@ Rule = namedtuple("Rule", "keyword line start end value")
 
 def keywords_to_dict(lang="nl"):
     """ "Return a dictionary of keywords from language of choice. Key is english value is lang of choice"""
+    return {k: list(v) for k, v in keyword_alternatives(lang).items()}
+
+
+@cache
+def keyword_alternatives(lang):
+    """Return a read-only mapping from every English keyword to all of its values in the language of choice.
+    The keyword file is read and split once per language, use keywords_to_dict for a copy that can be changed."""
     base = path.abspath(path.dirname(__file__))
 
     keywords_path = "content/keywords/"
     yaml_filesname_with_path = path.join(base, keywords_path, lang + ".yaml")
 
-    # as we mutate this dict, we have to make a copy
-    # as YamlFile re-uses the yaml contents
-    command_combinations = copy.deepcopy(
-        YamlFile.for_file(yaml_filesname_with_path).to_dict()
-    )
-    for k, v in command_combinations.items():
-        command_combinations[k] = v.split("|")
-
-    return command_combinations
+    command_combinations = YamlFile.for_file(yaml_filesname_with_path).to_dict()
+    return MappingProxyType({k: tuple(v.split("|")) for k, v in command_combinations.items()})
 
 
+@cache
 def keywords_to_dict_single_choice(lang):
-    command_combinations = keywords_to_dict(lang)
-    return {k: v[0] for (k, v) in command_combinations.items()}
+    """Return a read-only mapping from every English keyword to its default value in the language of choice"""
+    return MappingProxyType({k: v[0] for (k, v) in keyword_alternatives(lang).items()})
+
+
+@cache
+def keywords_to_en(lang):
+    """Return a read-only mapping from every value of a keyword in the language of choice to the English keyword"""
+    to_en = {}
+    for k, v in keyword_alternatives(lang).items():
+        for value in v:
+            to_en.setdefault(value, k)
+    return MappingProxyType(to_en)
+
+
+@cache
+def keyword_translation_table(from_lang, to_lang):
+    """Return a read-only mapping from the English keywords to the values of the keyword in from_lang and its
+    default value in to_lang, for the keywords that are in both languages"""
+    keywords_from = keyword_alternatives(from_lang)
+    keywords_to = keyword_alternatives(to_lang)
+    return MappingProxyType({k: (v, keywords_to[k][0]) for k, v in keywords_from.items() if k in keywords_to})
 
 
 def all_keywords_to_dict():
@@ -49,28 +70,12 @@ def all_keywords_to_dict():
 
 def translate_keyword_from_en(keyword, lang="en"):
     # translated the keyword to a local lang
-    local_keywords = keywords_to_dict(lang)
-    if keyword in local_keywords.keys():
-        local_keyword = local_keywords[keyword][0]
-    else:
-        local_keyword = keyword
-    return local_keyword
+    return keywords_to_dict_single_choice(lang).get(keyword, keyword)
 
 
 def translate_keyword_to_en(keyword, lang):
     # translated the keyword to from a local lang
-    original_keywords = keywords_to_dict(lang)
-    for k, v in original_keywords.items():
-        if keyword in v:
-            return k
-    return keyword
-
-
-def get_target_keyword(keyword_dict, keyword):
-    if keyword in keyword_dict.keys():
-        return keyword_dict[keyword][0]
-    else:
-        return keyword
+    return keywords_to_en(lang).get(keyword, keyword)
 
 
 def translate_keywords(input_string, from_lang="en", to_lang="nl", level=1):
@@ -87,12 +92,8 @@ def translate_keywords(input_string, from_lang="en", to_lang="nl", level=1):
     try:
         processed_input = hedy.process_input_string(input_string, level, from_lang, preprocess_ifs_enabled=False)
 
-        hedy.source_map.clear()
-        hedy.source_map.set_skip_faulty(False)
-
-        parser = hedy.get_parser(level, from_lang, True, hedy.source_map.skip_faulty)
-        keyword_dict_from = keywords_to_dict(from_lang)
-        keyword_dict_to = keywords_to_dict(to_lang)
+        parser = hedy.get_parser(level, from_lang, True, skip_faulty=False)
+        translation_table = keyword_translation_table(from_lang, to_lang)
 
         program_root = parser.parse(processed_input + "\n").children[0]
 
@@ -103,18 +104,9 @@ def translate_keywords(input_string, from_lang="en", to_lang="nl", level=1):
         # checks whether any error production nodes are present in the parse tree
         # hedy.is_program_valid(program_root, input_string, level, from_lang)
 
-        result = processed_input
-        for rule in ordered_rules:
-            if rule.keyword in keyword_dict_from and rule.keyword in keyword_dict_to:
-                lines = result.splitlines()
-                line = lines[rule.line - 1]
-                original = get_original_keyword(keyword_dict_from, rule.keyword, line)
-                target = get_target_keyword(keyword_dict_to, rule.keyword)
-                replaced_line = replace_token_in_line(line, rule, original, target)
-                result = replace_line(lines, rule.line - 1, replaced_line)
+        result = replace_keywords(processed_input, ordered_rules, translation_table)
 
         # For now the needed post processing is only removing the 'end-block's added during pre-processing
-        result = "\n".join([line for line in result.splitlines()])
         result = result.replace("#ENDBLOCK", "")
 
         # we have to reverse escaping or translating and retranslating will add an unlimited number of slashes
@@ -134,14 +126,17 @@ def translate_keywords(input_string, from_lang="en", to_lang="nl", level=1):
         raise E
 
 
-def replace_line(lines, index, line):
-    before = "\n".join(lines[0:index])
-    after = "\n".join(lines[index + 1:])
-    if len(before) > 0:
-        before = before + "\n"
-    if len(after) > 0:
-        after = "\n" + after
-    return "".join([before, line, after])
+def replace_keywords(text, rules, translation_table):
+    """Replace the keywords of the rules in the text in one pass. The rules must be ordered from the end of the text
+    to the start, so that replacing a keyword does not move the keywords that are still to be replaced."""
+    lines = text.splitlines()
+    for rule in rules:
+        if rule.keyword in translation_table:
+            alternatives, target = translation_table[rule.keyword]
+            line = lines[rule.line - 1]
+            original = get_original_keyword(alternatives, rule.keyword, line)
+            lines[rule.line - 1] = replace_token_in_line(line, rule, original, target)
+    return "\n".join(lines)
 
 
 def replace_token_in_line(line, rule, original, target):
@@ -155,9 +150,9 @@ def replace_token_in_line(line, rule, original, target):
 
 
 def find_command_keywords(
-    input_string, lang, level, keywords, start_line, end_line, start_column, end_column
+    input_string, lang, level, keywords, start_line, end_line, start_column, end_column, skip_faulty=False
 ):
-    parser = hedy.get_parser(level, lang, True, hedy.source_map.skip_faulty)
+    parser = hedy.get_parser(level, lang, True, skip_faulty)
     program_root = parser.parse(input_string).children[0]
 
     translator = Translator(input_string)
@@ -179,8 +174,8 @@ def find_keyword_in_rules(rules, keyword, start_line, end_line, start_column, en
     return None
 
 
-def get_original_keyword(keyword_dict, keyword, line):
-    for word in keyword_dict[keyword]:
+def get_original_keyword(alternatives, keyword, line):
+    for word in alternatives:
         if word in line:
             return word
 
@@ -0,0 +1,114 @@
+"""An in-memory cache for Lark parsers with a memory budget.
+
+A parser takes several MB of memory, and with all levels, keyword languages and options there are thousands of
+them, so we can not keep all of them in memory. Most of the traffic is on a few levels in a few languages though,
+so we keep the most used parsers that fit in the budget.
+
+The size of a parser is measured by walking all the objects it references. Parsers are evicted by LFU with
+dynamic aging: the entry with the lowest priority is evicted, where the priority is the number of hits plus the
+priority of the last evicted entry at the time the entry was added. That way, parsers that were popular a long
+time ago do not stay in the cache forever. Ties are broken by evicting the least recently used entry.
+
+Hits, misses and the number of resident bytes are logged through querylog.
+"""
+import collections
+import gc
+import os
+import sys
+import threading
+import types
+
+import utils
+from website import querylog
+
+# The default budget, in bytes, per worker. A parser retains 0.6MB (level 1) to 3MB (level 18), the parsers of all
+# levels of one keyword language take 33MB, so in production this keeps the busiest levels of a few languages.
+# Set env PARSER_CACHE_MAX_BYTES to change it.
+DEFAULT_MAX_BYTES = 48 * 1024 * 1024 if utils.is_production() else 1024 * 1024 * 1024
+
+# Objects which are shared with the rest of the program, and so should not be counted as part of a parser
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType)
+
+
+def retained_size(obj):
+    """The size in bytes of the object and all the objects it references."""
+    seen = set()
+    size = 0
+    todo = [obj]
+    while todo:
+        current = todo.pop()
+        if id(current) in seen or isinstance(current, _SHARED_TYPES):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        todo.extend(gc.get_referents(current))
+    return size
+
+
+class _Entry:
+    def __init__(self, value, size, priority):
+        self.value = value
+        self.size = size
+        self.priority = priority
+
+
+class ParserCache:
+    """A cache of parsers with a memory budget. Thread-safe."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, measure=retained_size):
+        self.max_bytes = max_bytes
+        self.measure = measure
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._age = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached parser for the key, or None if there is no such parser."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.priority += 1
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            resident_bytes = self.resident_bytes
+
+        querylog.log_counter('parser_cache_hit' if entry is not None else 'parser_cache_miss')
+        querylog.log_value(parser_cache_bytes=resident_bytes)
+        return entry.value if entry is not None else None
+
+    def put(self, key, value):
+        size = self.measure(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            while self._entries and self.resident_bytes + size > self.max_bytes:
+                self._evict()
+            self._entries[key] = _Entry(value, size, self._age + 1)
+            self.resident_bytes += size
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.resident_bytes = 0
+            self._age = 0
+
+    def _evict(self):
+        # min() returns the first of the entries with the lowest priority, which is the least recently used one
+        key = min(self._entries, key=lambda k: self._entries[k].priority)
+        entry = self._entries.pop(key)
+        self.resident_bytes -= entry.size
+        self._age = entry.priority
+
+
+PARSER_CACHE = ParserCache(max_bytes=int(os.getenv('PARSER_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)))
@@ -0,0 +1,101 @@
+"""The emitter of the Python code generated by the ConvertToPython transformers.
+
+The transformers generate the code of a block statement (an if, a loop, a function, ...) from the code of the
+statements in its body. If every block glued its body into a single string, the code of a statement that is nested
+n levels deep would be copied and re-indented n times. Instead, a block is a `Block`: a list of parts, which are
+either lines of code or the blocks nested in it, each with its own indentation. Indenting a block is free, and the
+code of the whole program is joined only once, by `Block.render`.
+
+While rendering, every block records where each of its parts ended up in the output, see `Block.ranges`, and
+where its own code starts and ends, see `Block.start` and `Block.end`. The same is done for the strings of code that
+are a `Code`, this is how the source map knows where the code of every statement is.
+"""
+
+INDENT = '  '
+
+
+class Code(str):
+    """A string of code of which `Block.render` records the output offsets in `start` and `end`."""
+    start = None
+    end = None
+
+
+class Block:
+    """Python code made out of parts, which are strings of one or more lines of code or nested blocks. The parts are
+    separated by newlines, and every line of a block is indented by `depth` times INDENT on top of the indentation of
+    the block it is part of."""
+
+    __slots__ = ('parts', 'depth', 'ranges', 'start', 'end')
+
+    def __init__(self, *parts, depth=0):
+        for part in parts:
+            if not isinstance(part, (str, Block)):
+                raise TypeError(f'Can not emit {type(part).__name__} as Python code: {part}')
+        self.parts = parts
+        self.depth = depth
+        # the (start, end) offsets of the parts in the output of the last render
+        self.ranges = None
+        # the offsets of the code itself in the output of the last render, without the indentation of the first line
+        self.start = None
+        self.end = None
+
+    def first_string(self):
+        """The first string of the code, without rendering it."""
+        part = self
+        while isinstance(part, Block):
+            if not part.parts:
+                return ''
+            part = part.parts[0]
+        return part
+
+    def last_word(self):
+        """The last non-whitespace word of the code, without rendering it."""
+        for part in reversed(self.parts):
+            words = part.split() if isinstance(part, str) else [part.last_word()]
+            if words and words[-1]:
+                return words[-1]
+        return ''
+
+    def render(self):
+        """Join the code of the block and all the blocks nested in it into a single string."""
+        output = []
+        self._render(output, 0, 0)
+        return ''.join(output)
+
+    def _render(self, output, depth, offset):
+        depth += self.depth
+        prefix = INDENT * depth
+        ranges = []
+        for i, part in enumerate(self.parts):
+            if i > 0:
+                output.append('\n')
+                offset += 1
+            start = offset
+            if isinstance(part, Block):
+                offset = part._render(output, depth, offset)
+            else:
+                code = prefix + part.replace('\n', '\n' + prefix) if prefix else part
+                output.append(code)
+                offset += len(code)
+                if isinstance(part, Code):
+                    part.start, part.end = start + len(prefix), offset
+            ranges.append((start, offset))
+        self.ranges = ranges
+        if not self.parts:
+            self.start = self.end = offset
+        else:
+            first = self.parts[0]
+            self.start = first.start if isinstance(first, Block) else ranges[0][0] + len(prefix)
+            self.end = offset
+        return offset
+
+    def __str__(self):
+        return self.render()
+
+    def __repr__(self):
+        return f'Block({", ".join(repr(p) for p in self.parts)}, depth={self.depth})'
+
+
+def indent(code, levels=1):
+    """Indent a string or block of code, without copying it."""
+    return Block(code, depth=levels)
@@ -0,0 +1,50 @@
+"""A BK-tree of words, to find the word closest to a misspelled one without computing the distance to all words.
+
+Every node of the tree holds a word, and its children are keyed by their distance to that word. Because the edit
+distance is a metric, a word within `threshold` of the searched word can only be found under the children whose key
+is within `threshold` of the distance between the node and the searched word, so the other children are skipped.
+"""
+
+
+class _Node:
+    def __init__(self, word, order):
+        self.word = word
+        self.order = order
+        self.children = {}
+
+
+class BKTree:
+    def __init__(self, words, distance):
+        """Build the tree of the words, with `distance` the edit distance between two words."""
+        self.distance = distance
+        self.root = None
+        for order, word in enumerate(words):
+            self._add(word, order)
+
+    def _add(self, word, order):
+        if self.root is None:
+            self.root = _Node(word, order)
+            return
+        node = self.root
+        while True:
+            d = self.distance(node.word, word)
+            if d == 0:
+                return
+            child = node.children.get(d)
+            if child is None:
+                node.children[d] = _Node(word, order)
+                return
+            node = child
+
+    def closest(self, word, threshold):
+        """Returns the word with the smallest distance to `word` that is at most `threshold`, or None if there is
+        no such word. Of words at the same distance, the one that came first in the words of the tree is returned."""
+        best = None
+        todo = [self.root] if self.root is not None else []
+        while todo:
+            node = todo.pop()
+            d = self.distance(node.word, word)
+            if d <= threshold and (best is None or (d, node.order) < (best[0], best[1].order)):
+                best = (d, node)
+            todo.extend(child for key, child in node.children.items() if d - threshold <= key <= d + threshold)
+        return best[1].word if best is not None else None
@@ -0,0 +1,57 @@
+import copy
+import unittest
+
+import hedy_content
+from hedy_content import Adventures, deep_translate_keywords
+
+
+class TestAdventureBundles(unittest.TestCase):
+    def setUp(self):
+        hedy_content.ADVENTURE_BUNDLES.clear()
+
+    def test_bundle_is_translated_once(self):
+        adventures = Adventures('nl')
+        bundle = adventures.get_bundle('nl')
+
+        self.assertIs(bundle, adventures.get_bundle('nl'))
+        self.assertIs(bundle, Adventures('nl').get_bundle('nl'))
+        self.assertIsNot(bundle, adventures.get_bundle('en'))
+
+    def test_bundle_is_built_again_when_the_content_changes(self):
+        adventures = Adventures('nl')
+        bundle = adventures.get_bundle('nl')
+        bundle.version = None
+
+        self.assertIsNot(bundle, adventures.get_bundle('nl'))
+
+    def test_adventures_for_level(self):
+        adventures = Adventures('nl')
+        translated = deep_translate_keywords(adventures.file.get('adventures'), 'nl')
+
+        for_level = adventures.get_adventures_for_level(3, 'nl')
+
+        self.assertEqual({aid: adv for aid, adv in translated.items() if 3 in adv['levels']}, for_level)
+
+    def test_adventures_for_level_subset(self):
+        adventures = Adventures('en')
+
+        for_level = adventures.get_adventures_for_level(1, 'en', subset=['print_command', 'for_command'])
+
+        self.assertEqual(['print_command'], list(for_level))
+
+    def test_shared_adventures_cannot_be_modified(self):
+        adventures = Adventures('en').get_adventures('en')
+
+        with self.assertRaises(TypeError):
+            adventures['print_command']['name'] = 'changed'
+        with self.assertRaises(TypeError):
+            adventures['print_command']['levels'][1]['story_text'] += 'changed'
+        with self.assertRaises(TypeError):
+            Adventures('en').get_adventures_for_level(1, 'en')['print_command']['levels'].pop(1)
+
+        # the dict of adventures itself is a copy, and a deep copy can be modified
+        del adventures['print_command']
+        self.assertIn('print_command', Adventures('en').get_adventures('en'))
+        adventure = copy.deepcopy(Adventures('en').get_adventures('en')['print_command'])
+        adventure['name'] = 'changed'
+        self.assertNotEqual('changed', Adventures('en').get_adventures('en')['print_command']['name'])
@@ -1,8 +1,10 @@
 import unittest
+from unittest.mock import patch
 
 from parameterized import parameterized
 
 import hedy
+import suggestion_index
 
 
 class TestsKeywordSuggestions(unittest.TestCase):
@@ -129,3 +131,29 @@ class TestsKeywordSuggestions(unittest.TestCase):
         result, suggestion = hedy.closest_command(mistake, keywords)
         self.assertTrue(result)
         self.assertEqual(correct, suggestion)
+
+    @parameterized.expand([('en', level) for level in range(1, 19)] + [('nl', 4), ('ar', 12), ('zh_Hans', 16)])
+    def test_suggestion_index_finds_the_closest_command(self, lang, level):
+        keywords = hedy.get_suggestions_for_language(lang, level)
+        index = hedy.get_suggestion_index(lang, level)
+
+        for mistake in ['pnirt', 'sk', 'elyse', 'whcle', 'x', 'iff', 'reapet', 'eechoooo']:
+            distances = [hedy.calculate_minimum_distance(keyword, mistake) for keyword in keywords]
+            closest = [keyword for keyword, distance in zip(keywords, distances) if distance == min(distances)]
+            if min(distances) <= 2:
+                self.assertIn(index.closest(mistake, 2), closest)
+            else:
+                self.assertIsNone(index.closest(mistake, 2))
+
+    def test_suggestion_index_is_built_once_per_language_and_level(self):
+        hedy._get_suggestion_index.cache_clear()
+        keywords = hedy.get_suggestions_for_language('en', 3)
+
+        with patch.object(suggestion_index.BKTree, '__init__', autospec=True,
+                          side_effect=suggestion_index.BKTree.__init__) as bk_tree:
+            hedy.closest_command('pront', keywords)
+            self.assertEqual(0, bk_tree.call_count)
+
+            for _ in range(3):
+                hedy.closest_command('pront', hedy.get_suggestion_index('en', 3))
+            self.assertEqual(1, bk_tree.call_count)
@@ -64,6 +64,13 @@ class TestErrors(HedyTester):
         self.assertIn('ask', result)
         self.assertEqual('vraag', result['ask'])
 
+    def test_missing_arguments_depend_on_given_arguments(self):
+        template = 'The input {command} is not {print} or {ask}'
+        first = _get_missing_arguments(template, {'command': 'go', 'print': 'x'}, 'en')
+        second = _get_missing_arguments(template, {'command': 'go'}, 'en')
+        self.assertEqual({'ask': 'ask'}, first)
+        self.assertEqual({'print': 'print', 'ask': 'ask'}, second)
+
     def test_missing_argument_unknown_keyword(self):
         result = _get_missing_arguments('This is {unknown}', {}, 'en')
         self.assertEqual(0, len(result))
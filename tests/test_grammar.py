@@ -1,5 +1,9 @@
+import os
 import textwrap
 import unittest
+from unittest.mock import patch
+
+import hedy_grammar
 from hedy_grammar import merge_rules_operator, parse_grammar_rule, merge_grammars, GrammarRule, RuleProcessor
 from parameterized import parameterized
 lang = 'en'
@@ -30,6 +34,28 @@ class TestGrammars(unittest.TestCase):
 
         self.assertEqual("command: for", result)
 
+    def test_merge_grammars_up_to_level_merges_all_levels(self):
+        expected = hedy_grammar.get_full_grammar_for_level(1)
+        for level in range(2, 5):
+            expected = merge_grammars(expected, hedy_grammar.get_additional_rules_for_level(level), 'nl')
+
+        self.assertEqual(expected, hedy_grammar.merge_grammars_up_to_level(4, 'nl'))
+
+    def test_create_grammar_saves_total_grammar_only_when_asked(self):
+        with patch('hedy_grammar.save_total_grammar_file') as save_total_grammar_file:
+            with patch.dict(os.environ):
+                os.environ.pop('SAVE_TOTAL_GRAMMARS', None)
+                hedy_grammar.create_grammar.cache_clear()
+                hedy_grammar.create_grammar(3, 'en', False)
+                save_total_grammar_file.assert_not_called()
+
+            with patch.dict(os.environ, {'SAVE_TOTAL_GRAMMARS': 'True'}):
+                hedy_grammar.create_grammar.cache_clear()
+                grammar = hedy_grammar.create_grammar(3, 'en', False)
+                save_total_grammar_file.assert_called_once_with(3, grammar, 'en')
+
+        hedy_grammar.create_grammar.cache_clear()
+
     def test_parse_rule(self):
         rule = parse_grammar_rule('start: program')
         self.assert_rule(rule, name='start', value=' program')
@@ -1,7 +1,21 @@
+import os
+import pickle
+import tempfile
+import textwrap
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 
+import hedy
+import hedy_content
+import hedy_parser_bundle
+import hedy_translation
+from lark import Tree
 from hedy import is_quoted, find_unquoted_segments
+from hedy_sourcemap import decode_compact_result, SourceRange, SourceRangeIndex
+from parser_cache import ParserCache
 from parameterized import parameterized
+from tests.test_snippets.snippet_tester import markdown_code_blocks
 
 
 class TestHedy(unittest.TestCase):
@@ -57,3 +71,444 @@ class TestHedy(unittest.TestCase):
     def test_find_unquoted_segments(self, s, expected):
         result = find_unquoted_segments(s)
         self.assertEqual(expected, result)
+
+    @parameterized.expand([
+        ("if x is 5 print 'a'\nprint 'b'", 6, ("if x is 5 print 'a' else x__x__x__x is 5", "print 'b'")),
+        ("if x is 5 print 'a'\n\nelse print 'b'", 6, ("if x is 5 print 'a'", '', "else print 'b'")),
+        ("repeat 3 times if x is 5 print 'a'\nprint 'b'", 7,
+         ("repeat 3 times if x is 5 print 'a' else x__x__x__x is 5", "print 'b'")),
+        ("als x is 5 print 'a'\nprint 'b'", 6, ("als x is 5 print 'a' else x__x__x__x is 5", "print 'b'"), 'nl'),
+        ("for i in range 1 to 3\n    print i\n    # done\nprint 'b'", 12,
+         ('for i in range 1 to 3', '    print i', '    # done#ENDBLOCK', "print 'b'")),
+        ("if x is 5\n  if y is 6\n    print 'a'", 9, ('if x is 5', '  if y is 6', "    print 'a'#ENDBLOCK#ENDBLOCK")),
+    ])
+    def test_process_input_string_keeps_processed_lines(self, code, level, expected_lines, lang='en'):
+        result = hedy.process_input_string(code, level, lang)
+
+        self.assertEqual(expected_lines, result.lines)
+        self.assertEqual('\n'.join(expected_lines), result)
+        # the transpile cache pickles the source map, which holds the processed input
+        self.assertEqual(expected_lines, pickle.loads(pickle.dumps(result)).lines)
+
+
+class TestProgramAnalysis(unittest.TestCase):
+    def test_transpile_parses_program_once(self):
+        code = "animals is dog, cat\nname is ask what is your name?\nprint name animals at random"
+
+        with patch('hedy.parse_input', wraps=hedy.parse_input) as parse_input:
+            result = hedy.transpile(code, 3, 'en')
+
+        self.assertEqual(1, parse_input.call_count)
+        self.assertEqual({'animals': 'list_variable_role', 'name': 'input_variable_role'},
+                         result.roles_of_variables)
+
+    def test_concurrent_transpiles_have_separate_source_maps(self):
+        programs = [(f"print hello {i}\nprint goodbye {i}", i) for i in range(8)]
+
+        def transpile(program):
+            code, _ = program
+            return hedy.transpile(code, 1, 'en').source_map
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            source_maps = list(executor.map(transpile, programs))
+
+        for (code, i), source_map in zip(programs, source_maps):
+            self.assertEqual(code, source_map.hedy_code)
+            hedy_codes = [hedy_code.code for hedy_code in source_map.map.keys()]
+            self.assertIn(f'print hello {i}', hedy_codes)
+            self.assertNotIn(f'print hello {i + 1}', hedy_codes)
+
+
+class TestTreeWalk(unittest.TestCase):
+    code = "animals is dog, cat\nname is ask what is your name?\nprint name animals at random"
+
+    def test_walk_gives_the_same_results_as_separate_transforms(self):
+        program_root = hedy.parse_input(self.code, 3, 'en')
+
+        commands, abstract_syntax_tree = hedy.TreeWalk(hedy.AllCommands(3), hedy.ExtractAST()).walk(program_root)
+
+        self.assertEqual(hedy.AllCommands(3).transform(program_root), commands)
+        self.assertEqual(hedy.ExtractAST().transform(program_root), abstract_syntax_tree)
+
+    def test_visitors_are_called_top_down(self):
+        abstract_syntax_tree = hedy.ExtractAST().transform(hedy.parse_input(self.code, 3, 'en'))
+        separate = hedy.LookupEntryCollector(3, False)
+        separate.visit_topdown(abstract_syntax_tree)
+        fused = hedy.LookupEntryCollector(3, False)
+
+        is_complete = hedy.TreeWalk(hedy.IsComplete(3), fused).walk(abstract_syntax_tree)[0]
+
+        self.assertEqual([True], is_complete)
+        self.assertEqual([e.name for e in separate.lookup_entries], [e.name for e in fused.lookup_entries])
+
+
+class TestLookupTable(unittest.TestCase):
+    def setUp(self):
+        # a function on lines 3 to 5 with a local variable, surrounded by global variables
+        self.entries = [
+            hedy.LookupEntry('x', None, 1, False),
+            hedy.LookupEntry('print', None, 2, False),
+            hedy.LookupEntry('f()', None, 3, False),
+            hedy.LookupEntry('x', None, 4, False),
+            hedy.LookupEntry('y', None, 7, False),
+        ]
+        self.lookup = hedy.LookupTable([('f', 3, 5)], self.entries)
+
+    def test_try_get_local_scope(self):
+        self.assertIsNone(self.lookup.try_get_local_scope(2))
+        self.assertEqual(('f', 3, 5), self.lookup.try_get_local_scope(4))
+        self.assertIsNone(self.lookup.try_get_local_scope(6))
+
+    def test_get_matching_in_local_scope(self):
+        x_global, _, _, x_local, _ = self.entries
+
+        self.assertEqual([x_local, x_global], self.lookup.get_matching('x', 5))
+
+    def test_get_matching_in_global_scope(self):
+        x_global, _, f, _, y = self.entries
+
+        self.assertEqual([x_global], self.lookup.get_matching('x', 7))
+        self.assertEqual([y], self.lookup.get_matching('y', 7))
+        # a function is found both as part of the global scope and as a function definition
+        self.assertEqual([f, f], self.lookup.get_matching('f(1, 2)', 7))
+        self.assertEqual([], self.lookup.get_matching('z', 7))
+
+    def test_get_matching_escapes_reserved_words(self):
+        _, print_entry, _, _, _ = self.entries
+
+        self.assertEqual([print_entry], self.lookup.get_matching('print', 7))
+        self.assertEqual([print_entry], self.lookup.get_matching('_print', 7))
+
+
+class TestSkipFaulty(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.dict(os.environ, {'ENABLE_SKIP_FAULTY': 'True'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_errors_of_all_faulty_lines_are_found_in_one_parse(self):
+        code = "prnt hello\nprint hello\nprnt bye\nprint bye\nprnt again"
+
+        with patch('hedy.parse_input', wraps=hedy.parse_input) as parse_input:
+            result = hedy.transpile(code, 1, 'en')
+
+        # once without skipping faulty code, once for the suggested fix of the first error and once with skipping
+        self.assertEqual(3, parse_input.call_count)
+        errors = [source.error for source in result.source_map.map.keys() if source.error is not None]
+        self.assertEqual([1, 3, 5], [error.arguments['line_number'] for error in errors])
+        self.assertTrue(all(isinstance(e, hedy.exceptions.InvalidCommandException) for e in errors))
+
+    def test_compact_source_map_decodes_to_the_source_map(self):
+        result = hedy.transpile("prnt hello\nprint hello\nprint bye", 1, 'en')
+
+        compact_result = result.source_map.get_compact_result()
+
+        self.assertEqual(result.source_map.get_result(), decode_compact_result(compact_result))
+        self.assertEqual([0], [index for index, _ in compact_result['errors']])
+
+    def test_concurrent_skip_faulty_transpiles(self):
+        faulty = [f"prnt hello {i}\nprint goodbye {i}" for i in range(4)]
+        valid = [f"print hello {i}\nprint goodbye {i}" for i in range(4)]
+
+        def transpile(code):
+            try:
+                return hedy.transpile(code, 1, 'en').code
+            except hedy.exceptions.HedyException as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(transpile, [code for pair in zip(faulty, valid) for code in pair]))
+
+        for i in range(4):
+            self.assertEqual(f"pass\nprint('goodbye {i}')", results[2 * i])
+            self.assertEqual(f"print('hello {i}')\nprint('goodbye {i}')", results[2 * i + 1])
+
+
+class TestSourceRangeIndex(unittest.TestCase):
+    def test_containing_gives_the_same_results_as_a_linear_search(self):
+        ranges = [SourceRange(a, b, c, d) for a in range(1, 4) for b in range(1, 3) for c in range(a, 4)
+                  for d in range(1, 3) if (a, b) <= (c, d)]
+        index = SourceRangeIndex([(r, i) for i, r in enumerate(ranges)])
+
+        for query in ranges:
+            expected = [i for i, r in enumerate(ranges) if r.contains(query)]
+            self.assertEqual(expected, index.containing(query))
+            self.assertEqual(ranges.index(query), index.find(query))
+
+        self.assertIsNone(index.find(SourceRange(5, 1, 5, 2)))
+        self.assertEqual([], SourceRangeIndex([]).containing(SourceRange(1, 1, 1, 1)))
+
+    def test_source_map_lookups_by_position(self):
+        code = textwrap.dedent("""\
+            repeat 3 times
+                print 'hello'
+            print 'bye'""")
+        source_map = hedy.transpile(code, 8, 'en').source_map
+
+        commands = [hedy_code.command_name
+                    for hedy_code, _ in source_map.get_entries_containing_hedy_range(SourceRange(2, 8, 2, 8))]
+        self.assertEqual(['print', 'repeat', 'program'], commands)
+
+    def test_skipped_error_in_range_gives_the_same_results_as_a_linear_search(self):
+        code = textwrap.dedent("""\
+            print 'hello'
+            prnt 'one'
+            print 'world'
+            prnt 'two'""")
+        source_map = hedy.transpile_inner(code, 2, 'en', populate_source_map=True, skip_faulty=True).source_map
+        self.assertEqual(2, len(source_map.skipped_errors))
+
+        for hedy_source_code in source_map.map:
+            source_range = hedy_source_code.source_range
+            expected = next((error for skipped_range, error in source_map.skipped_errors
+                             if source_range.contains(skipped_range)), None)
+            self.assertIs(expected, source_map.get_skipped_error_in_range(source_range))
+
+
+class TestIncrementalParse(unittest.TestCase):
+    code = textwrap.dedent("""\
+        name = 'Hedy'
+        if name = 'Hedy'
+            print 'hello ' name
+        else
+            print 'bye'
+        for i in range 1 to 3
+            print i
+        # done
+        print 'end'""")
+
+    def setUp(self):
+        patcher = patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop('ENABLE_SKIP_FAULTY', None)
+
+    def test_incremental_parse_gives_the_same_tree(self):
+        input_string = hedy.process_input_string(self.code, 12, 'en')
+
+        full = hedy.parse_input(input_string, 12, 'en')
+        incremental = hedy.parse_input_incrementally(input_string, 12, 'en')
+
+        self.assertEqual(full, incremental)
+        self.assertEqual(self.positions(full), self.positions(incremental))
+
+    def test_split_into_chunks_keeps_blocks_and_else_together(self):
+        input_string = hedy.process_input_string(self.code, 12, 'en')
+
+        chunks = hedy.split_into_chunks(input_string, 12, 'en')
+
+        self.assertEqual(input_string, ''.join(chunks))
+        self.assertEqual(4, len(chunks))
+        self.assertTrue(chunks[1].startswith('if') and 'else' in chunks[1])
+
+    def test_unchanged_chunks_are_not_parsed_again(self):
+        hedy.parse_input_incrementally(hedy.process_input_string(self.code, 12, 'en'), 12, 'en')
+        misses = hedy._parse_chunk.cache_info().misses
+        edited = self.code.replace("print 'end'", "print 'the end'")
+
+        hedy.parse_input_incrementally(hedy.process_input_string(edited, 12, 'en'), 12, 'en')
+
+        self.assertEqual(misses + 1, hedy._parse_chunk.cache_info().misses)
+
+    def test_split_into_chunks_before_level_8_splits_lines(self):
+        code = "naam is ask 'what is your name?'\nprint 'hello ' naam\n\nprint 'bye'"
+
+        chunks = hedy.split_into_chunks(code, 4, 'en')
+
+        self.assertEqual(["naam is ask 'what is your name?'\n", "print 'hello ' naam\n\n", "print 'bye'"], chunks)
+
+    def test_split_into_chunks_before_level_8_keeps_programs_with_if_whole(self):
+        code = "naam is Hedy\nif naam is Hedy print 'leuk' else\nprint 'minder leuk'\nprint 'bye'"
+
+        self.assertEqual([code], hedy.split_into_chunks(code, 5, 'en'))
+
+    @parameterized.expand([
+        ("repeat 3 times if naam is Hedy print 'leuk'\nprint 'bye'", 'en'),
+        ("naam is Hedy\nals naam is Hedy print 'leuk'\nanders print 'minder leuk'", 'nl'),
+    ])
+    def test_split_into_chunks_before_level_8_finds_if_after_repeat_and_in_other_languages(self, code, lang):
+        self.assertEqual([code], hedy.split_into_chunks(code, 7, lang))
+
+    def test_split_into_chunks_before_level_8_ignores_if_and_else_inside_words(self):
+        code = "gift is 'a different present'\nprint 'elsewhere ' gift"
+
+        self.assertEqual(2, len(hedy.split_into_chunks(code, 5, 'en')))
+
+    @parameterized.expand([
+        ("naam is ask 'what is your name?'\nprint 'hello ' naam\nprint 'bye'", 1),
+        ("dieren is hond, kat\nprint dieren at random\nprint 'bye'", 3),
+        ("dieren is hond, kat\nprint dieren at random\nrepeat 3 times print 'hi'", 7),
+    ])
+    def test_incremental_parse_before_level_8_gives_the_same_tree(self, code, level):
+        input_string = hedy.process_input_string(code, level, 'en')
+
+        full = hedy.parse_input(input_string, level, 'en')
+        incremental = hedy.parse_input_incrementally(input_string, level, 'en')
+
+        self.assertEqual(full, incremental)
+        self.assertEqual(self.positions(full), self.positions(incremental))
+
+    @parameterized.expand([
+        "print 'hello'\nprnt 'bye'",
+        "print 'hello'\nif name is Hedy\n    print 'hi'\nprint 'bye' 'now'",
+    ])
+    def test_errors_are_the_same_as_with_a_full_parse(self, code):
+        with self.assertRaises(hedy.exceptions.HedyException) as full:
+            hedy.transpile(code, 12, 'en')
+        with patch.dict(os.environ, {'ENABLE_INCREMENTAL_PARSE': 'True'}):
+            with self.assertRaises(hedy.exceptions.HedyException) as incremental:
+                hedy.transpile(code, 12, 'en')
+
+        self.assertIs(type(full.exception), type(incremental.exception))
+        self.assertEqual(full.exception.arguments, incremental.exception.arguments)
+
+    @parameterized.expand([(level,) for level in range(1, hedy.HEDY_MAX_LEVEL + 1)])
+    def test_adventure_examples_give_the_same_result_as_with_a_full_parse(self, level):
+        adventures = hedy_content.Adventures('en').get_adventures_for_level(level, 'en')
+        examples = [code for adventure in adventures.values()
+                    for text in adventure['levels'][level].values()
+                    for code in markdown_code_blocks(text)]
+
+        for code in examples:
+            with self.subTest(code=code):
+                full = self.transpile_outcome(code, level)
+                with patch.dict(os.environ, {'ENABLE_INCREMENTAL_PARSE': 'True'}):
+                    incremental = self.transpile_outcome(code, level)
+                self.assertEqual(full, incremental)
+
+    @staticmethod
+    def transpile_outcome(code, level):
+        try:
+            return hedy.transpile(code, level, 'en').code
+        except hedy.exceptions.HedyException as e:
+            return type(e), e.arguments
+
+    @classmethod
+    def positions(cls, tree):
+        result = [(tree.data, tree.meta.line, tree.meta.column, tree.meta.end_line, tree.meta.end_column)]
+        for child in tree.children:
+            if isinstance(child, Tree):
+                result += cls.positions(child)
+        return result
+
+
+class TestTranspileMany(unittest.TestCase):
+    programs = [
+        ("print hello", 1, 'en'),
+        ("prnt hello", 1, 'en'),
+        ("print hello", 1, 'en'),
+        ("print 'hello'", 4, 'en'),
+        ("print hello", 1, 'en'),
+    ]
+
+    def assert_outcomes(self, outcomes):
+        self.assertEqual(len(self.programs), len(outcomes))
+        for (code, level, lang), (result, error) in zip(self.programs, outcomes):
+            try:
+                expected = hedy.transpile(code, level, lang)
+            except Exception as e:
+                self.assertIsNone(result)
+                self.assertEqual(type(e), type(error))
+                self.assertEqual(e.arguments, error.arguments)
+            else:
+                self.assertIsNone(error)
+                self.assertEqual(expected.code, result.code)
+
+    def test_transpile_many_in_a_pool(self):
+        self.assert_outcomes(list(hedy.transpile_many(iter(self.programs), processes=2)))
+
+    def test_transpile_many_without_a_pool(self):
+        with patch('hedy.transpile', wraps=hedy.transpile) as transpile:
+            outcomes = list(hedy.transpile_many(self.programs, processes=1))
+
+        # the same programs are transpiled once
+        self.assertEqual(3, transpile.call_count)
+        self.assert_outcomes(outcomes)
+
+    def test_workers_only_get_the_bundle_entries_of_the_batch(self):
+        level_1 = hedy._get_unique_parser_hash_for_level(1, 'en', False, False)
+        level_2 = hedy._get_unique_parser_hash_for_level(2, 'en', False, False)
+        bundle = {level_1: 'level-1.pkl', level_2: 'level-2.pkl'}
+        with patch.dict(hedy_parser_bundle.PARSERS, bundle, clear=True):
+            entries = hedy._get_bundle_entries([(1, 'en'), (1, 'nl'), (25, 'en')])
+
+        self.assertEqual({level_1: 'level-1.pkl'}, entries)
+
+    def test_workers_get_the_skip_faulty_bundle_entries_if_skipping_faulty_code_is_enabled(self):
+        parser = hedy._get_unique_parser_hash_for_level(1, 'en', False, False)
+        skip_faulty_parser = hedy._get_unique_parser_hash_for_level(1, 'en', False, True)
+        bundle = {parser: 'parser.pkl', skip_faulty_parser: 'skip-faulty-parser.pkl'}
+        with patch.dict(hedy_parser_bundle.PARSERS, bundle, clear=True):
+            with patch.dict(os.environ, {'ENABLE_SKIP_FAULTY': 'True'}):
+                entries = hedy._get_bundle_entries([(1, 'en')])
+            with patch.dict(os.environ):
+                os.environ.pop('ENABLE_SKIP_FAULTY', None)
+                entries_without_skip_faulty = hedy._get_bundle_entries([(1, 'en')])
+
+        self.assertEqual(bundle, entries)
+        self.assertEqual({parser: 'parser.pkl'}, entries_without_skip_faulty)
+
+
+class TestKeywordTables(unittest.TestCase):
+    def test_tables_are_read_only(self):
+        with self.assertRaises(TypeError):
+            hedy_translation.keyword_alternatives('nl')['print'] = ('druk',)
+        # keywords_to_dict gives a copy that can be changed
+        keywords = hedy_translation.keywords_to_dict('nl')
+        keywords['print'].append('druk')
+        self.assertNotIn('druk', hedy_translation.keyword_alternatives('nl')['print'])
+
+    def test_translation_table(self):
+        alternatives, target = hedy_translation.keyword_translation_table('nl', 'en')['print']
+        self.assertEqual(('print', 'print'), (hedy_translation.translate_keyword_to_en(alternatives[0], 'nl'), target))
+        self.assertEqual(alternatives[0], hedy_translation.translate_keyword_from_en('print', 'nl'))
+
+
+class TestParserBundle(unittest.TestCase):
+    def test_get_parser_uses_bundle(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(2, hedy.save_parser_bundle(directory, levels=[1], languages=['en']))
+
+            with patch.dict(hedy_parser_bundle.PARSERS, clear=True):
+                self.assertEqual(2, hedy_parser_bundle.load(directory))
+                with patch('parser_cache.PARSER_CACHE', ParserCache()), \
+                        patch('hedy.Lark') as lark, \
+                        patch('hedy._restore_parser_from_file_if_present') as from_file:
+                    parser = hedy.get_parser(1, 'en', skip_faulty=False)
+
+                lark.assert_not_called()
+                from_file.assert_not_called()
+                self.assertEqual('start', parser.parse('print hello\n').data)
+
+    def test_save_replaces_earlier_bundle(self):
+        with tempfile.TemporaryDirectory() as directory:
+            hedy.save_parser_bundle(directory, levels=[1], languages=['en'])
+            hedy.save_parser_bundle(directory, levels=[2], languages=['en'])
+
+            level_1 = hedy._get_unique_parser_hash_for_level(1, 'en', False, False)
+            level_2 = hedy._get_unique_parser_hash_for_level(2, 'en', False, False)
+            with patch.dict(hedy_parser_bundle.PARSERS, clear=True):
+                self.assertEqual(2, hedy_parser_bundle.load(directory))
+                self.assertIsNotNone(hedy_parser_bundle.get(level_2))
+                self.assertIsNone(hedy_parser_bundle.get(level_1))
+
+    def test_load_ignores_missing_bundle(self):
+        self.assertEqual(0, hedy_parser_bundle.load('does-not-exist'))
+
+    @parameterized.expand([
+        ('', hedy.DEFAULT_PARSER_BUNDLE_LANGUAGES),
+        ('nl, fy', ['nl', 'fy']),
+        ('all', sorted(hedy_content.ALL_KEYWORD_LANGUAGES)),
+    ])
+    def test_bundle_languages_can_be_configured(self, setting, expected):
+        with patch.dict(os.environ, {'PARSER_BUNDLE_LANGUAGES': setting}):
+            self.assertEqual(expected, hedy.get_parser_bundle_languages())
+
+
+class TestGetParser(unittest.TestCase):
+    def test_languages_with_the_same_grammar_share_a_parser(self):
+        with patch('parser_cache.PARSER_CACHE', ParserCache()):
+            english = hedy.get_parser(1, 'en')
+            # The keywords of Frisian are not translated
+            self.assertIs(english, hedy.get_parser(1, 'fy'))
+            self.assertIsNot(english, hedy.get_parser(1, 'nl'))
@@ -1611,11 +1611,11 @@ class TestsLevel8(HedyTester):
             '2/1-2/7': '2/1-2/7',
             '2/1-2/57': '2/1-4/37',
             '3/1-3/15': '5/1-5/17',
-            '4/8-4/14': '2/27-2/33',
-            '5/5-5/9': '7/1-7/5',
-            '5/5-5/47': '7/1-9/29',
-            '6/11-6/15': '9/1-9/5',
-            '6/5-6/15': '10/1-10/17',
+            '4/8-4/14': '6/33-6/39',
+            '5/5-5/9': '7/3-7/7',
+            '5/5-5/47': '7/3-9/35',
+            '6/11-6/15': '10/12-10/16',
+            '6/5-6/15': '10/3-10/19',
             '4/1-6/24': '6/1-11/18',
             '7/1-7/32': '12/1-12/34',
             '8/1-8/25': '13/1-13/27',
@@ -1625,6 +1625,23 @@ class TestsLevel8(HedyTester):
         self.single_level_tester(code, expected=expected_code)
         self.source_map_tester(code=code, expected_source_map=expected_source_map)
 
+    def test_source_map_identical_statements(self):
+        code = textwrap.dedent("""\
+            print 'hi'
+            repeat 2 times
+                print 'hi'
+            print 'hi'""")
+
+        expected_source_map = {
+            '1/1-1/11': '1/1-1/13',
+            '3/5-3/15': '3/3-3/15',
+            '2/1-3/24': '2/1-4/18',
+            '4/1-4/11': '5/1-5/13',
+            '1/1-4/12': '1/1-5/13',
+        }
+
+        self.source_map_tester(code=code, expected_source_map=expected_source_map)
+
     def test_play_repeat_random(self):
         code = textwrap.dedent("""\
             repeat 10 times
@@ -399,14 +399,14 @@ class TestsLevel9(HedyTester):
                 print 'pizza is better'""")
 
         expected_source_map = {
-            '2/5-2/9': '2/1-2/5',
-            '2/5-2/35': '2/1-4/29',
-            '3/8-3/21': '9/-270-1/40',
-            '4/9-4/22': '6/1-6/16',
-            '3/5-4/31': '5/1-6/16',
-            '6/9-6/32': '8/1-8/26',
-            '4/31-6/41': '9/-270-1/34',
-            '3/5-6/41': '5/1-8/22',
+            '2/5-2/9': '2/3-2/7',
+            '2/5-2/35': '2/3-4/35',
+            '3/8-3/21': '5/6-5/46',
+            '4/9-4/22': '6/5-6/20',
+            '3/5-4/31': '5/3-6/20',
+            '6/9-6/32': '8/5-8/30',
+            '4/31-6/41': '7/3-8/30',
+            '3/5-6/41': '5/3-8/30',
             '1/1-6/50': '1/1-9/18',
             '1/1-6/51': '1/1-9/18'
         }
@@ -4173,31 +4173,31 @@ class TestsLevel12(HedyTester):
             '2/1-2/43': '2/1-11/33',
             '3/1-3/6': '12/1-12/6',
             '3/1-3/44': '12/1-21/35',
-            '4/4-4/8': '3/20-3/24',
+            '4/4-4/8': '22/4-22/8',
             '4/4-4/23': '22/4-22/28',
-            '5/5-5/10': '25/1-25/6',
-            '5/13-5/18': '27/1-27/6',
-            '5/5-5/25': '23/1-23/98',
+            '5/5-5/10': '23/3-23/8',
+            '5/13-5/18': '23/32-23/37',
+            '5/5-5/25': '23/3-23/100',
             '4/1-5/34': '22/1-23/100',
-            '6/4-6/8': '5/3-5/7',
+            '6/4-6/8': '24/4-24/8',
             '6/4-6/19': '24/4-24/24',
-            '7/5-7/10': '29/1-29/6',
-            '7/13-7/18': '1/1-1/6',
-            '7/5-7/25': '25/1-25/99',
+            '7/5-7/10': '25/3-25/8',
+            '7/13-7/18': '25/32-25/37',
+            '7/5-7/25': '25/3-25/101',
             '6/1-7/34': '24/1-25/101',
-            '8/4-8/9': '12/42-12/47',
+            '8/4-8/9': '26/4-26/9',
             '8/4-8/20': '26/4-26/25',
-            '9/5-9/10': '23/1-23/6',
-            '9/13-9/18': '25/1-25/6',
-            '9/5-9/25': '27/1-27/98',
+            '9/5-9/10': '27/3-27/8',
+            '9/13-9/18': '27/32-27/37',
+            '9/5-9/25': '27/3-27/100',
             '8/1-9/34': '26/1-27/100',
-            '10/4-10/9': '13/20-13/25',
+            '10/4-10/9': '28/4-28/9',
             '10/4-10/19': '28/4-28/24',
-            '11/5-11/10': '27/1-27/6',
-            '11/13-11/18': '29/1-29/6',
-            '11/5-11/25': '29/1-29/99',
+            '11/5-11/10': '29/3-29/8',
+            '11/13-11/18': '29/32-29/37',
+            '11/5-11/25': '29/3-29/101',
             '10/1-11/34': '28/1-29/101',
-            '12/23-12/28': '27/93-27/98',
+            '12/23-12/28': '30/25-30/30',
             '12/1-12/46': '30/1-30/50',
             '1/1-12/47': '1/1-30/50'
         }
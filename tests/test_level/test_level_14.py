@@ -772,10 +772,10 @@ class TestsLevel14(HedyTester):
             '1/1-1/9': '1/1-1/33',
             '2/4-2/7': '2/4-2/7',
             '2/4-2/12': '2/4-2/15',
-            '3/5-3/37': '3/1-3/39',
+            '3/5-3/37': '3/3-3/41',
             '2/1-3/46': '2/1-3/41',
-            '5/5-5/35': '5/1-5/37',
-            '3/46-5/44': '5/-96-2/12',
+            '5/5-5/35': '5/3-5/39',
+            '3/46-5/44': '4/1-5/39',
             '2/1-5/44': '2/1-5/39',
             '1/1-5/45': '1/1-5/39'
         }
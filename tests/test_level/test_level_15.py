@@ -792,8 +792,8 @@ class TestsLevel15(HedyTester):
             '1/1-1/11': '1/1-1/35',
             '2/7-2/13': '2/7-2/13',
             '2/7-2/19': '2/7-2/22',
-            '3/5-3/11': '10/5-10/11',
-            '3/5-3/38': '3/1-15/28',
+            '3/5-3/11': '3/3-3/9',
+            '3/5-3/38': '3/3-15/54',
             '2/1-3/47': '2/1-16/18',
             '4/1-4/40': '17/1-17/46',
             '1/1-4/41': '1/1-17/46'
@@ -770,9 +770,9 @@ class TestsLevel17(HedyTester):
             "print(f'''Ready or not, here I come!''')")
 
         expected_source_map = {
-            '1/5-1/6': '1/12-1/13',
-            '2/11-2/12': '1/1-1/2',
-            '2/5-2/12': '3/1-3/18',
+            '1/5-1/6': '2/5-2/6',
+            '2/11-2/12': '3/14-3/15',
+            '2/5-2/12': '3/3-3/20',
             '1/1-2/21': '1/1-4/18',
             '3/1-3/35': '5/1-5/41',
             '1/1-3/36': '1/1-5/41'
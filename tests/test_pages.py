@@ -0,0 +1,32 @@
+import unittest
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+from app import create_app
+from website import log_queue, querylog
+
+
+class TestContentPages(unittest.TestCase):
+    def setUp(self):
+        self.client = create_app(for_testing=True).test_client()
+        # keep the log records of the requests out of the queue of the process
+        patcher = patch.object(querylog, 'LOG_QUEUE', log_queue.LogQueue('test-pages', batch_window_s=300))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # These pages annotate the content of YAML files, which is shared by all requests
+    @parameterized.expand([
+        '/for-teachers/workbooks/1',
+        '/for-teachers/workbooks/2',
+        '/for-teachers/manual/levels',
+        '/for-teachers/manual/teaching',
+        '/',
+    ])
+    def test_page_renders_the_same_every_time(self, url):
+        first = self.client.get(url)
+        second = self.client.get(url)
+
+        self.assertEqual(200, first.status_code)
+        self.assertEqual(200, second.status_code)
+        self.assertEqual(first.data, second.data)
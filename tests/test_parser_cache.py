@@ -0,0 +1,64 @@
+import unittest
+
+from parser_cache import ParserCache, retained_size
+
+
+class TestParserCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ParserCache(max_bytes=300, measure=len)
+
+    def test_hit_and_miss(self):
+        self.cache.put('a', 'a' * 100)
+
+        self.assertEqual('a' * 100, self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(0.5, self.cache.hit_rate())
+        self.assertEqual(100, self.cache.resident_bytes)
+
+    def test_evicts_least_frequently_used(self):
+        self.cache.put('a', 'a' * 100)
+        self.cache.put('b', 'b' * 100)
+        self.cache.get('a')
+        self.cache.get('a')
+        self.cache.get('b')
+        self.cache.put('c', 'c' * 150)
+
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+        self.assertEqual(250, self.cache.resident_bytes)
+
+    def test_evicts_least_recently_used_on_ties(self):
+        self.cache.put('a', 'a' * 100)
+        self.cache.put('b', 'b' * 100)
+        self.cache.put('c', 'c' * 100)
+        self.cache.get('a')
+        self.cache.get('b')
+        self.cache.get('c')
+        self.cache.put('d', 'd' * 100)
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('b'))
+
+    def test_old_popular_entries_age_out(self):
+        self.cache.put('old', 'o' * 200)
+        for _ in range(3):
+            self.cache.get('old')
+        for key in 'abcde':
+            self.cache.put(key, key * 100)
+            for _ in range(3):
+                self.cache.get(key)
+
+        self.assertIsNone(self.cache.get('old'))
+
+    def test_does_not_store_entries_over_budget(self):
+        self.cache.put('a', 'a' * 301)
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(0, self.cache.resident_bytes)
+
+    def test_retained_size_counts_referenced_objects(self):
+        small = {'a': []}
+        large = {'a': list(range(1000))}
+
+        self.assertGreater(retained_size(large), retained_size(small) + 1000)
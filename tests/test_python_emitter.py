@@ -0,0 +1,60 @@
+import unittest
+
+from python_emitter import Block, Code, indent
+
+
+class TestPythonEmitter(unittest.TestCase):
+    def test_render_joins_parts_with_newlines(self):
+        block = Block("print('a')", "x = 1\ny = 2")
+
+        self.assertEqual("print('a')\nx = 1\ny = 2", block.render())
+
+    def test_render_indents_every_line_of_nested_blocks(self):
+        body = Block("print('a')", "x = 1\ny = 2")
+        block = Block('for i in range(2):', indent(Block('if x:', indent(body))), 'done()')
+
+        self.assertEqual(
+            "for i in range(2):\n"
+            "  if x:\n"
+            "    print('a')\n"
+            "    x = 1\n"
+            "    y = 2\n"
+            "done()", block.render())
+
+    def test_indent_empty_line_like_a_string(self):
+        self.assertEqual("  a\n  \n  b", indent('a\n\nb').render())
+
+    def test_render_records_offsets_of_parts(self):
+        body = Block("print('a')", 'x = 1')
+        block = Block('if x:', indent(body))
+
+        code = block.render()
+
+        self.assertEqual([(0, 5), (6, 26)], block.ranges)
+        self.assertEqual(["  print('a')", '  x = 1'], [code[start:end] for start, end in body.ranges])
+
+    def test_last_word(self):
+        block = Block('for i in range(2):', indent(Block("print('a')", 'time.sleep(0.1)')), '')
+
+        self.assertEqual('time.sleep(0.1)', block.last_word())
+
+    def test_only_code_can_be_emitted(self):
+        with self.assertRaises(TypeError):
+            Block('print()', 42)
+
+    def test_first_string(self):
+        block = Block(indent(Block('if x:', indent('print()'))), 'done()')
+
+        self.assertEqual('if x:', block.first_string())
+
+    def test_render_records_offsets_of_code(self):
+        statement = Code("print('a')")
+        body = Block(statement)
+        block = Block('if x:', indent(body))
+
+        code = block.render()
+
+        self.assertEqual((8, 18), (statement.start, statement.end))
+        self.assertEqual((8, 18), (body.start, body.end))
+        self.assertEqual((0, 18), (block.start, block.end))
+        self.assertEqual("print('a')", code[statement.start:statement.end])
@@ -0,0 +1,34 @@
+import itertools
+import json
+import unittest
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+import exceptions
+import hedy
+import transpile_budget
+
+slow_programs_file_name = 'tools/slow-programs.json'
+
+# these are the programs which were the slowest to transpile, found with tools/find-slow-programs.py
+# these tests make sure the budget we use in production stops them when it runs out. Whether they are transpiled
+# within that budget depends on the machine, that is measured with tools/benchmark-slow-programs.py
+
+with open(slow_programs_file_name, 'r') as slow_programs_file:
+    slow_programs = json.load(slow_programs_file)
+
+
+class TestSlowPrograms(unittest.TestCase):
+    @parameterized.expand([(f'{i}_level_{p["level"]}_{p["language"]}', p) for i, p in enumerate(slow_programs)])
+    def test_budget_stops_transpiling(self, name, program):
+        level, lang = program['level'], program['language']
+        # creating the parser is not part of the budget, in production the parsers are created at deploy time
+        hedy.get_parser(level, lang)
+
+        # the clock runs out of budget right after the budget is started
+        clock = itertools.chain([0], itertools.repeat(transpile_budget.PRODUCTION_SECONDS + 1))
+        with patch('time.thread_time', side_effect=lambda: next(clock)):
+            with transpile_budget.limit(transpile_budget.PRODUCTION_SECONDS):
+                with self.assertRaises(exceptions.TranspileBudgetExceededException):
+                    hedy.transpile(program['code'], level, lang)
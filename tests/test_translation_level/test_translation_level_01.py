@@ -146,6 +146,14 @@ class TestsTranslationLevel1(HedyTester):
 
         self.assertEqual(code, result)
 
+    def test_empty_lines_are_kept(self):
+        code = 'ask hoe heet je\n\necho\n\n\n'
+
+        result = hedy_translation.translate_keywords(code, from_lang="en", to_lang="nl", level=self.level)
+        expected = 'vraag hoe heet je\n\necho\n\n'
+
+        self.assertEqual(expected, result)
+
     # No translation because of the invalid space error
 
     def test_invalid_space(self):
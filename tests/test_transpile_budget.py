@@ -0,0 +1,73 @@
+import os
+import unittest
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+import exceptions
+import hedy
+import transpile_budget
+
+
+class TestTranspileBudget(unittest.TestCase):
+    code = '\n'.join(f"print 'hello {i}, how are you doing today?'" for i in range(80))
+
+    def setUp(self):
+        # create the parser up front, so that it does not take up the budget
+        hedy.get_parser(1, 'en')
+
+    def test_no_budget_by_default(self):
+        with patch.dict(os.environ):
+            os.environ.pop('TRANSPILE_BUDGET_SECONDS', None)
+            with transpile_budget.limit():
+                transpile_budget.check()
+
+    def test_parse_stops_when_the_budget_is_exhausted(self):
+        with patch('time.thread_time', side_effect=[0, 0] + [10] * 1000):
+            with transpile_budget.limit(5):
+                with self.assertRaises(exceptions.TranspileBudgetExceededException) as context:
+                    hedy.parse_input(self.code, 1, 'en')
+
+        self.assertEqual(5, context.exception.arguments['seconds'])
+
+    def test_analysis_stops_when_the_budget_is_exhausted(self):
+        program_root = hedy.parse_input(self.code, 1, 'en')
+
+        with patch('time.thread_time', side_effect=[0] + [10] * 1000):
+            with transpile_budget.limit(5):
+                with self.assertRaises(exceptions.TranspileBudgetExceededException):
+                    hedy.TreeWalk(hedy.ExtractAST()).walk(program_root)
+
+    def test_nested_transpiles_share_the_budget(self):
+        with transpile_budget.limit(5):
+            outer = transpile_budget._current_budget.get()
+            with transpile_budget.limit(10):
+                self.assertIs(outer, transpile_budget._current_budget.get())
+        self.assertIsNone(transpile_budget._current_budget.get())
+
+    def test_transpile_raises_and_logs_when_the_budget_is_exhausted(self):
+        with patch.dict(os.environ, {'TRANSPILE_BUDGET_SECONDS': '0.000001', 'ENABLE_SKIP_FAULTY': 'True'}):
+            with patch('website.querylog.log_counter') as log_counter:
+                with self.assertRaises(exceptions.TranspileBudgetExceededException):
+                    hedy.transpile_uncached(self.code, 1, 'en')
+
+        log_counter.assert_called_with('transpile_budget_exceeded')
+
+    @parameterized.expand([
+        ("prnt 'hello'", 2),  # the fixed command is transpiled by error_invalid
+        (" print 'hello'\nprint 'bye'", 1),  # the fixed indentation is transpiled by repair_leading_space
+    ])
+    def test_budget_exhausted_while_transpiling_a_fix_is_not_a_program_error(self, code, level):
+        transpile_inner = hedy.transpile_inner
+        calls = []
+
+        def exhaust_budget_when_nested(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise exceptions.TranspileBudgetExceededException(seconds=5)
+            return transpile_inner(*args, **kwargs)
+
+        with patch('hedy.transpile_inner', side_effect=exhaust_budget_when_nested):
+            with self.assertRaises(exceptions.TranspileBudgetExceededException):
+                hedy.transpile_uncached(code, level, 'en')
+        self.assertGreater(len(calls), 1)
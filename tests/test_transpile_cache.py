@@ -0,0 +1,120 @@
+import os
+import tempfile
+import unittest
+from os import path
+from unittest.mock import patch
+
+import exceptions
+import hedy
+import transpile_cache
+from transpile_cache import TranspileCache
+
+
+class TestTranspileCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = TranspileCache(max_bytes=10_000, directory=self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hit_returns_a_copy(self):
+        self.cache.put('key', {'code': 'print()'})
+
+        first = self.cache.get('key')
+        first['code'] = 'changed'
+
+        self.assertEqual({'code': 'print()'}, self.cache.get('key'))
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.get('unknown'))
+
+    def test_evicts_least_recently_used_entries(self):
+        cache = TranspileCache(max_bytes=250)
+        cache.put('a', 'a' * 100)
+        cache.put('b', 'b' * 100)
+        cache.get('a')
+        cache.put('c', 'c' * 100)
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertLessEqual(cache.size_bytes, 250)
+
+    def test_entries_are_shared_through_disk(self):
+        self.cache.put('key', 'value')
+        other_worker = TranspileCache(directory=self.directory.name)
+
+        self.assertEqual('value', other_worker.get('key'))
+
+    def test_disk_tier_removes_least_recently_used_files_over_budget(self):
+        cache = TranspileCache(directory=self.directory.name, max_disk_bytes=1000)
+        for i, key in enumerate(['a', 'b', 'c', 'd']):
+            with open(cache._file_for(key), 'wb') as f:
+                f.write(b'x' * 300)
+            os.utime(cache._file_for(key), (i, i))
+        # reading a file renews it
+        self.assertIsNotNone(cache._read_from_disk('a'))
+
+        cache.trim_disk()
+
+        self.assertEqual(['a', 'c', 'd'], sorted(f[:-len('.pkl')] for f in os.listdir(self.directory.name)))
+
+    def test_disk_tier_is_trimmed_while_writing(self):
+        cache = TranspileCache(directory=self.directory.name, max_disk_bytes=1000)
+        for i in range(20):
+            cache._write_to_disk(f'key{i}', b'x' * 60)
+
+        size = sum(path.getsize(path.join(self.directory.name, f)) for f in os.listdir(self.directory.name))
+        self.assertLessEqual(size, 1000 + 100)
+
+    def test_transpiler_version_covers_all_modules_of_the_transpiler(self):
+        modules = [path.relpath(file, transpile_cache.ROOT_DIR) for file in transpile_cache.transpiler_modules()]
+
+        for module in ['hedy.py', 'exceptions.py', 'python_emitter.py', 'transpile_budget.py', 'suggestion_index.py',
+                       'utils.py', path.join('prefixes', 'normal.py')]:
+            self.assertIn(module, modules)
+
+    def test_cached_transpile_stores_results_and_hedy_exceptions(self):
+        with patch.object(transpile_cache, 'TRANSPILE_CACHE', self.cache):
+            with patch('hedy.transpile_uncached', wraps=hedy.transpile_uncached) as transpile:
+                for _ in range(2):
+                    result = transpile_cache.cached_transpile(
+                        hedy.transpile_uncached, 'print hello', 1, 'en', True, False, False, False)
+                    self.assertEqual("print('hello')", result.code)
+
+                    with self.assertRaises(exceptions.InvalidCommandException):
+                        transpile_cache.cached_transpile(
+                            hedy.transpile_uncached, 'prnt hello', 1, 'en', True, False, False, False)
+
+                self.assertEqual(2, transpile.call_count)
+
+    def test_cached_transpile_does_not_store_budget_failures(self):
+        outcomes = [exceptions.TranspileBudgetExceededException(seconds=5), hedy.transpile_uncached]
+
+        def transpile_on_busy_worker(*args, **kwargs):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome(*args, **kwargs)
+
+        with patch.object(transpile_cache, 'TRANSPILE_CACHE', self.cache):
+            with self.assertRaises(exceptions.TranspileBudgetExceededException):
+                transpile_cache.cached_transpile(
+                    transpile_on_busy_worker, 'print hello', 1, 'en', True, False, False, False)
+
+            result = transpile_cache.cached_transpile(
+                transpile_on_busy_worker, 'print hello', 1, 'en', True, False, False, False)
+
+        self.assertEqual("print('hello')", result.code)
+        self.assertEqual([], outcomes)
+
+    def test_exceptions_survive_pickling(self):
+        ex = exceptions.UnquotedTextException(level=4, unquotedtext='hello', line_number=2)
+        self.cache.put('key', (None, ex))
+
+        _, cached = self.cache.get('key')
+
+        self.assertIsInstance(cached, exceptions.UnquotedTextException)
+        self.assertEqual(ex.arguments, cached.arguments)
+        self.assertEqual([2], cached.error_location)
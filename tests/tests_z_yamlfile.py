@@ -1,11 +1,22 @@
+import copy
 import os
+import pickle
+import tempfile
 import time
 import unittest
 
-from website.yaml_file import YamlFile
+from website.yaml_file import ContentCache, YamlFile
 
 
 class TestYamlFile(unittest.TestCase):
+    def create_yaml_file(self, directory, content):
+        filename = os.path.join(directory, 'en.yaml')
+        with open(filename, 'w') as f:
+            f.write(content)
+        file = YamlFile(filename)
+        self.addCleanup(lambda: os.path.isfile(file.pickle_filename) and os.unlink(file.pickle_filename))
+        return file
+
     def test_load_yaml_equivalent(self):
         """Test that when we load a YAML file uncached and cached, it produces the same data.
 
@@ -30,7 +41,7 @@ class TestYamlFile(unittest.TestCase):
         original_seconds = time.time() - start
 
         # Generate the pickle file
-        file.access()
+        file.load()
 
         start = time.time()
         for _ in range(n):
@@ -42,6 +53,67 @@ class TestYamlFile(unittest.TestCase):
             f'YAML loading takes {original_seconds / n} seconds, unpickling takes {cached_seconds / n}'
             f'({original_seconds / cached_seconds:.1f}x faster)')
 
+    def test_access_returns_frozen_data(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = self.create_yaml_file(directory, 'key1:\n  - a\n  - b\n')
+
+            data = file.access()
+
+            self.assertEqual({'key1': ['a', 'b']}, data)
+            with self.assertRaises(TypeError):
+                data['key2'] = 'c'
+            with self.assertRaises(TypeError):
+                data['key1'].append('c')
+            self.assertIs(data, file.access())
+
+    def test_copies_of_frozen_data_can_be_modified(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = self.create_yaml_file(directory, 'key1:\n  - a\n  - b\n')
+
+            for data in [file.to_dict(), copy.deepcopy(file.access()), pickle.loads(pickle.dumps(file.access()))]:
+                data['key1'].append('c')
+                data['key2'] = 'd'
+                self.assertEqual({'key1': ['a', 'b', 'c'], 'key2': 'd'}, data)
+            self.assertEqual({'key1': ['a', 'b']}, file.access())
+
+    def test_access_loads_changed_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = self.create_yaml_file(directory, 'key1: a\n')
+            self.assertEqual({'key1': 'a'}, file.access())
+
+            with open(file.filename, 'w') as f:
+                f.write('key1: b\n')
+            # Make sure the modification time differs, and is newer than the pickle file
+            later = time.time() + 10
+            os.utime(file.filename, (later, later))
+
+            self.assertEqual({'key1': 'b'}, file.access())
+
+    def test_content_cache_drops_least_recently_used(self):
+        cache = ContentCache(max_bytes=10)
+        cache.put('a', 1, {'a': 1}, 4)
+        cache.put('b', 1, {'b': 1}, 4)
+        cache.get('a', 1)
+        cache.put('c', 1, {'c': 1}, 4)
+
+        self.assertEqual({'a': 1}, cache.get('a', 1))
+        self.assertIsNone(cache.get('b', 1))
+        self.assertEqual({'c': 1}, cache.get('c', 1))
+        self.assertEqual(8, cache.size_bytes)
+
+    def test_content_cache_only_returns_same_version(self):
+        cache = ContentCache()
+        cache.put('a', 1, {'a': 1}, 4)
+
+        self.assertIsNone(cache.get('a', 2))
+
+    def test_content_cache_skips_entries_over_budget(self):
+        cache = ContentCache(max_bytes=10)
+        cache.put('a', 1, {'a': 1}, 11)
+
+        self.assertIsNone(cache.get('a', 1))
+        self.assertEqual(0, cache.size_bytes)
+
     # Merging of YAML content
     # Key of type dict
     def test_merge_dicts_prefers_source(self):
@@ -0,0 +1,45 @@
+import json
+import sys
+import time
+
+import exceptions
+import hedy
+import transpile_budget
+
+# This file measures how long the slowest programs found with tools/find-slow-programs.py take to transpile, and
+# whether that is within the budget we use in production. The times depend on the machine, so this is not part of
+# the tests. Run it from the root of the repo, on an otherwise idle machine, e.g.:
+#   PYTHONPATH=. python tools/benchmark-slow-programs.py
+
+slow_programs_file_name = 'tools/slow-programs.json'
+
+
+def main():
+    with open(slow_programs_file_name, 'r') as file:
+        slow_programs = json.load(file)
+
+    too_slow = 0
+    for program in slow_programs:
+        level, lang = program['level'], program['language']
+        # creating the parser is not part of the budget, in production the parsers are created at deploy time
+        hedy.get_parser(level, lang)
+
+        start = time.process_time()
+        try:
+            with transpile_budget.limit(transpile_budget.PRODUCTION_SECONDS):
+                hedy.transpile(program['code'], level, lang)
+            outcome = 'ok'
+        except exceptions.TranspileBudgetExceededException:
+            outcome = 'over budget'
+            too_slow += 1
+        except exceptions.HedyException:
+            outcome = 'ok (error)'  # slow programs may contain errors
+        seconds = time.process_time() - start
+        print(f'level {level:>2} {lang:<5} {seconds:6.2f}s (was {program["seconds"]:.2f}s) {outcome}')
+
+    print(f'{too_slow} of {len(slow_programs)} programs took more than {transpile_budget.PRODUCTION_SECONDS} seconds')
+    return 1 if too_slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import argparse
+import json
+import time
+
+import hedy
+import hedy_content
+import transpile_budget
+
+# This file finds the programs that take the longest to transpile, and stores them as regression cases for
+# tools/benchmark-slow-programs.py and tests/test_slow_programs.py. It reads parse logs (JSON lines files with the
+# code, level and lang of every program that was run, as downloaded with tools/download-programs) or the filtered
+# public programs (a JSON list with code, level and language). Run it from the root of the repo, e.g.:
+#   PYTHONPATH=. python tools/find-slow-programs.py programs/*
+
+slow_programs_file_name = 'tools/slow-programs.json'
+
+
+def read_programs(file_name):
+    with open(file_name, 'r') as file:
+        text = file.read()
+    try:
+        records = json.loads(text)
+    except json.decoder.JSONDecodeError:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(records, dict):
+        records = [records]
+
+    for record in records:
+        code = record.get('code')
+        lang = record.get('lang', record.get('language', 'en'))
+        if code and lang in hedy_content.ALL_KEYWORD_LANGUAGES:
+            yield code, int(record['level']), lang
+
+
+def transpile_seconds(code, level, lang):
+    start = time.process_time()
+    try:
+        with transpile_budget.limit(0):
+            hedy.transpile(code, level, lang)
+    except Exception:
+        pass  # slow programs with errors are just as interesting
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Store the programs which are slowest to transpile.')
+    parser.add_argument('files', nargs='+', help='parse logs or public programs files')
+    parser.add_argument('--top', type=int, default=20, help='the number of programs to store')
+    args = parser.parse_args()
+
+    programs = {program for file_name in args.files for program in read_programs(file_name)}
+    # create the parsers first, so that creating them does not count as transpile time
+    for level, lang in {(level, lang) for _, level, lang in programs}:
+        hedy.get_parser(level, lang)
+
+    timed = [(transpile_seconds(code, level, lang), code, level, lang) for code, level, lang in programs]
+    slowest = sorted(timed, key=lambda t: t[0], reverse=True)[:args.top]
+
+    slow_programs = [{'code': code, 'level': level, 'language': lang, 'seconds': round(seconds, 3)}
+                     for seconds, code, level, lang in slowest]
+    with open(slow_programs_file_name, 'w') as file:
+        json.dump(slow_programs, file, indent=2, ensure_ascii=False)
+    print(f'Stored the {len(slow_programs)} slowest of {len(programs)} programs in {slow_programs_file_name}')
+
+
+if __name__ == '__main__':
+    main()
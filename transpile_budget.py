@@ -0,0 +1,76 @@
+"""A budget of CPU time for transpiling a single program.
+
+A short but very ambiguous program can keep the Earley parser and the analysis passes busy for seconds, which ties up
+a gunicorn worker. The budget is checked cooperatively: the parser checks it for every character it scans, and the
+tree walks of the analysis passes check it for every node. When the budget is exhausted, a
+TranspileBudgetExceededException is raised, and this is logged through querylog.
+
+The budget is set by env TRANSPILE_BUDGET_SECONDS, 0 means no budget. It is kept per thread, and a transpile which
+is started while another one is running, e.g. to check a fixed version of the program, shares its budget.
+"""
+import contextlib
+import contextvars
+import os
+import time
+
+import exceptions
+import utils
+from website import querylog
+
+# The default budget, in seconds of CPU time
+PRODUCTION_SECONDS = 5
+DEFAULT_SECONDS = PRODUCTION_SECONDS if utils.is_production() else 0
+
+_current_budget = contextvars.ContextVar('transpile_budget', default=None)
+
+
+class Budget:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = time.thread_time() + seconds
+
+    def check(self):
+        if time.thread_time() > self.deadline:
+            querylog.log_counter('transpile_budget_exceeded')
+            raise exceptions.TranspileBudgetExceededException(seconds=self.seconds)
+
+
+def get_seconds():
+    return float(os.getenv('TRANSPILE_BUDGET_SECONDS', DEFAULT_SECONDS))
+
+
+@contextlib.contextmanager
+def limit(seconds=None):
+    """Run the code in the block within a budget. If a budget is already running, that budget is used."""
+    if _current_budget.get() is not None:
+        yield
+        return
+
+    seconds = get_seconds() if seconds is None else seconds
+    token = _current_budget.set(Budget(seconds) if seconds > 0 else None)
+    try:
+        yield
+    finally:
+        _current_budget.reset(token)
+
+
+def check():
+    """Raises a TranspileBudgetExceededException if the budget of the running transpile is exhausted."""
+    budget = _current_budget.get()
+    if budget is not None:
+        budget.check()
+
+
+def budgeted(text):
+    """Returns the text as a BudgetedText if a budget is running, the text itself otherwise."""
+    return BudgetedText(text) if _current_budget.get() is not None else text
+
+
+class BudgetedText(str):
+    """A text which checks the budget whenever the next character is read. The Earley parser of Lark goes over the
+    characters of the text it parses one by one, so this stops a parse which takes too long."""
+
+    def __iter__(self):
+        for c in super().__iter__():
+            check()
+            yield c
@@ -0,0 +1,262 @@
+"""A content-addressed cache for the results of `hedy.transpile`.
+
+Many students run exactly the same program (for example the example code of an adventure), so we store the outcome
+of a transpilation under a hash of everything that determines it: the code, the level, the keyword language, the
+transpile options, the UI language of the error messages and the version of the grammars and the transpiler.
+
+Both successful results and HedyExceptions are stored, since transpilation is deterministic. The entries are kept
+in two tiers:
+
+  - an in-process LRU cache with a memory budget
+  - a directory of pickles on disk, shared by all the workers on a machine, with a budget in bytes as well
+
+The entries are stored pickled in both tiers. Every hit unpickles a fresh copy, so callers can never change the
+cached result, e.g. when error messages are translated in place.
+
+The cache is opt-in: set the environment variable ENABLE_TRANSPILE_CACHE to use it.
+"""
+import collections
+import glob
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import types
+from functools import lru_cache
+from os import path
+
+import flask_babel
+
+import exceptions
+from utils import atomic_write_file
+from website import querylog
+
+ROOT_DIR = path.abspath(path.dirname(__file__))
+
+# The default size of the in-process tier, in bytes of pickled results
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# The default size of the disk tier, in bytes of pickled results
+DEFAULT_MAX_DISK_BYTES = 256 * 1024 * 1024
+
+
+def is_enabled():
+    return os.getenv('ENABLE_TRANSPILE_CACHE', '') != ''
+
+
+@lru_cache(maxsize=None)
+def transpiler_version():
+    """A hash of all the files that influence the output of the transpiler: the grammars, the keywords, the
+    translations of the error messages, the prefixes and all the modules of this repository that the transpiler
+    uses."""
+    files = sorted(set(
+        glob.glob(path.join(ROOT_DIR, 'grammars', '*.lark')) +
+        glob.glob(path.join(ROOT_DIR, 'content', 'keywords', '*.yaml')) +
+        glob.glob(path.join(ROOT_DIR, 'translations', '*', 'LC_MESSAGES', '*.po')) +
+        # the transpiled programs call the functions of the prefixes, so they change together
+        glob.glob(path.join(ROOT_DIR, 'prefixes', '*.py')) +
+        transpiler_modules()
+    ))
+    sha = hashlib.sha1()
+    for file in files:
+        with open(file, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def transpiler_modules():
+    """The files of the modules of this repository which hedy uses, directly or through other modules.
+
+    A module is used if it is imported, or if a function or class is imported from it. Modules of installed packages
+    are left out, their versions do not change while the cache directory exists.
+    """
+    import hedy
+
+    files = set()
+    seen = set()
+    todo = [hedy]
+    while todo:
+        module = todo.pop()
+        if module.__name__ in seen:
+            continue
+        seen.add(module.__name__)
+        file = getattr(module, '__file__', None)
+        if not file or not path.abspath(file).startswith(ROOT_DIR + os.sep) or 'site-packages' in file:
+            continue
+        files.add(path.abspath(file))
+        for value in vars(module).values():
+            if isinstance(value, types.ModuleType):
+                todo.append(value)
+            elif getattr(value, '__module__', None) in sys.modules:
+                todo.append(sys.modules[value.__module__])
+    return sorted(files)
+
+
+def _current_ui_locale():
+    # Error messages and roles of variables are translated while transpiling, so the UI language is part of the key.
+    return str(flask_babel.get_locale())
+
+
+def cache_key(code, level, lang, skip_faulty, is_debug, unused_allowed, microbit):
+    skip_faulty_enabled = os.getenv('ENABLE_SKIP_FAULTY', '') != ''
+    parts = [transpiler_version(), _current_ui_locale(), str(level), lang, str(skip_faulty and skip_faulty_enabled),
+             str(is_debug), str(unused_allowed), str(microbit), code]
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+class TranspileCache:
+    """A two-tier cache of pickled transpile results. Thread-safe."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None, max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.size_bytes = 0
+        self._written_since_trim = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached entry for the key, or None if there is no such entry."""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+        if data is not None:
+            querylog.log_counter('transpile_cache_hit')
+            return pickle.loads(data)
+
+        data = self._read_from_disk(key)
+        if data is not None:
+            try:
+                entry = pickle.loads(data)
+            except Exception:
+                # A damaged file is treated as a miss and will be overwritten
+                entry = None
+            if entry is not None:
+                querylog.log_counter('transpile_cache_disk_hit')
+                self._store_in_memory(key, data)
+                return entry
+
+        querylog.log_counter('transpile_cache_miss')
+        return None
+
+    def put(self, key, entry):
+        try:
+            data = pickle.dumps(entry)
+        except Exception:
+            # Results which cannot be pickled are simply not cached
+            return
+        self._store_in_memory(key, data)
+        self._write_to_disk(key, data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def _store_in_memory(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = data
+            self.size_bytes += len(data)
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted)
+
+    def _file_for(self, key):
+        return path.join(self.directory, f'{key}.pkl')
+
+    def _read_from_disk(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._file_for(key), 'rb') as f:
+                data = f.read()
+            # The modification time of a file is the last time it was used, see trim_disk
+            os.utime(self._file_for(key))
+            return data
+        except OSError:
+            return None
+
+    def _write_to_disk(self, key, data):
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with atomic_write_file(self._file_for(key)) as f:
+                f.write(data)
+        except OSError:
+            # Another worker may be writing the same entry, which is fine
+            return
+
+        # Every worker checks the size of the directory after it has written a tenth of the budget, so the directory
+        # grows at most a tenth of the budget per worker beyond it
+        with self._lock:
+            self._written_since_trim += len(data)
+            should_trim = self._written_since_trim > self.max_disk_bytes // 10
+            if should_trim:
+                self._written_since_trim = 0
+        if should_trim:
+            self.trim_disk()
+
+    def trim_disk(self):
+        """If the files on disk take more than the budget, remove the least recently used ones until they take 90% of
+        it. Other workers may be removing the same files at the same time, which is fine."""
+        files = []
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.pkl'):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return
+
+        total_bytes = sum(size for _, size, _ in files)
+        if total_bytes <= self.max_disk_bytes:
+            return
+        for _, size, file in sorted(files):
+            if total_bytes <= self.max_disk_bytes * 9 // 10:
+                break
+            try:
+                os.unlink(file)
+            except OSError:
+                pass
+            total_bytes -= size
+
+
+TRANSPILE_CACHE = TranspileCache(
+    max_bytes=int(os.getenv('TRANSPILE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+    directory=path.join(tempfile.gettempdir(), 'hedy_transpile_cache'),
+    max_disk_bytes=int(os.getenv('TRANSPILE_CACHE_MAX_DISK_BYTES', DEFAULT_MAX_DISK_BYTES)))
+
+
+def cached_transpile(transpile_fn, code, level, lang, skip_faulty, is_debug, unused_allowed, microbit):
+    """Call transpile_fn with the given arguments, or return/raise its cached outcome."""
+    key = cache_key(code, level, lang, skip_faulty, is_debug, unused_allowed, microbit)
+    entry = TRANSPILE_CACHE.get(key)
+    if entry is not None:
+        result, error = entry
+        if error is not None:
+            raise error
+        return result
+
+    try:
+        result = transpile_fn(code, level, lang, skip_faulty=skip_faulty, is_debug=is_debug,
+                              unused_allowed=unused_allowed, microbit=microbit)
+    except exceptions.TranspileBudgetExceededException:
+        # Whether the budget runs out depends on the load of the machine, so this is not an outcome of the program
+        raise
+    except exceptions.HedyException as ex:
+        TRANSPILE_CACHE.put(key, (None, ex))
+        raise
+    TRANSPILE_CACHE.put(key, (result, None))
+    return result
@@ -1,4 +1,5 @@
 import collections
+import copy
 from difflib import SequenceMatcher
 import os
 import re
@@ -94,7 +95,8 @@ class ForTeachersModule(WebsiteModule):
         content = hedyweb.PageTranslations("workbooks").get_page_translations(g.lang)
         workbooks = content['workbooks']
         line = '_' * 30
-        workbook_for_level = workbooks['levels'][int(level)-1]
+        # the content is shared by all requests, so the exercises are annotated in a copy
+        workbook_for_level = copy.deepcopy(workbooks['levels'][int(level)-1])
 
         for exercise in workbook_for_level['exercises']:
             if exercise['type'] == 'output':
@@ -175,6 +177,8 @@ class ForTeachersModule(WebsiteModule):
 
         if not current_section:
             return utils.error_page(error=404, ui_message=gettext("page_not_found"))
+        # the content is shared by all requests, so the titles are added to a copy
+        current_section = copy.deepcopy(current_section)
 
         intro = current_section.get('intro')
 
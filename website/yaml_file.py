@@ -1,3 +1,5 @@
+import collections
+import copy
 import hashlib
 import logging
 from os import path
@@ -5,6 +7,7 @@ import os
 import pickle
 import re
 import tempfile
+import threading
 from . import querylog
 
 from ruamel import yaml
@@ -17,6 +20,98 @@ logger = logging.getLogger(__name__)
 
 YAML_FILES_CACHE = {}
 
+# The default size of the content cache, in bytes of pickled data. The data in memory takes a few times as much.
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+def _readonly(self, *args, **kwargs):
+    raise TypeError('Content loaded from a YAML file cannot be modified, make a copy first')
+
+
+class FrozenDict(dict):
+    """A dict that cannot be modified, because it is shared by all requests. Copies of it can be modified."""
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class FrozenList(list):
+    """A list that cannot be modified, because it is shared by all requests. Copies of it can be modified."""
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = clear = extend = insert = pop = remove = reverse = sort = _readonly
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(list(self), memo)
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+def freeze(data):
+    """Return a copy of the data in which all the dicts and lists are replaced by ones that cannot be modified."""
+    if isinstance(data, dict):
+        return FrozenDict((k, freeze(v)) for k, v in data.items())
+    if isinstance(data, list):
+        return FrozenList(freeze(v) for v in data)
+    return data
+
+
+class ContentCache:
+    """An LRU cache of the frozen data of YAML files, shared by all the requests of a process. Thread-safe.
+
+    Entries are stored with the content version of their file, and are only returned for that same version. The size
+    of an entry is the size of its pickled data, and the least recently used entries are dropped when the total size
+    exceeds the budget.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, filename, version):
+        """Returns the data of the file if it is cached for this version, or None otherwise."""
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(filename)
+            return entry[1]
+
+    def put(self, filename, version, data, size):
+        with self._lock:
+            old = self._entries.pop(filename, None)
+            if old is not None:
+                self.size_bytes -= old[2]
+            if size > self.max_bytes:
+                return
+            self._entries[filename] = (version, data, size)
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.size_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+
+CONTENT_CACHE = ContentCache(max_bytes=int(os.getenv('YAML_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)))
+
 
 class YamlFile:
     """Data from a YAML file, accessible as if it is a dictionary.
@@ -34,12 +129,13 @@ class YamlFile:
     files for a single language in the course of rendering the main code editor page),
     we do some caching work:
 
-    - Caches the loaded data in memory, on the Flask 'current request globals' object.
-      This means that accessing the same file twice in the same request will only load
-      it once. If we don't do this, loading YAMLs takes 2s instead of 1 because of the
-      duplicate loads.
-      - To keep the application memory footprint low, we don't cache the data
-        permanently, but drop it after the request is done.
+    - Caches the loaded data in memory for the whole process, in CONTENT_CACHE, so a file is
+      loaded at most once per worker until it changes on disk. The data is frozen, since it is
+      shared by all requests: make a copy (or use to_dict()) to get data that can be modified.
+      - The modification times of the file are checked on the first access in a request. Later
+        accesses in the same request use the Flask 'current request globals' object.
+      - To keep the application memory footprint bounded, the cache has a budget in bytes of
+        pickled data, and drops the least recently used files when it is exceeded.
     - After we have successfully loaded a YAML file, we write a pickled version
       of that YAML file to disk, so that we can load the pickled version faster in
       the future future  (loading pickled data is ~400x faster than parsing a YAML
@@ -70,16 +166,16 @@ class YamlFile:
     def to_dict(self):
         """Return the contents of the file as a plain dict, or an empty dict if the file doesn't exist.
 
-        You should generally not need to use this: this object can be used in places
-        where dicts are expected (except if the file doesn't exist, then accessing it will throw; we
-        can consider changing that behavior to always return an empty dict).
+        The dict is a copy that can be modified. You should generally not need to use this: this object
+        can be used in places where dicts are expected (except if the file doesn't exist, then accessing
+        it will throw; we can consider changing that behavior to always return an empty dict).
         """
         if self.exists():
-            return self.access()
+            return copy.deepcopy(self.access())
         return {}
 
     def access(self):
-        """Access the data from memory.
+        """Access the frozen data from memory.
 
         Load it if we haven't loaded it yet or the data on disk changed.
         """
@@ -90,10 +186,18 @@ class YamlFile:
         if cached is not None:
             return cached
 
-        data = self.load()
-
-        if not isinstance(data, dict):
-            raise RuntimeError(f"Contents of {self.filename} needs to be a dict, got: {data}")
+        version = self.content_version()
+        data = CONTENT_CACHE.get(self.filename, version)
+        if data is not None:
+            querylog.log_counter('yaml_cache_hit')
+        else:
+            data, size = self._load_with_size()
+            if not isinstance(data, dict):
+                raise RuntimeError(f"Contents of {self.filename} needs to be a dict, got: {data}")
+            data = freeze(data)
+            CONTENT_CACHE.put(self.filename, version, data, size)
+            querylog.log_counter('yaml_cache_miss')
+            querylog.log_counter('yaml_cache_bytes', size)
 
         yaml_cache[self.filename] = data
         return data
@@ -104,29 +208,38 @@ class YamlFile:
         Load from a pickle file if available, or load the original YAML
         and write a pickle file otherwise.
         """
-        yaml_ts = self._file_timestamp(self.filename)
+        return self._load_with_size()[0]
+
+    def _load_with_size(self):
+        """Load the data from disk, and return it together with the size of its pickled version."""
+        yaml_ts = [ts for ts in self.content_version() if ts]
         pickle_ts = self._file_timestamp(self.pickle_filename)
 
-        if pickle_ts and yaml_ts and pickle_ts > yaml_ts:
-            # Pickle file is newer than the YAML, just read that
-            return self.load_pickle()
+        if pickle_ts and yaml_ts and pickle_ts > max(yaml_ts):
+            # Pickle file is newer than the YAML files, just read that
+            return self._load_pickle_with_size()
 
         # Otherwise load uncached and save (atomically, since multiple processes might
         # be trying to write the pickle file in parallel)
         data = self.load_uncached()
+        pickled = pickle.dumps(data)
         try:
             os.makedirs(path.dirname(self.pickle_filename), exist_ok=True)
             with atomic_write_file(self.pickle_filename) as f:
-                pickle.dump(data, f)
+                f.write(pickled)
         except IOError as e:
             logger.warn('Error writing pickled YAML: %s', e)
 
-        return data
+        return data, len(pickled)
 
-    @querylog.timed_as('load_yaml_pickled')
     def load_pickle(self):
+        return self._load_pickle_with_size()[0]
+
+    @querylog.timed_as('load_yaml_pickled')
+    def _load_pickle_with_size(self):
         with open(self.pickle_filename, "rb") as f:
-            return pickle.load(f)
+            pickled = f.read()
+        return pickle.loads(pickled), len(pickled)
 
     @querylog.timed_as('load_yaml_uncached')
     def load_uncached(self):
@@ -172,6 +285,15 @@ class YamlFile:
             return source if source else fallback
         return fallback
 
+    def content_version(self):
+        """A value that changes whenever the data of this file changes.
+
+        These are the modification times of the file and of the English file it is merged with, so data derived
+        from this file can be kept around until this value changes, without loading the data to compare.
+        """
+        base_filename = path.join(path.dirname(self.filename), 'en.yaml')
+        return (self._file_timestamp(self.filename), self._file_timestamp(base_filename))
+
     def _file_timestamp(self, filename):
         try:
             return os.stat(filename).st_mtime